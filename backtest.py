@@ -0,0 +1,107 @@
+"""
+Vectorized backtests of daily allocations with the metrics of evaluate_Q
+
+The capital is compounded as in the Portfolio Optimization notebooks: on every day a fraction risk of the capital is
+invested according to the allocation, and the reward of an instrument is its (signed) relative change times its share
+of the invested capital. With r the allocation-weighted return of a day, the capital after day t is
+capital * prod(1 + risk * r[:t + 1]), so the whole curve is a cumulative product and every metric an array reduction:
+
+    metrics, capitals = backtest(env.signed_changes, actions[action_indices], capital, risk, env.dates)   # Q-learning policy
+    metrics, capitals = backtest(env.changes, np.full((len(env), 3), 1 / 3), capital, risk, env.dates)   # equal weight, long only
+
+Allocations may also be a (policies, days, instruments) array, in which case a dataframe with a row of metrics per policy
+and a (policies, days) array of capitals are returned.
+"""
+
+import numpy as np
+import pandas as pd
+
+def _max_consecutive(wins):
+    """
+    Function that calculates the longest run of True values along the last axis
+    Input:  wins - boolean numpy array
+    Output: numpy integer array
+    """
+    counts = np.cumsum(wins, axis=-1)
+    # the count at the last loss before every day, subtracted to restart the run
+    resets = np.maximum.accumulate(np.where(wins, 0, counts), axis=-1)
+    return (counts - resets).max(axis=-1, initial=0)
+
+def _divide(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.asarray(a, dtype=np.float64) / b
+
+def backtest(returns, allocations, capital, risk=1.0, dates=None):
+    """
+    Function that compounds the capital over allocations and calculates the metrics of evaluate_Q
+    Input:  returns - numpy array (days, instruments) of the return per unit invested, e.g. MarketEnvironment.signed_changes
+            allocations - numpy array (days, instruments) or (policies, days, instruments) with the share per instrument,
+                          a single day (1, instruments) is used for every day
+            capital - initial capital (float)
+            risk - fraction of the capital invested per day (float)
+            dates - optional array of the dates of the days, for start_date and end_date
+    Output: tuple (dict of metrics, numpy array with the capital after every day) for a single policy,
+            tuple (dataframe of metrics, numpy array (policies, days)) for several
+            raises a ValueError without days
+    """
+    allocations = np.asarray(allocations, dtype=np.float64)
+    single = allocations.ndim == 2
+    if single:
+        allocations = allocations[None]
+    returns = np.asarray(returns, dtype=np.float64)
+    days = returns.shape[0]
+    if days == 0:
+        raise ValueError("No days to backtest, e.g. a mode without days in its years")
+    allocations = np.broadcast_to(allocations, (len(allocations),) + returns.shape) # e.g. a constant (1, instruments) allocation
+    growth = 1 + risk * (returns * allocations).sum(axis=-1) # (policies, days)
+    capitals = capital * np.cumprod(growth, axis=-1)
+    before = np.concatenate([np.full((len(capitals), 1), float(capital)), capitals[:, :-1]], axis=1)
+    trade_rewards = returns * allocations * (before * risk)[..., None]
+    rewards = trade_rewards.sum(axis=-1)
+
+    path = np.concatenate([np.full((len(capitals), 1), float(capital)), capitals], axis=1)
+    peaks = np.maximum.accumulate(path, axis=1)[:, 1:]
+    valleys = np.minimum.accumulate(path, axis=1)[:, 1:]
+    win_trades = (trade_rewards > 0).sum(axis=(1, 2))
+    loss_trades = (trade_rewards < 0).sum(axis=(1, 2))
+    trades = (allocations > 0).sum(axis=(1, 2))
+    win_days = (rewards >= 0).sum(axis=1)
+    loss_days = days - win_days
+    average_win_trade = _divide(np.where(trade_rewards > 0, trade_rewards, 0).sum(axis=(1, 2)), win_trades)
+    average_loss_trade = np.abs(_divide(np.where(trade_rewards < 0, trade_rewards, 0).sum(axis=(1, 2)), loss_trades))
+    average_win_day = _divide(np.where(rewards >= 0, rewards, 0).sum(axis=1), win_days)
+    average_loss_day = np.abs(_divide(np.where(rewards < 0, rewards, 0).sum(axis=1), loss_days))
+    profit = rewards.sum(axis=1)
+
+    metrics = pd.DataFrame({
+        'start_date': dates[0] if dates is not None and len(dates) else None,
+        'end_date': dates[-1] if dates is not None and len(dates) else None,
+        'profit': profit,
+        # relative to the capital after the first day, as in evaluate_Q
+        'relative_profit': _divide(profit, capitals[:, 0]),
+        'max_drawdown': (peaks - capitals).max(axis=1, initial=0),
+        'rel_max_drawdown': _divide(peaks - capitals, peaks).max(axis=1, initial=0),
+        'max_run_up': (capitals - valleys).max(axis=1, initial=0),
+        'rel_max_run_up': _divide(capitals - valleys, valleys).max(axis=1, initial=0),
+        'trades': trades,
+        'win_trades': win_trades,
+        'loss_trades': loss_trades,
+        'relative_win_trades': _divide(win_trades, trades),
+        'days_traded': days,
+        'win_days': win_days,
+        'loss_days': loss_days,
+        'relative_win_days': _divide(win_days, days),
+        # never accumulated in evaluate_Q
+        'average_trade': 0.0,
+        'average_win_trade': average_win_trade,
+        'average_loss_trade': average_loss_trade,
+        'ratio_wl_trade': _divide(average_win_trade, average_loss_trade),
+        'average_day': 0.0,
+        'average_win_day': average_win_day,
+        'average_loss_day': average_loss_day,
+        'ratio_wl_day': _divide(average_win_day, average_loss_day),
+        'max_consecutive_wins': _max_consecutive(rewards >= 0),
+    })
+    if single:
+        return metrics.iloc[0].to_dict(), capitals[0]
+    return metrics, capitals
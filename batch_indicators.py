@@ -0,0 +1,123 @@
+"""
+Batched indicator computation for many instruments at once
+
+Takes the instrument -> OHLCV mapping of the Create Dataset notebooks (e.g. data_loader.load_files(FILES)) and a feature spec
+of feature_pipeline.py, computes every instrument in a process pool and returns one wide frame aligned on Date:
+
+    frames = load_files(FILES)
+    df = compute_indicators(frames, BASE_SPEC, specs={"SP500": FOCUS_SPEC})
+    datasets = create_datasets(frames, ["SP500", "NASDAQ", "US30"])
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from feature_pipeline import ROLES, FOCUS_SPEC, BASE_SPEC, IndicatorGraph, build_features
+from instrumentation import Collector, active_collector, instrumented
+
+def _compute_instrument(task):
+    """
+    Function that computes the features of a single instrument, executed in a worker process
+    Input:  task - tuple (varname, dataframe, list of specs, drop_prices)
+    Output: tuple (varname, list of feature dataframes indexed by Date, one per spec)
+    """
+    varname, df, specs, drop_prices = task
+    if 'Date' not in df.columns: # indexed by date, as returned by data_loader.py
+        df = df.reset_index()
+    df = df.sort_values(by='Date').reset_index(drop=True)
+    graph = IndicatorGraph(df, varname) # shared between the specs of this instrument
+    prices = [varname + ROLES[role] for role in ('close', 'open', 'high', 'low')]
+    if varname + ROLES['open'] not in df.columns: # a rate file only has a close, the rate itself is kept as feature
+        prices.remove(varname + ROLES['close'])
+    results = []
+    for spec in specs:
+        features = build_features(df, varname, spec, graph)
+        if drop_prices:
+            features = features.drop(columns=[c for c in prices if c in features.columns])
+        results.append(features.set_index('Date'))
+    return varname, results
+
+def _compute_recorded(task):
+    """
+    Function that computes the features of a single instrument in a worker process while recording its stages
+    Input:  task - tuple (memory, task of _compute_instrument), memory as in Collector
+    Output: tuple (result of _compute_instrument, records of the worker, epoch of its collector)
+    """
+    memory, task = task
+    with Collector(memory) as collector:
+        result = _compute_instrument(task)
+    return result, collector.records, collector.epoch
+
+def _map(tasks, max_workers):
+    if max_workers == 1 or len(tasks) <= 1:
+        return [_compute_instrument(task) for task in tasks]
+    collector = active_collector()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        if collector is None:
+            return list(executor.map(_compute_instrument, tasks))
+        # the stages in the workers are recorded there and merged into the collector of this process
+        results = []
+        for result, records, epoch in executor.map(_compute_recorded, [(collector.memory, task) for task in tasks]):
+            collector.merge(records, epoch)
+            results.append(result)
+        return results
+
+@instrumented('combine')
+def _combine(frames, start, end):
+    df = pd.concat(frames, axis=1, join='outer').sort_index()
+    df.index.name = 'Date'
+    df = df.reset_index()
+    if start is not None:
+        df = df[df['Date'] >= start]
+    if end is not None:
+        df = df[df['Date'] <= end]
+    return df.reset_index(drop=True)
+
+@instrumented()
+def compute_indicators(instruments, spec=BASE_SPEC, specs=None, max_workers=None, drop_prices=True, start=None, end=None):
+    """
+    Function that computes the features of many instruments in parallel and aligns them on Date
+    Input:  instruments - dict mapping varname (string) to a dataframe with the Date (column or index) and varname_Open/High/Low/Close(/Volume) columns,
+                          indicators of missing columns are skipped (e.g. all but the close of the rate files)
+            spec - feature spec (list of dicts) applied to every instrument
+            specs - optional dict mapping varname to a spec that replaces spec for that instrument
+            max_workers - number of worker processes, defaults to the number of cores, 1 computes in this process
+            drop_prices - boolean to drop the open/high/low/close columns as the Create Dataset notebooks do, the close
+                          of an instrument without an open (rate files) is kept
+            start, end - optional datetimes to which the result is limited
+    Output: dataframe with a Date column and the features of all instruments, in the order of instruments
+    """
+    specs = specs or {}
+    tasks = [(varname, df, [specs.get(varname, spec)], drop_prices) for varname, df in instruments.items()]
+    results = dict(_map(tasks, max_workers or os.cpu_count()))
+    return _combine([results[varname][0] for varname in instruments], start, end)
+
+@instrumented()
+def create_datasets(instruments, focus_list, focus_spec=FOCUS_SPEC, base_spec=BASE_SPEC, max_workers=None,
+                    start=datetime(2009, 7, 1), end=datetime(2019, 12, 31)):
+    """
+    Function that builds several combined datasets at once, as create_US_dataset does for a single focus instrument
+    Input:  instruments - dict mapping varname (string) to a dataframe with the Date (column or index) and varname_Open/High/Low/Close(/Volume) columns
+            focus_list - list of varnames (strings) to create a dataset for, e.g. ["SP500", "NASDAQ", "US30"]
+            focus_spec - feature spec of the focus instrument
+            base_spec - feature spec of the other instruments
+            max_workers - number of worker processes, defaults to the number of cores
+            start, end - datetimes to which the datasets are limited
+    Output: dict mapping every focus varname to its combined dataframe
+
+    every instrument is computed once: the base features are shared by all datasets and the focus features
+    reuse the intermediates of the base features within the same worker
+    """
+    tasks = []
+    for varname, df in instruments.items():
+        specs = [base_spec, focus_spec] if varname in focus_list else [base_spec]
+        tasks.append((varname, df, specs, True))
+    results = dict(_map(tasks, max_workers or os.cpu_count()))
+    datasets = {}
+    for focus in focus_list:
+        frames = [results[varname][1] if varname == focus else results[varname][0] for varname in instruments]
+        datasets[focus] = _combine(frames, start, end)
+    return datasets
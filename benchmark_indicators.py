@@ -0,0 +1,252 @@
+"""
+Benchmark and regression check of the calculate_* functions of technical_indicators.py and of the dataset build
+
+Every calculate_* function is run with the periods of the Create Dataset - v4 notebooks on the SP500, NASDAQ and US30
+series of Dataset v3 and on synthetic price series of increasing length, recording the best wall time of several runs
+and the peak memory allocated during a run. A scaling run repeats every windowed indicator for several window sizes.
+Every output column on the real series is compared element-wise with its reference array in benchmark_golden.npz:
+
+    python benchmark_indicators.py --check                      # compare with the golden values only
+    python benchmark_indicators.py --sizes 10000 100000 1000000 --output benchmark.csv
+    python benchmark_indicators.py --update-golden --force      # after an intended change of the outputs
+
+The reference arrays were computed with the row-by-row loops of the original technical_indicators.py, except for the
+relative strength index. Its equal-move bookkeeping was corrected when the indicators were vectorized, so its arrays
+are the output of the corrected version.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import technical_indicators as ti
+from batch_indicators import create_datasets
+from data_loader import FILES, load_csv, load_files
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_golden.npz')
+INSTRUMENTS = ['SP500', 'NASDAQ', 'US30']
+SIZES = [10000, 100000, 1000000]
+WINDOWS = [5, 50, 500]
+RTOL = 1e-9
+ATOL = 1e-12
+WEEKS = ('weeks_high', 'weeks_low') # periods in weeks of 5 trading days
+
+def _ohlc(varname):
+    return varname + "_Open", varname + "_High", varname + "_Low", varname + "_Close", varname + "_Volume"
+
+# name: (function of (df, varname, periods), periods of the notebooks or None for indicators without a period)
+INDICATORS = {
+    'daily_relative_difference': (lambda df, v, p: ti.calculate_daily_relative_difference(df, _ohlc(v)[0], _ohlc(v)[3], v), None),
+    'average_relative_difference': (lambda df, v, p: ti.calculate_average_relative_difference(df, _ohlc(v)[0], _ohlc(v)[3], p, v), [5, 10, 20, 50]),
+    'exponential_moving_average': (lambda df, v, p: ti.calculate_exponential_moving_average(df, _ohlc(v)[3], p, v), [5, 10, 20, 50]),
+    'moving_average': (lambda df, v, p: ti.calculate_moving_average(df, _ohlc(v)[3], p, v), [5, 10, 20, 50]),
+    'average_true_range': (lambda df, v, p: ti.calculate_average_true_range(df, *_ohlc(v)[:4], p, v), [5, 10, 20, 50]),
+    'weeks_high': (lambda df, v, p: ti.calculate_weeks_high(df, _ohlc(v)[1], p, v), [1, 10, 52]),
+    'weeks_low': (lambda df, v, p: ti.calculate_weeks_low(df, _ohlc(v)[2], p, v), [1, 10, 52]),
+    'relative_strength_index': (lambda df, v, p: ti.calculate_relative_strength_index(df, _ohlc(v)[0], _ohlc(v)[3], p, v), [14, 28]),
+    'stochastic_k': (lambda df, v, p: ti.calculate_stochastic_k(df, *_ohlc(v)[1:4], p, v), [5, 10, 20, 50]),
+    'stochastic_d': (lambda df, v, p: ti.calculate_stochastic_d(df, *_ohlc(v)[1:4], p, v), [5, 10, 20, 50]),
+    'momentum': (lambda df, v, p: ti.calculate_momentum(df, _ohlc(v)[3], p, v), [4, 8, 16]),
+    'williams_r': (lambda df, v, p: ti.calculate_williams_r(df, *_ohlc(v)[1:4], p, v), [5, 10, 20, 50]),
+    'ad_oscillator': (lambda df, v, p: ti.calculate_ad_oscillator(df, *_ohlc(v)[1:4], v), None),
+    'disparity': (lambda df, v, p: ti.calculate_disparity(df, _ohlc(v)[3], p, v), [5, 10, 20, 50]),
+    'bollinger_bands': (lambda df, v, p: ti.calculate_bollinger_bands(df, _ohlc(v)[3], p, v), [5, 10, 20, 50]),
+    'moving_average_convergence_divergence':
+        (lambda df, v, p: ti.calculate_moving_average_convergence_divergence(df, _ohlc(v)[3], [[q, 2 * q + 2] for q in p], v), [12]),
+    'on_balance_volume': (lambda df, v, p: ti.calculate_on_balance_volume(df, _ohlc(v)[0], _ohlc(v)[3], _ohlc(v)[4], v), None),
+    'stdev_on_balance_volume':
+        (lambda df, v, p: ti.calculate_stdev_on_balance_volume(df, _ohlc(v)[0], _ohlc(v)[3], _ohlc(v)[4], p, v), [5, 10, 20, 50]),
+}
+
+def synthetic_prices(rows, varname='SYN', seed=0):
+    """
+    Function that generates a random walk with the columns of data_loader.load_csv
+    Input:  rows - number of days (integer)
+            varname - stock/index name (string) to name the columns
+            seed - seed of the numpy Generator (integer)
+    Output: pandas dataframe with the varname_Close/Open/High/Low/Volume columns
+    """
+    rng = np.random.default_rng(seed)
+    close = 1000 * np.exp(np.cumsum(rng.normal(0.0002, 0.01, rows)))
+    open_ = np.append(1000.0, close[:-1]) * np.exp(rng.normal(0, 0.002, rows))
+    spread = np.abs(rng.normal(0, 0.005, (2, rows))) * close
+    return pd.DataFrame({
+        varname + '_Close': close,
+        varname + '_Open': open_,
+        varname + '_High': np.maximum(open_, close) + spread[0],
+        varname + '_Low': np.minimum(open_, close) - spread[1],
+        varname + '_Volume': rng.integers(10 ** 6, 10 ** 9, rows).astype(np.float64),
+    }, index=pd.RangeIndex(rows))
+
+def measure(function, repeat=3):
+    """
+    Function that measures a call
+    Input:  function - callable without arguments
+            repeat - number of timed runs (integer)
+    Output: tuple (result of the last run, best wall time in seconds, peak memory in bytes of an extra traced run)
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak
+
+def run_indicator(name, df, varname, periods=None):
+    """
+    Function that runs a calculate_* function on a copy of the price columns
+    Input:  name - key of INDICATORS (string)
+            df - pandas dataframe with the price columns of varname
+            varname - stock/index name (string)
+            periods - list of periods, defaults to those of the notebooks
+    Output: pandas dataframe with the columns added by the function
+    """
+    function, default = INDICATORS[name]
+    before = list(df.columns)
+    out = function(df.copy(), varname, default if periods is None else periods)
+    return out[[c for c in out.columns if c not in before]]
+
+def compare(outputs, golden):
+    """
+    Function that compares output columns element-wise with the golden values
+    Input:  outputs, golden - dicts mapping varname/indicator/column to a numpy array of golden_outputs
+    Output: list of strings describing the differences, empty when identical within RTOL and ATOL
+    """
+    differences = []
+    for key in sorted(set(outputs) | set(golden)):
+        if key not in golden or key not in outputs:
+            differences.append(f"{key}: {'not in golden values' if key not in golden else 'missing'}")
+            continue
+        new, old = outputs[key], golden[key]
+        if new.shape != old.shape:
+            differences.append(f"{key}: {len(new)} rows instead of {len(old)}")
+            continue
+        close = np.isclose(new, old, rtol=RTOL, atol=ATOL, equal_nan=True)
+        if not close.all():
+            rows = np.flatnonzero(~close)
+            with np.errstate(invalid='ignore'):
+                error = np.nanmax(np.abs(new[rows] - old[rows]), initial=0)
+            differences.append(f"{key}: {len(rows)} rows differ, first row {rows[0]}, max difference {error:.3g}")
+    return differences
+
+def golden_data(root='.'):
+    """
+    Function that loads the series the golden values are computed on
+    Input:  root - directory Dataset v3 is in (string)
+    Output: dict mapping varname to its price dataframe
+    """
+    return {varname: load_csv(os.path.join(root, FILES[varname]), varname) for varname in INSTRUMENTS}
+
+def golden_outputs(data):
+    """
+    Function that runs every indicator with the periods of the notebooks on the golden series
+    Input:  data - dict mapping varname to its price dataframe (golden_data)
+    Output: dict mapping varname/indicator/column to a float64 numpy array
+    """
+    outputs = {}
+    for varname, df in data.items():
+        for name in INDICATORS:
+            features = run_indicator(name, df, varname)
+            for column in features.columns:
+                outputs[f"{varname}/{name}/{column}"] = features[column].to_numpy(dtype=np.float64)
+    return outputs
+
+def load_golden(filename=GOLDEN_FILE):
+    with np.load(filename) as golden:
+        return {key: golden[key] for key in golden.files}
+
+def benchmark(data, sizes=SIZES, windows=WINDOWS, repeat=3):
+    """
+    Function that times every indicator on the real series, on synthetic series and for several window sizes
+    Input:  data - dict mapping varname to its price dataframe (golden_data)
+            sizes - numbers of rows of the synthetic series
+            windows - window sizes in days of the scaling run, applied to the synthetic series of every size
+            repeat - number of timed runs per measurement
+    Output: pandas dataframe with a row per measurement, the window is in days for the week high/low as well
+    """
+    rows = []
+    series = [(varname, df, 'real') for varname, df in data.items()]
+    series += [('SYN', synthetic_prices(size), 'synthetic') for size in sizes]
+    for varname, df, kind in series:
+        for name, (_, default) in INDICATORS.items():
+            runs = [(None, default)]
+            if default is not None and kind == 'synthetic':
+                # the windows are in days, the weeks are rounded down to the nearest whole week
+                runs += [(max(w // 5, 1) * 5, [max(w // 5, 1)]) if name in WEEKS else (w, [w]) for w in windows]
+            for window, periods in runs:
+                _, seconds, peak = measure(lambda: run_indicator(name, df, varname, periods), repeat)
+                rows.append({'series': varname, 'kind': kind, 'rows': len(df), 'indicator': name,
+                             'window': window if window is not None else 'notebook', 'seconds': seconds,
+                             'rows_per_second': len(df) / seconds if seconds else np.inf, 'peak_mb': peak / 2 ** 20})
+    return pd.DataFrame(rows)
+
+def benchmark_build(root='.', repeat=1, max_workers=None):
+    """
+    Function that times a full dataset build: loading all price files and creating the SP500, NASDAQ and US30 datasets
+    Input:  root - directory Dataset v3 is in (string)
+            repeat - number of timed runs
+            max_workers - number of worker processes of create_datasets, 1 builds in this process
+    Output: pandas dataframe with a row per stage
+
+    tracemalloc only traces this process, so the peak memory of create_datasets is only given for max_workers=1
+    """
+    files = {varname: filename for varname, filename in FILES.items() if os.path.exists(os.path.join(root, filename))}
+    instruments, load_seconds, load_peak = measure(lambda: load_files(files, root), repeat)
+    datasets, build_seconds, build_peak = measure(lambda: create_datasets(instruments, INSTRUMENTS, max_workers=max_workers), repeat)
+    rows = len(next(iter(datasets.values()))) if datasets else 0
+    return pd.DataFrame([
+        {'series': 'Dataset v3', 'kind': 'build', 'rows': rows, 'indicator': 'load_files', 'window': len(files),
+         'seconds': load_seconds, 'rows_per_second': np.nan, 'peak_mb': load_peak / 2 ** 20},
+        {'series': 'Dataset v3', 'kind': 'build', 'rows': rows, 'indicator': 'create_datasets', 'window': len(INSTRUMENTS),
+         'seconds': build_seconds, 'rows_per_second': np.nan, 'peak_mb': build_peak / 2 ** 20 if max_workers == 1 else np.nan},
+    ])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark and regression check of technical_indicators.py")
+    parser.add_argument('--root', default='.', help="directory containing Dataset v3")
+    parser.add_argument('--sizes', type=int, nargs='*', default=SIZES, help="rows of the synthetic series")
+    parser.add_argument('--windows', type=int, nargs='*', default=WINDOWS, help="window sizes of the scaling run")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per measurement")
+    parser.add_argument('--check', action='store_true', help="only compare the outputs with the golden values")
+    parser.add_argument('--update-golden', action='store_true', help="store the current outputs as the golden values")
+    parser.add_argument('--force', action='store_true', help="allow --update-golden to overwrite the golden values")
+    parser.add_argument('--skip-build', action='store_true', help="do not time the full dataset build")
+    parser.add_argument('--build-workers', type=int, help="worker processes of the dataset build, 1 also measures its peak memory")
+    parser.add_argument('--output', help="csv file for the measurements")
+    args = parser.parse_args(argv)
+
+    if args.update_golden and os.path.exists(GOLDEN_FILE) and not args.force:
+        parser.error(f"{GOLDEN_FILE} exists, add --force to overwrite the golden values with the current outputs")
+    data = golden_data(args.root)
+    outputs = golden_outputs(data)
+    if args.update_golden:
+        np.savez_compressed(GOLDEN_FILE, **outputs)
+        print(f"Stored golden values of {len(outputs)} columns in {GOLDEN_FILE}")
+        return 0
+    differences = compare(outputs, load_golden())
+    print(f"Golden values: {len(differences)} differences")
+    for difference in differences:
+        print("  " + difference)
+    if args.check:
+        return 1 if differences else 0
+
+    results = benchmark(data, args.sizes, args.windows, args.repeat)
+    if not args.skip_build:
+        results = pd.concat([results, benchmark_build(args.root, max_workers=args.build_workers)], ignore_index=True)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(results.to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+    if args.output:
+        results.to_csv(args.output, index=False)
+    return 1 if differences else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
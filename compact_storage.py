@@ -0,0 +1,208 @@
+"""
+Compact in-memory and on-disk form of the combined and reduced datasets
+
+The datasets of the notebooks are frames of float64 columns, with the row number read back as an extra column. Here the
+features are downcast to float32 where float32 reproduces the float64 values within a tolerance, and columns of whole
+numbers (volumes, counts, labels) are stored in the smallest integer type that holds them. The columns of a type are
+packed into one contiguous 2-D array, with a column index mapping every name to its block and position:
+
+    data = compact(read_dataset("Dataset v3/SP500_reduced_data_20220425.csv"))
+    data.report()                                       # bytes per block and the float32 error of every column
+    x = data.features(data.columns[1:])                 # contiguous float32 model input
+    windows = LookbackWindows(data.frame(), lookback=3)
+    data.save("Dataset v3/SP500_reduced_compact")       # .npy blocks, loaded as memory maps
+
+Columns that do not pass the precision check stay float64, so no column loses more precision than the tolerance allows.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+RTOL = 1e-6 # float32 has a relative rounding error of at most 6e-8, larger errors come from over- or underflow
+ATOL = 0.0
+_INTEGER_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+def _integer_type(values):
+    """
+    Function that finds the smallest integer type holding a column of whole numbers
+    Input:  values - float64 numpy array
+    Output: numpy integer type, or None when the column has nan, infinities or fractions
+    """
+    if not len(values) or not np.isfinite(values).all() or not (values == np.round(values)).all():
+        return None
+    low, high = values.min(), values.max()
+    for dtype in _INTEGER_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return None
+
+def float32_error(values):
+    """
+    Function that calculates how far the float32 values of a column are from the float64 values
+    Input:  values - float64 numpy array
+    Output: tuple (largest absolute error, largest error relative to the float64 value), nan positions must stay nan
+    """
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        single = values.astype(np.float32).astype(np.float64)
+        same = (single == values) | (np.isnan(single) & np.isnan(values))
+        errors = np.where(same, 0.0, np.abs(single - values))
+        relative = np.where(same, 0.0, errors / np.abs(values))
+    return float(errors.max(initial=0.0)), float(relative.max(initial=0.0))
+
+
+class CompactDataset:
+    """
+    Class that holds the columns of a dataset in one contiguous 2-D array per type, with a column index
+    """
+
+    def __init__(self, blocks, columns, index, dates=None, errors=None):
+        self.blocks = blocks        # dict mapping dtype name to a (rows, columns of the type) array
+        self.columns = list(columns)
+        self.index = index          # dict mapping column name to (dtype name, position in the block)
+        self.dates = dates or {}    # dict mapping datetime column name to its datetime64 array
+        self.errors = errors or {}  # dict mapping column name to the (absolute, relative) float32 error
+
+    def __len__(self):
+        return len(next(iter(self.blocks.values()))) if self.blocks else len(next(iter(self.dates.values()), []))
+
+    @property
+    def nbytes(self):
+        return sum(block.nbytes for block in self.blocks.values()) + sum(d.nbytes for d in self.dates.values())
+
+    def column(self, name):
+        """
+        Function that returns a column without copying
+        Input:  name - column name (string)
+        Output: numpy array, a view on its block
+        """
+        if name in self.dates:
+            return self.dates[name]
+        block, position = self.index[name]
+        return self.blocks[block][:, position]
+
+    def features(self, columns=None, dtype=np.float32):
+        """
+        Function that gathers columns into one contiguous array, e.g. as input of the models
+        Input:  columns - list of column names, defaults to all non-datetime columns
+                dtype - numpy type of the result
+        Output: numpy array (rows, columns), a view when the columns are a whole block of that type in order
+        """
+        columns = [c for c in self.columns if c not in self.dates] if columns is None else list(columns)
+        blocks = {self.index[c][0] for c in columns}
+        if len(blocks) == 1:
+            block = blocks.pop()
+            positions = [self.index[c][1] for c in columns]
+            values = self.blocks[block]
+            if np.dtype(block) == np.dtype(dtype) and positions == list(range(values.shape[1])):
+                return values
+            return np.ascontiguousarray(values[:, positions], dtype=dtype)
+        result = np.empty((len(self), len(columns)), dtype=dtype)
+        for i, c in enumerate(columns):
+            result[:, i] = self.column(c)
+        return result
+
+    def frame(self):
+        """
+        Function that converts the dataset into a dataframe in the original column order
+        Input:  None
+        Output: pandas dataframe with float32, float64, integer and datetime columns
+        """
+        parts = [pd.DataFrame(block, columns=[c for c in self.columns if c in self.index and self.index[c][0] == name], copy=False)
+                 for name, block in self.blocks.items()]
+        parts += [pd.DataFrame({name: values}) for name, values in self.dates.items()]
+        return pd.concat(parts, axis=1)[self.columns]
+
+    def report(self):
+        """
+        Function that summarizes the storage of every column
+        Input:  None
+        Output: pandas dataframe with the type, bytes and float32 errors per column
+        """
+        rows = []
+        for c in self.columns:
+            dtype = self.column(c).dtype
+            absolute, relative = self.errors.get(c, (0.0, 0.0))
+            rows.append({'column': c, 'dtype': str(dtype), 'bytes': len(self) * dtype.itemsize,
+                         'float32_abs_error': absolute, 'float32_rel_error': relative})
+        return pd.DataFrame(rows)
+
+    def save(self, path):
+        """
+        Function that stores the dataset as .npy blocks and a json column index, replacing an earlier one
+        Input:  path - directory to store the dataset in (string)
+        Output: None
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        for name, block in self.blocks.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), block)
+        for i, values in enumerate(self.dates.values()):
+            np.save(os.path.join(tmp, f'date{i}.npy'), values)
+        meta = {'columns': self.columns, 'index': self.index, 'dates': list(self.dates), 'errors': self.errors}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Function that loads a dataset stored by save
+        Input:  path - directory of the stored dataset (string)
+                mmap - boolean to memory map the blocks (read-only, no copy) instead of reading them into memory
+        Output: CompactDataset
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        mode = 'r' if mmap else None
+        index = {c: tuple(location) for c, location in meta['index'].items()}
+        blocks = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode) for name in sorted({b for b, _ in index.values()})}
+        dates = {c: np.load(os.path.join(path, f'date{i}.npy')) for i, c in enumerate(meta['dates'])}
+        return CompactDataset(blocks, meta['columns'], index, dates, {c: tuple(e) for c, e in meta['errors'].items()})
+
+
+def compact(df, rtol=RTOL, atol=ATOL, integers=True, drop_row_numbers=True):
+    """
+    Function that converts a dataset into its compact form
+    Input:  df - pandas dataframe with numeric and datetime columns, e.g. a combined or reduced dataset
+            rtol, atol - tolerance of the float32 values relative to the float64 values, columns outside it stay float64
+            integers - boolean to store columns of whole numbers as integers
+            drop_row_numbers - boolean to drop an unnamed column that only holds the row number (Unnamed: 0)
+    Output: CompactDataset
+    """
+    columns = []
+    groups = {}
+    dates = {}
+    errors = {}
+    for c in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[c]):
+            dates[c] = df[c].to_numpy()
+            columns.append(c)
+            continue
+        values = df[c].to_numpy(dtype=np.float64)
+        if drop_row_numbers and str(c).startswith('Unnamed:') and np.array_equal(values, np.arange(len(values))):
+            continue
+        dtype = _integer_type(values) if integers else None
+        if dtype is None:
+            absolute, relative = float32_error(values)
+            errors[str(c)] = (absolute, relative)
+            dtype = np.float32 if absolute <= atol or relative <= rtol else np.float64
+        groups.setdefault(np.dtype(dtype).name, []).append((str(c), values))
+        columns.append(str(c))
+    blocks = {}
+    index = {}
+    for name, group in groups.items():
+        block = np.empty((len(df), len(group)), dtype=name) # C order: the columns of a row are adjacent for batching
+        for position, (c, values) in enumerate(group):
+            block[:, position] = values
+            index[c] = (name, position)
+        blocks[name] = block
+    return CompactDataset(blocks, columns, index, dates, errors)
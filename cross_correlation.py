@@ -0,0 +1,159 @@
+"""
+Time-lagged cross-correlation of a target against many columns at many lags at once
+
+crosscorr in the Time Lagged Cross Correlation notebook computes datax.corr(datay.shift(lag)) for every column and lag:
+the Pearson correlation of x[t] and y[t - lag] over the days on which both are present. That correlation only depends
+on six sums over these days (the count, the sums of x, y, x^2 and y^2 and the sum of x * y), and every sum is a
+cross-correlation of two series in which nan is replaced by 0 and the presence is a 0/1 mask. The sums of all lags of
+all columns are computed with one matrix product per lag, or with FFTs when there are hundreds of lags:
+
+    closes = select_columns(df, suffix="_relative_change_perc_1")
+    corr = lagged_correlation(df, "SP500_relative_change_perc_1", closes, range(-10, 11))   # lags x columns
+    rs = corr[close_col].tolist()                                                           # as crosscorr per lag
+"""
+
+import numpy as np
+import pandas as pd
+
+def _prepare(values):
+    """
+    Function that splits series into the terms of the correlation sums
+    Input:  values - numpy array (days) or (days, columns)
+    Output: tuple (mask, values with nan as 0, squared values with nan as 0), all float64
+    """
+    values = np.asarray(values, dtype=np.float64)
+    mask = ~np.isnan(values)
+    zeros = np.where(mask, values, 0.0)
+    # centering does not change the correlation but keeps the sums of squares small
+    zeros -= np.where(mask, zeros.sum(axis=0) / np.maximum(mask.sum(axis=0), 1), 0.0)
+    return mask.astype(np.float64), zeros, zeros * zeros
+
+def _pearson(n, sx, sy, sxx, syy, sxy):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_x = n * sxx - sx * sx
+        var_y = n * syy - sy * sy
+        r = (n * sxy - sx * sy) / np.sqrt(var_x * var_y)
+        # rounding can leave a tiny variance for a series that is constant on the common days, pandas reports nan
+        r[(n < 2) | (var_x <= 1e-12 * n * sxx) | (var_y <= 1e-12 * n * syy)] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+def _sums_direct(x, y, lags):
+    """
+    Function that calculates the correlation sums with one matrix product per lag
+    Input:  x - tuple of _prepare of the target, arrays (days, targets)
+            y - tuple of _prepare of the columns, arrays (days, columns)
+            lags - numpy integer array
+    Output: numpy array (6, lags, targets, columns)
+    """
+    days = x[0].shape[0]
+    sums = np.zeros((6, len(lags), x[0].shape[1], y[0].shape[1]))
+    for i, lag in enumerate(lags):
+        start, stop = max(0, lag), min(days, days + lag)
+        if start >= stop:
+            continue
+        (mx, x0, x2), (my, y0, y2) = ((a[start:stop] for a in x), (a[start - lag:stop - lag] for a in y))
+        mx_t, x0_t = mx.T, x0.T
+        sums[:, i] = mx_t @ my, x0_t @ my, mx_t @ y0, x2.T @ my, mx_t @ y2, x0_t @ y0
+    return sums
+
+def _sums_fft(x, y, lags):
+    """
+    Function that calculates the correlation sums of all lags with FFTs
+    Input:  x - tuple of _prepare of the target, arrays (days, targets)
+            y - tuple of _prepare of the columns, arrays (days, columns)
+            lags - numpy integer array
+    Output: numpy array (6, lags, targets, columns)
+    """
+    days = x[0].shape[0]
+    size = 1 << int(np.ceil(np.log2(max(2 * days - 1, 1)))) # no circular overlap of positive and negative lags
+    (fmx, fx0, fx2), (fmy, fy0, fy2) = ([np.fft.rfft(a, size, axis=0) for a in terms] for terms in (x, y))
+    valid = np.abs(lags) < days
+    rows = np.where(valid, lags, 0) % size
+    sums = np.zeros((6, len(lags), x[0].shape[1], y[0].shape[1]))
+    # bound the spectra held at once to about 2^24 values, e.g. for all pairs of hundreds of columns
+    chunk = max(1, (1 << 24) // (fmx.shape[0] * y[0].shape[1]))
+    for t in range(0, x[0].shape[1], chunk):
+        block = slice(t, t + chunk)
+        for k, (a, b) in enumerate(((fmx, fmy), (fx0, fmy), (fmx, fy0), (fx2, fmy), (fmx, fy2), (fx0, fy0))):
+            # sum over t of a[t] * b[t - lag] for every lag, per pair of target and column
+            spectrum = a[:, block, None] * np.conj(b[:, None, :])
+            sums[k, :, block] = np.fft.irfft(spectrum, size, axis=0)[rows]
+    sums[:, ~valid] = 0.0
+    sums[0] = np.round(sums[0]) # the counts are integers
+    return sums
+
+def cross_correlation(x, y, lags=range(-10, 11), method='auto'):
+    """
+    Function that calculates the Pearson correlation of x[t] and y[t - lag] for every lag and pair of series,
+    over the days on which both are present as crosscorr(x, y, lag)
+    Input:  x - numpy array (days) or (days, targets)
+            y - numpy array (days) or (days, columns)
+            lags - iterable of integer lags, a positive lag correlates x with earlier values of y
+            method - 'fft', 'direct' (one matrix product per lag) or 'auto'
+    Output: numpy array (lags, columns) for a single target, (lags, targets, columns) otherwise
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    single = x.ndim == 1
+    x = x.reshape(len(x), -1)
+    y = y.reshape(len(y), -1)
+    lags = np.asarray(list(lags), dtype=np.int64)
+    if method == 'auto':
+        # the products per lag run at matrix speed, the FFTs only pay off for a single target and hundreds of lags
+        method = 'fft' if x.shape[1] == 1 and len(lags) > 20 * np.log2(max(len(x), 2)) else 'direct'
+    if method not in ('fft', 'direct'):
+        raise ValueError(f"Unknown method: {method}")
+    sums = (_sums_fft if method == 'fft' else _sums_direct)(_prepare(x), _prepare(y), lags)
+    r = _pearson(*sums)
+    return r[:, 0] if single else r
+
+def lagged_correlation(df, target, columns=None, lags=range(-10, 11), method='auto'):
+    """
+    Function that calculates the time-lagged cross-correlation of a target column against many columns
+    Input:  df - pandas dataframe
+            target - name of the target column (string)
+            columns - list of column names, defaults to all numeric columns
+            lags - iterable of integer lags
+            method - 'fft', 'direct' or 'auto'
+    Output: pandas dataframe with a row per lag and a column per column
+    """
+    if columns is None:
+        columns = df.select_dtypes('number').columns.tolist()
+    lags = list(lags)
+    r = cross_correlation(df[target].to_numpy(dtype=np.float64), df[columns].to_numpy(dtype=np.float64), lags, method)
+    return pd.DataFrame(r, index=pd.Index(lags, name='lag'), columns=columns)
+
+def all_pairs(df, columns=None, lags=range(-10, 11), method='auto'):
+    """
+    Function that calculates the time-lagged cross-correlation between every pair of columns
+    Input:  df - pandas dataframe
+            columns - list of column names, defaults to all numeric columns
+            lags - iterable of integer lags
+            method - 'fft', 'direct' or 'auto'
+    Output: numpy array (lags, columns, columns), element [l, i, j] correlates column i with column j shifted by lag l
+    """
+    if columns is None:
+        columns = df.select_dtypes('number').columns.tolist()
+    values = df[columns].to_numpy(dtype=np.float64)
+    return cross_correlation(values, values, lags, method)
+
+def select_columns(df, suffix=None, prefix=None):
+    """
+    Function that selects the columns of the notebook plots, e.g. all _relative_change_perc_1 columns or all indicators
+    of an index
+    Input:  df - pandas dataframe
+            suffix - optional end of the column names (string)
+            prefix - optional start of the column names (string)
+    Output: list of column names
+    """
+    return [c for c in df.columns if (suffix is None or c.endswith(suffix)) and (prefix is None or c.startswith(prefix))]
+
+def significant(corr, threshold=0.1):
+    """
+    Function that flags the columns whose correlation reaches the threshold at some lag, the colored traces of the plots
+    Input:  corr - dataframe or array (lags, columns) of lagged_correlation
+            threshold - absolute correlation (float)
+    Output: boolean numpy array per column
+    """
+    corr = np.abs(np.asarray(corr, dtype=np.float64))
+    return np.where(np.isnan(corr), 0.0, corr).max(axis=0) >= threshold
@@ -0,0 +1,203 @@
+"""
+Loader for the historical price files in Dataset v3
+
+Replaces the row-by-row parsing of retrieve_full_data/retrieve_data in the Create Dataset notebooks. The layout of a file
+is detected once from its header, and prices, volumes and percentages are converted column-wise:
+
+    investing   - "Date","Price","Open","High","Low"(,"Vol."),"Change %" with dates as Dec 31, 2021 and prices as 4,766.18
+    plain       - Date,Close,Open,High,Low,Vol. with ISO dates and plain numbers (invUK100, Nikkei 225), the notebooks
+                  read the Vol. column as Change% and drop it, so it is not loaded
+    fred        - DATE,<series code> with ISO dates and . for missing values (Treasury Bill Rates)
+    macrotrends - text header followed by date, value (Fed Funds Futures)
+
+Every frame has a DatetimeIndex named Date, sorted ascending, and float64 columns named varname_Close, varname_Open,
+varname_High, varname_Low and varname_Volume (if the file has volumes). Rate files only have varname_Close.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+
+FILES = {
+    # varname: filename, as in the Create Dataset - v4 notebooks
+    "SP500": "Dataset v3/Indices/S&P 500 Historical Data.csv",
+    "US30": "Dataset v3/Indices/Dow Jones Industrial Average Historical Data.csv",
+    "US2000": "Dataset v3/Indices/US Small Cap 2000 Historical Data.csv",
+    "NASDAQ": "Dataset v3/Indices/NASDAQ Composite Historical Data.csv",
+    "GER30": "Dataset v3/Indices/DAX Historical Data.csv",
+    "CAC40": "Dataset v3/Indices/CAC 40 Historical Data.csv",
+    "UK100": "Dataset v3/Indices/invUK100 Historical Data.csv",
+    "SSE50": "Dataset v3/Indices/Shanghai Composite Historical Data.csv",
+    "HS50": "Dataset v3/Indices/Hang Seng Historical Data.csv",
+    "NIKKEI225": "Dataset v3/Indices/Nikkei 225 Historical Data.csv",
+
+    "SP500_F": "Dataset v3/Index Futures/US 500 Cash Historical Data.csv",
+    "US30_F": "Dataset v3/Index Futures/US 30 Cash Historical Data.csv",
+    "US2000_F": "Dataset v3/Index Futures/Small Cap 2000 Cash Historical Data.csv",
+    "NASDAQ_F": "Dataset v3/Index Futures/US Tech 100 Cash Historical Data.csv",
+    "GER30_F": "Dataset v3/Index Futures/DAX Futures Historical Data.csv",
+    "CAC40_F": "Dataset v3/Index Futures/CAC 40 Futures Historical Data.csv",
+    "UK100_F": "Dataset v3/Index Futures/FTSE 100 Futures Historical Data.csv",
+    "SSE50_F": "Dataset v3/Index Futures/CSI 300 Futures Historical Data.csv",
+    "HS50_F": "Dataset v3/Index Futures/Hang Seng Futures Historical Data.csv",
+    "NIKKEI225_F": "Dataset v3/Index Futures/Nikkei 225 Futures Historical Data.csv",
+
+    "AAPL": "Dataset v3/Index Constituents/S&P 500/AAPL Historical Data.csv",
+    "AMZN": "Dataset v3/Index Constituents/S&P 500/AMZN Historical Data.csv",
+    "TSLA": "Dataset v3/Index Constituents/S&P 500/TSLA Historical Data.csv",
+    "FB": "Dataset v3/Index Constituents/S&P 500/FB Historical Data.csv",
+    "GOOGL": "Dataset v3/Index Constituents/S&P 500/GOOGL Historical Data.csv",
+    "GOOG": "Dataset v3/Index Constituents/S&P 500/GOOG Historical Data.csv",
+    "MSFT": "Dataset v3/Index Constituents/S&P 500/MSFT Historical Data.csv",
+
+    "BrentOil_F": "Dataset v3/Commodities/Brent Oil Futures Historical Data.csv",
+    "Copper_F": "Dataset v3/Commodities/Copper Futures Historical Data.csv",
+    "WTIOil_F": "Dataset v3/Commodities/Crude Oil WTI Futures Historical Data.csv",
+    "NaturalGas_F": "Dataset v3/Commodities/Natural Gas Futures Historical Data.csv",
+    "Corn_F": "Dataset v3/Commodities/US Corn Futures Historical Data.csv",
+    "Gold_F": "Dataset v3/Commodities/Gold Futures Historical Data.csv",
+    "Silver_F": "Dataset v3/Commodities/Silver Futures Historical Data.csv",
+
+    "AUDUSD": "Dataset v3/Forex/USD/AUD_USD Historical Data.csv",
+    "EURUSD": "Dataset v3/Forex/USD/EUR_USD Historical Data.csv",
+    "GBPUSD": "Dataset v3/Forex/USD/GBP_USD Historical Data.csv",
+    "NZDUSD": "Dataset v3/Forex/USD/NZD_USD Historical Data.csv",
+    "USDCAD": "Dataset v3/Forex/USD/USD_CAD Historical Data.csv",
+    "USDCHF": "Dataset v3/Forex/USD/USD_CHF Historical Data.csv",
+    "USDHKD": "Dataset v3/Forex/USD/USD_HKD Historical Data.csv",
+    "USDJPY": "Dataset v3/Forex/USD/USD_JPY Historical Data.csv",
+}
+
+RATE_FILES = {
+    "TBill1M": "Dataset v3/Treasury Bill Rates/1-month T-Bill.csv",
+    "TBill3M": "Dataset v3/Treasury Bill Rates/3-month T-Bill.csv",
+    "TBill6M": "Dataset v3/Treasury Bill Rates/6-month T-Bill.csv",
+    "Treasury1Y": "Dataset v3/Treasury Bill Rates/DGS1.csv",
+    "Treasury5Y": "Dataset v3/Treasury Bill Rates/DGS5.csv",
+    "Treasury10Y": "Dataset v3/Treasury Bill Rates/DGS10.csv",
+    "FedFunds_F": "Dataset v3/Fed Funds Futures/30-day-fed-funds-futures.csv",
+}
+
+LOADER_VERSION = 2 # increase when the parsing changes, invalidates dataset_cache.py entries
+_VOLUME_UNITS = {'K': 1e3, 'M': 1e6, 'B': 1e9}
+_HEADER_LINES = 32 # maximum number of lines searched for the column header
+
+def detect_schema(filename):
+    """
+    Function that detects the layout of a price file from its header
+    Input:  filename - path of the csv file (string)
+    Output: tuple (schema name, number of lines before the column header, list of column names)
+    """
+    with open(filename, encoding='utf-8-sig') as f:
+        for skip, line in zip(range(_HEADER_LINES), f):
+            columns = [c.strip().strip('"') for c in line.strip().split(',')]
+            if columns[0] == 'Date' and 'Price' in columns:
+                return 'investing', skip, columns
+            if columns[0] == 'Date' and 'Close' in columns:
+                return 'plain', skip, columns
+            if columns[0] == 'DATE' and len(columns) == 2:
+                return 'fred', skip, columns
+            if columns[0] == 'date' and len(columns) == 2:
+                return 'macrotrends', skip, columns
+    raise ValueError(f"Unknown layout of price file: {filename}")
+
+def parse_volume(volumes):
+    """
+    Function that converts volumes as 5.23K, 1.2M, 3B or - into numbers
+    Input:  volumes - pandas series of strings
+    Output: numpy float64 array, 0 for -
+    """
+    volumes = volumes.astype(str).str.strip().str.replace(',', '', regex=False)
+    units = volumes.str[-1].map(_VOLUME_UNITS).fillna(1.0).to_numpy()
+    numbers = volumes.str.rstrip('KMB').replace('-', '0')
+    return pd.to_numeric(numbers, errors='coerce').to_numpy(dtype=np.float64) * units
+
+def parse_percentage(percentages):
+    """
+    Function that converts percentages as -0.26% into numbers
+    Input:  percentages - pandas series of strings
+    Output: numpy float64 array in percent
+    """
+    numbers = percentages.astype(str).str.rstrip('%').str.replace(',', '', regex=False)
+    return pd.to_numeric(numbers, errors='coerce').to_numpy(dtype=np.float64)
+
+@instrumented(detail='varname')
+def load_csv(filename, varname, change=False):
+    """
+    Function that loads a single price file
+    Input:  filename - path of the csv file (string)
+            varname - stock/index name (string) used in the column names
+            change - boolean to add the Change % column of investing files as varname_Change (in percent)
+    Output: pandas dataframe with a DatetimeIndex named Date and float64 columns, sorted by date
+    """
+    schema, skip, columns = detect_schema(filename)
+    if schema in ('fred', 'macrotrends'):
+        df = pd.read_csv(filename, skiprows=skip, header=0, names=['Date', 'Close'], na_values=['.'],
+                         skipinitialspace=True, encoding='utf-8-sig')
+        df['Date'] = pd.to_datetime(df['Date'], format='%Y-%m-%d')
+    else:
+        df = pd.read_csv(filename, skiprows=skip, thousands=',', encoding='utf-8-sig',
+                         dtype={'Vol.': str, 'Change %': str})
+        if schema == 'plain':
+            df = df.drop(columns='Vol.', errors='ignore')
+        df = df.rename(columns={'Price': 'Close', 'Vol.': 'Volume', 'Change %': 'Change'})
+        df['Date'] = pd.to_datetime(df['Date'], format='%b %d, %Y' if schema == 'investing' else '%Y-%m-%d')
+        if 'Volume' in df.columns and not pd.api.types.is_numeric_dtype(df['Volume']):
+            df['Volume'] = parse_volume(df['Volume'])
+        if 'Change' in df.columns:
+            if change:
+                df['Change'] = parse_percentage(df['Change'])
+            else:
+                df = df.drop(columns='Change')
+    df = df.set_index('Date').sort_index().astype(np.float64)
+    df.columns = [varname + '_' + c for c in df.columns]
+    return df
+
+@instrumented()
+def load_files(files, root='.', max_workers=None, change=False):
+    """
+    Function that loads many price files in parallel threads
+    Input:  files - dict mapping varname (string) to the path of its csv file, e.g. FILES
+            root - directory the paths are relative to
+            max_workers - number of threads, defaults to the number of files
+            change - boolean to add the Change % column of investing files as varname_Change
+    Output: dict mapping varname to its dataframe, in the order of files
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or len(files) or 1) as executor:
+        futures = {varname: executor.submit(load_csv, os.path.join(root, filename), varname, change)
+                   for varname, filename in files.items()}
+        return {varname: future.result() for varname, future in futures.items()}
+
+def discover(root='Dataset v3'):
+    """
+    Function that finds all price files below a directory, including the index constituents
+    Input:  root - directory to search (string)
+    Output: dict mapping a varname derived from the filename to the path of the file, sorted by path
+    """
+    files = {}
+    for directory, _, filenames in sorted(os.walk(root)):
+        for filename in sorted(filenames):
+            if not filename.endswith('.csv'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                detect_schema(path)
+            except ValueError: # combined datasets written by the notebooks
+                continue
+            varname = filename[:-len('.csv')].replace(' Historical Data', '').replace(' ', '').replace('&', '').replace('-', '')
+            files.setdefault(varname, path) # constituents of several indices are loaded once
+    return files
+
+def load_tree(root='Dataset v3', max_workers=None, change=False):
+    """
+    Function that loads every price file below a directory in parallel threads
+    Input:  root - directory to search (string)
+            max_workers - number of threads, defaults to the number of files
+            change - boolean to add the Change % column of investing files as varname_Change
+    Output: dict mapping a varname derived from the filename to its dataframe
+    """
+    return load_files(discover(root), max_workers=max_workers, change=change)
@@ -0,0 +1,176 @@
+"""
+Binary cache in front of data_loader.py and the combined/reduced dataset csv files
+
+A parsed frame is stored as a directory with
+    values.npy - all numeric columns as one float64 array in column-major order, so every column is contiguous
+    index.npy  - the index as datetime64 or int64
+    date<i>.npy - every datetime column (e.g. Date) as datetime64
+    meta.json  - column order, index name and the key of the entry
+
+and is loaded as a memory map, which the dataframe wraps without copying. The key is a hash of the content of the source
+file, the loader and its version, so an entry is invalidated as soon as the csv file or the parsing changes:
+
+    df = read_dataset("SP500_reduced_data_20220425.csv")
+    frames = load_files(FILES)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+
+CACHE_DIR = '.dataset_cache'
+CACHE_VERSION = 1 # increase when the storage format changes
+READER_VERSION = 1 # increase when _read_dataset changes, invalidates read_dataset entries
+_HASHES = {} # (path, mtime_ns, size) -> digest of the files hashed by this process
+
+def file_hash(filename):
+    """
+    Function that hashes the content of a file
+    Input:  filename - path of the file (string)
+    Output: hexadecimal sha256 digest (string)
+
+    the digest is remembered per modification time and size, so a file is only read again after it changed
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    if key not in _HASHES:
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _HASHES[key] = digest.hexdigest()
+    return _HASHES[key]
+
+def _entry(filename, loader, params, cache_dir):
+    key = json.dumps([file_hash(filename), loader, params, CACHE_VERSION], sort_keys=True)
+    # entries that only differ in the content of the file or in the versions share the prefix, so they replace each other
+    source = json.dumps([os.path.abspath(filename), loader, {k: v for k, v in params.items() if k != 'version'}], sort_keys=True)
+    source = hashlib.sha256(source.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, source + '-' + hashlib.sha256(key.encode()).hexdigest()[:16])
+
+def save_frame(df, path):
+    """
+    Function that stores a dataframe in the cache format, the directory appears atomically
+    Input:  df - pandas dataframe with numeric and datetime columns
+            path - directory to store the frame in (string)
+    Output: None
+    """
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+    dates = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    unsupported = [c for c in df.columns if c not in numeric and c not in dates]
+    if unsupported:
+        raise ValueError(f"Columns cannot be cached: {unsupported}")
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent)
+    np.save(os.path.join(tmp, 'values.npy'), np.asfortranarray(df[numeric].to_numpy(dtype=np.float64)))
+    index = df.index.to_numpy() if isinstance(df.index, pd.DatetimeIndex) else df.index.to_numpy(dtype=np.int64)
+    np.save(os.path.join(tmp, 'index.npy'), index)
+    for i, column in enumerate(dates):
+        np.save(os.path.join(tmp, f'date{i}.npy'), df[column].to_numpy())
+    meta = {'columns': [str(c) for c in df.columns], 'numeric': [str(c) for c in numeric], 'dates': [str(c) for c in dates],
+            'index_name': df.index.name, 'version': CACHE_VERSION}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.replace(tmp, path)
+    except OSError: # stored concurrently under the same key
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def load_frame(path, mmap=True):
+    """
+    Function that loads a dataframe stored by save_frame
+    Input:  path - directory of the stored frame (string)
+            mmap - boolean to memory map the values (read-only, no copy) instead of reading them into memory
+    Output: pandas dataframe with the stored columns, index and column order
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    mode = 'r' if mmap else None
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode=mode)
+    index = np.load(os.path.join(path, 'index.npy'))
+    if index.dtype.kind == 'M':
+        index = pd.DatetimeIndex(index, name=meta['index_name'])
+    elif np.array_equal(index, np.arange(len(index))):
+        index = pd.RangeIndex(len(index), name=meta['index_name'])
+    else:
+        index = pd.Index(index, name=meta['index_name'])
+    df = pd.DataFrame(values, columns=meta['numeric'], index=index, copy=False)
+    for i, column in enumerate(meta['dates']):
+        df.insert(meta['columns'].index(column), column, np.load(os.path.join(path, f'date{i}.npy')))
+    return df
+
+def cached(filename, loader, params, load, cache_dir=CACHE_DIR, mmap=True):
+    """
+    Function that returns a parsed frame from the cache, parsing and storing it on a miss
+    Input:  filename - path of the source file (string)
+            loader - name of the parsing function (string), part of the key
+            params - json serializable dict of parameters of the parsing, part of the key, with the version of the
+                     loader as 'version'
+            load - function without arguments that parses the source file into a dataframe
+            cache_dir - directory of the cache (string)
+            mmap - boolean to memory map the cached values
+    Output: pandas dataframe
+    """
+    path = _entry(filename, loader, params, cache_dir)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        save_frame(load(), path)
+        # entries of an earlier version of the source file, the loader or the cache format are stale
+        source = os.path.basename(path).split('-')[0]
+        for name in os.listdir(cache_dir):
+            if name.startswith(source + '-') and name != os.path.basename(path):
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    return load_frame(path, mmap)
+
+def load_csv(filename, varname, change=False, cache_dir=CACHE_DIR, mmap=True):
+    """
+    Function that loads a single price file through the cache, see data_loader.load_csv
+    Input:  filename - path of the csv file (string)
+            varname - stock/index name (string) used in the column names
+            change - boolean to add the Change % column of investing files as varname_Change
+            cache_dir - directory of the cache (string)
+            mmap - boolean to memory map the cached values
+    Output: pandas dataframe with a DatetimeIndex named Date and float64 columns, sorted by date
+    """
+    params = {'varname': varname, 'change': change, 'version': data_loader.LOADER_VERSION}
+    return cached(filename, 'data_loader.load_csv', params, lambda: data_loader.load_csv(filename, varname, change),
+                  cache_dir, mmap)
+
+def load_files(files, root='.', max_workers=None, change=False, cache_dir=CACHE_DIR, mmap=True):
+    """
+    Function that loads many price files through the cache in parallel threads, see data_loader.load_files
+    Input:  files - dict mapping varname (string) to the path of its csv file, e.g. data_loader.FILES
+            root - directory the paths are relative to
+            max_workers - number of threads, defaults to the number of files
+            change - boolean to add the Change % column of investing files as varname_Change
+            cache_dir - directory of the cache (string)
+            mmap - boolean to memory map the cached values
+    Output: dict mapping varname to its dataframe, in the order of files
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or len(files) or 1) as executor:
+        futures = {varname: executor.submit(load_csv, os.path.join(root, filename), varname, change, cache_dir, mmap)
+                   for varname, filename in files.items()}
+        return {varname: future.result() for varname, future in futures.items()}
+
+def _read_dataset(filename):
+    df = pd.read_csv(filename, index_col=0)
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df
+
+def read_dataset(filename, cache_dir=CACHE_DIR, mmap=True):
+    """
+    Function that reads a combined/reduced dataset written by the notebooks through the cache
+    Input:  filename - path of the csv file (string), e.g. "Dataset v3/SP500_reduced_data_20220425.csv"
+            cache_dir - directory of the cache (string)
+            mmap - boolean to memory map the cached values
+    Output: pandas dataframe as pd.read_csv(filename, index_col=0) with a parsed Date column
+    """
+    return cached(filename, 'read_dataset', {'version': READER_VERSION}, lambda: _read_dataset(filename), cache_dir, mmap)
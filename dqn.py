@@ -0,0 +1,232 @@
+"""
+Deep Q Network training of the Portfolio Optimization - Deep Q Network notebook with minibatch experience replay
+
+The notebook predicts and fits the network once per sampled transition and predicts once per chosen action. Here the
+transitions are kept in a ring buffer of preallocated arrays and a minibatch is trained in a single call. As a state is
+one of the 2^6 direction/magnitude combinations (encoded as in q_table.py), the Q values of all states are computed in
+one forward pass after every update, so the targets of a minibatch and all greedy actions are array lookups:
+
+    actions = init_actions()
+    network = QNetwork(init_model(len(actions), 40, 80, 'relu', seed), target_update=None)
+    network, total_rewards = train(network, env.mode('train'), actions, alpha, gamma, epsilon, decay, episodes,
+                                   capital, risk, rng, batch_size=100)
+    metrics, capitals, dates = evaluate(network, env.mode('test'), actions, capital, risk)
+
+With gamma=0 (the default) the target of a transition is Q(s, a) + alpha * reward as in retrain_q_network. A positive
+gamma adds the discounted best Q value of the next day, taken from a target network when target_update is set.
+TensorFlow is imported by init_model only.
+"""
+
+import numpy as np
+
+from backtest import backtest
+from q_table import encode_states
+
+def init_model(n_actions, one=60, two=30, activation='sigmoid', seed=0, bits=6, learning_rate=0.01):
+    """
+    Function that creates the Q network of the notebook, with an embedding of the encoded state as input
+    Input:  n_actions - number of actions (integer)
+            one, two - units of the hidden layers (integers)
+            activation - activation of the hidden layers (string)
+            seed - seed of tensorflow (integer)
+            bits - number of bits of a state (integer)
+            learning_rate - learning rate of Adam (float)
+    Output: compiled keras model mapping (samples, 1) state codes to (samples, n_actions) Q values
+    """
+    import tensorflow
+    from tensorflow.keras.layers import Dense, Embedding, Input, Reshape
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.optimizers import Adam
+
+    tensorflow.random.set_seed(seed)
+    model = Sequential()
+    model.add(Input(shape=(1,), dtype='int32'))
+    model.add(Embedding(1 << bits, 20))
+    model.add(Reshape((20,)))
+    model.add(Dense(one, activation=activation))
+    model.add(Dense(two, activation=activation))
+    model.add(Dense(n_actions, activation='linear'))
+    model.compile(loss='mse', optimizer=Adam(learning_rate=learning_rate))
+    return model
+
+def _clone(model):
+    from tensorflow.keras.models import clone_model
+    target = clone_model(model)
+    target.set_weights(model.get_weights())
+    return target
+
+
+class ReplayMemory:
+    """
+    Class that stores the most recent transitions in preallocated arrays, overwriting the oldest when full
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done=False):
+        i = self.position
+        self.states[i], self.actions[i], self.rewards[i], self.next_states[i], self.dones[i] = state, action, reward, next_state, done
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size, rng):
+        """
+        Function that draws a minibatch of distinct transitions uniformly, as random.sample(store, batch_size)
+        Input:  batch_size - number of transitions (integer)
+                rng - numpy random Generator
+        Output: tuple of arrays (states, actions, rewards, next_states, dones)
+        """
+        rows = rng.choice(self.size, size=min(batch_size, self.size), replace=False)
+        return self.states[rows], self.actions[rows], self.rewards[rows], self.next_states[rows], self.dones[rows]
+
+    def clear(self):
+        self.size = 0
+        self.position = 0
+
+
+class QNetwork:
+    """
+    Class that wraps a Q network and an optional target network, caching the Q values of all states between updates
+    """
+
+    def __init__(self, model, bits=6, target_update=None):
+        self.model = model
+        self.bits = bits
+        self.target_update = target_update # number of updates between copies to the target network, None uses model
+        self.target = _clone(model) if target_update else None
+        self.updates = 0
+        self._values = None
+        self._target_values = None
+
+    def _all_states(self):
+        return np.arange(1 << self.bits, dtype=np.int32)[:, None]
+
+    def values(self):
+        """
+        Function that calculates the Q values of all states in one forward pass
+        Input:  None
+        Output: numpy array (states, actions)
+        """
+        if self._values is None:
+            self._values = np.asarray(self.model.predict_on_batch(self._all_states()), dtype=np.float64)
+        return self._values
+
+    def target_values(self):
+        if self.target is None:
+            return self.values()
+        if self._target_values is None:
+            self._target_values = np.asarray(self.target.predict_on_batch(self._all_states()), dtype=np.float64)
+        return self._target_values
+
+    def best(self, codes):
+        """
+        Function that selects the greedy action, the last of the best actions as choose_action
+        Input:  codes - encoded state (integer) or array of encoded states
+        Output: action index (integer) or numpy array of action indices
+        """
+        rows = self.values()[codes]
+        best = rows.shape[-1] - 1 - rows[..., ::-1].argmax(axis=-1)
+        return int(best) if np.ndim(best) == 0 else best
+
+    def choose(self, codes, epsilon, rng):
+        """
+        Function that selects actions epsilon-greedily for a batch of states
+        Input:  codes - array of encoded states
+                epsilon - probability of a random action (float)
+                rng - numpy random Generator
+        Output: numpy array of action indices
+        """
+        codes = np.asarray(codes)
+        n_actions = self.values().shape[1]
+        return np.where(rng.random(len(codes)) < epsilon, rng.integers(n_actions, size=len(codes)), self.best(codes))
+
+    def fit(self, states, actions, rewards, next_states, dones, alpha, gamma=0.0):
+        """
+        Function that trains the network on a minibatch of transitions in a single call
+        Input:  states, actions, rewards, next_states, dones - arrays of a minibatch (ReplayMemory.sample)
+                alpha - step towards the reward (float)
+                gamma - discount of the best Q value of the next state (float), 0 as in the notebook
+        Output: None
+        """
+        targets = self.values()[states]
+        update = rewards
+        if gamma:
+            update = rewards + gamma * np.where(dones, 0.0, self.target_values()[next_states].max(axis=1))
+        targets[np.arange(len(actions)), actions] += alpha * update
+        self.model.train_on_batch(states.astype(np.int32)[:, None], targets)
+        self._values = None
+        self.updates += 1
+        if self.target is not None and self.updates % self.target_update == 0:
+            self.target.set_weights(self.model.get_weights())
+            self._target_values = None
+
+    def save(self, filename):
+        self.model.save(filename)
+
+
+def train(network, env, actions, alpha, gamma, epsilon, decay, episodes, capital, risk, rng, batch_size=10,
+          capacity=100000, store_reset=False):
+    """
+    Function that trains a Q network on a market environment with experience replay, as run in the notebook
+    Input:  network - QNetwork
+            env - MarketEnvironment with the days to train on
+            actions - numpy array of allocations (q_table.init_actions)
+            alpha - step towards the reward (float)
+            gamma - discount of the next state (float)
+            epsilon - initial probability of a random action (float), multiplied by decay after every episode
+            decay - decay of epsilon (float)
+            episodes - number of passes over the days (integer)
+            capital - initial capital (float), compounded over all episodes as in the notebook
+            risk - fraction of the capital invested per day (float)
+            rng - numpy random Generator
+            batch_size - transitions per update (integer), updates start once the memory holds more
+            capacity - number of transitions kept in the replay memory (integer)
+            store_reset - boolean, True empties the memory after every update as in the notebook
+    Output: tuple (network, list of total reward per episode)
+    """
+    codes = encode_states(env.states)
+    next_codes = np.append(codes[1:], codes[-1:])
+    memory = ReplayMemory(capacity)
+    total_rewards = []
+    for episode in range(episodes):
+        total_reward = 0
+        explore = rng.random(len(env)) < epsilon
+        random_actions = rng.integers(len(actions), size=len(env))
+        for day in range(len(env)):
+            action_index = random_actions[day] if explore[day] else network.best(codes[day])
+            reward = env.reward(day, actions[action_index], capital, risk)
+            memory.add(codes[day], action_index, reward, next_codes[day], day == len(env) - 1)
+            if len(memory) > batch_size:
+                network.fit(*memory.sample(batch_size, rng), alpha, gamma)
+                if store_reset:
+                    memory.clear()
+            total_reward += reward
+            capital += reward
+        epsilon = epsilon * decay
+        total_rewards.append(total_reward)
+    return network, total_rewards
+
+def evaluate(network, env, actions, capital, risk):
+    """
+    Function that evaluates the greedy policy of a Q network on a market environment, as evaluate_network
+    Input:  network - QNetwork
+            env - MarketEnvironment with the days to evaluate on
+            actions - numpy array of allocations (q_table.init_actions)
+            capital - initial capital (float)
+            risk - fraction of the capital invested per day (float)
+    Output: tuple (dict of metrics, list of the capital after every day, list of dates)
+    """
+    action_indices = network.best(encode_states(env.states))
+    metrics, capitals = backtest(env.signed_changes, actions[action_indices], capital, risk, env.dates)
+    return metrics, capitals.tolist(), list(env.dates)
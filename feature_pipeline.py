@@ -0,0 +1,257 @@
+"""
+Declarative feature pipeline on top of technical_indicators.py
+
+A feature spec is a list of dicts, one per indicator, that mirrors the calculate_* calls of the Create Dataset notebooks:
+
+    spec = [
+        {'indicator': 'moving_average', 'column': 'relative_change_perc_1', 'days': [5, 10, 20, 50]},
+        {'indicator': 'stochastic_d', 'days': [5, 10, 20, 50]},
+    ]
+    df = build_features(df, "SP500", spec)
+
+Columns are referred to by role (open, high, low, close, volume), by the derived relative_change_perc_1 or by their full name.
+Every indicator is resolved into a graph of intermediate nodes (moving averages, rolling extremes, EMAs, stochastic K, OBV),
+and each node is computed exactly once per instrument, however many indicators depend on it.
+"""
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented, stage
+from rolling_windows import rolling_max, rolling_min, rolling_mean, rolling_std
+from technical_indicators import _values, _relative_difference, _exponential_moving_average, _average_true_range, \
+    _relative_strength_index, _williams_r, _ad_oscillator, \
+    _on_balance_volume, _warmup
+
+ROLES = {'open': '_Open', 'high': '_High', 'low': '_Low', 'close': '_Close', 'volume': '_Volume'}
+
+# additional features of the instrument the dataset is created for, as in retrieve_full_data
+FOCUS_SPEC = [
+    {'indicator': 'daily_relative_difference'},
+    {'indicator': 'average_relative_difference', 'days': [5, 10, 20, 50]},
+    {'indicator': 'exponential_moving_average', 'column': 'relative_change_perc_1', 'days': [5, 10, 20, 50]},
+    {'indicator': 'moving_average', 'column': 'relative_change_perc_1', 'days': [5, 10, 20, 50]},
+    {'indicator': 'weeks_high', 'weeks': [1, 10, 52]},
+    {'indicator': 'weeks_low', 'weeks': [1, 10, 52]},
+    {'indicator': 'average_true_range', 'days': [5, 10, 20, 50]},
+    {'indicator': 'relative_strength_index', 'days': [14, 28]},
+    {'indicator': 'stochastic_k', 'days': [5, 10, 20, 50]},
+    {'indicator': 'stochastic_d', 'days': [5, 10, 20, 50]},
+    {'indicator': 'momentum', 'days': [4, 8, 16]},
+    {'indicator': 'williams_r', 'days': [5, 10, 20, 50]},
+    {'indicator': 'ad_oscillator'},
+    # the moving averages above are present in the dataframe, so the batch functions divide by those
+    {'indicator': 'disparity', 'days': [5, 10, 20, 50], 'column_ma': 'relative_change_perc_1'},
+    {'indicator': 'bollinger_bands', 'days': [5, 10, 20, 50], 'column_ma': 'relative_change_perc_1'},
+    {'indicator': 'moving_average_convergence_divergence', 'days_pairs': [[12, 26]]},
+    {'indicator': 'on_balance_volume'},
+    {'indicator': 'stdev_on_balance_volume', 'days': [5, 10, 20, 50]},
+]
+
+# features of every other instrument, as in retrieve_data
+BASE_SPEC = [
+    {'indicator': 'daily_relative_difference'},
+    {'indicator': 'average_relative_difference', 'days': [5, 10, 20, 50]},
+]
+
+
+class IndicatorGraph:
+    """
+    Class that computes and memoizes the intermediate series of a single instrument
+
+    Nodes are tuples (kind, *args), where args may be other nodes, e.g. ('MA', ('column', 'SP500_Close'), 5).
+    get() computes a node after its dependencies and caches it for the rest of the run
+    """
+
+    def __init__(self, df, varname):
+        self.df = df
+        self.varname = varname
+        self.cache = {}
+        self.computed = [] # nodes in the order they were computed
+
+    def source(self, column):
+        """
+        Function that translates a column reference of the spec into a node
+        Input:  column - role (open, high, low, close, volume), relative_change_perc_1 or column name (string)
+        Output: node (tuple)
+        """
+        if column in ROLES:
+            return ('column', self.varname + ROLES[column])
+        if column == 'relative_change_perc_1':
+            return ('relative_difference',)
+        return ('column', column)
+
+    def has(self, column):
+        return self.source(column)[0] != 'column' or self.source(column)[1] in self.df.columns
+
+    def get(self, node):
+        if node not in self.cache:
+            # recorded per kind and arguments, e.g. MA (('column', 'SP500_Close'), 5), including its dependencies
+            with stage(node[0], len(self.df), str(node[1:])):
+                self.cache[node] = _NODES[node[0]](self, *node[1:])
+            self.computed.append(node)
+        return self.cache[node]
+
+    def _role(self, column):
+        return self.get(self.source(column))
+
+
+def _stochastic_k(graph, days):
+    lowest = graph.get(('min', graph.source('low'), days))
+    highest = graph.get(('max', graph.source('high'), days))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (graph._role('close') - lowest) / (highest - lowest)
+
+def _momentum(graph, days):
+    closes = graph._role('close')
+    momentums = np.full(len(closes), np.nan)
+    momentums[days:] = closes[days:] - closes[:len(closes) - days]
+    return momentums
+
+def _bollinger_band(graph, days, source_ma, sign):
+    mas = _warmup(graph.get(('MA', source_ma, days)), days)
+    if sign == 0:
+        return mas
+    return mas + sign * 2 * graph.get(('stdev', graph.source('close'), days))
+
+_NODES = {
+    'column': lambda graph, column: _values(graph.df, column),
+    'relative_difference': lambda graph: _relative_difference(graph._role('open'), graph._role('close')),
+    'MA': lambda graph, source, days: rolling_mean(graph.get(source), days),
+    'EMA': lambda graph, source, days: _exponential_moving_average(graph.get(source), days),
+    'stdev': lambda graph, source, days: rolling_std(graph.get(source), days),
+    'max': lambda graph, source, days: rolling_max(graph.get(source), days),
+    'min': lambda graph, source, days: rolling_min(graph.get(source), days),
+    'ATR': lambda graph, days: _average_true_range(graph._role('high'), graph._role('low'), graph._role('close'), days),
+    'RSI': lambda graph, days, lingering: _relative_strength_index(graph._role('open'), graph._role('close'), days, lingering),
+    'stochastic_K': _stochastic_k,
+    'stochastic_D': lambda graph, days: graph.get(('MA', ('stochastic_K', days), days)),
+    'momentum': _momentum,
+    'williams_R': lambda graph, days: _williams_r(graph._role('high'), graph._role('low'), graph._role('close'), days),
+    'AD_oscillator': lambda graph: _ad_oscillator(graph._role('high'), graph._role('low'), graph._role('close')),
+    'disparity': lambda graph, days, source_ma: _warmup(graph._role('close') / graph.get(('MA', source_ma, days)), days),
+    'MACD': lambda graph, days1, days2: _warmup(graph.get(('EMA', graph.source('close'), days1)) - graph.get(('EMA', graph.source('close'), days2)), max(days1, days2)),
+    'bollinger': _bollinger_band,
+    'OBV': lambda graph: _on_balance_volume(graph._role('open'), graph._role('close'), graph._role('volume')),
+}
+
+# price roles an indicator reads besides its column(s), indicators of missing roles are skipped (e.g. volume of
+# an index without volumes, open/high/low of the rate files that only have a close)
+_REQUIRES = {
+    'daily_relative_difference': ('open', 'close'),
+    'average_relative_difference': ('open', 'close'),
+    'exponential_moving_average': (),
+    'moving_average': (),
+    'weeks_high': (),
+    'weeks_low': (),
+    'average_true_range': ('high', 'low', 'close'),
+    'relative_strength_index': ('open', 'close'),
+    'stochastic_k': ('high', 'low', 'close'),
+    'stochastic_d': ('high', 'low', 'close'),
+    'momentum': ('close',),
+    'williams_r': ('high', 'low', 'close'),
+    'ad_oscillator': ('high', 'low', 'close'),
+    'disparity': ('close',),
+    'bollinger_bands': ('close',),
+    'moving_average_convergence_divergence': ('close',),
+    'on_balance_volume': ('open', 'close', 'volume'),
+    'stdev_on_balance_volume': ('open', 'close', 'volume'),
+}
+
+def available(item, graph):
+    """
+    Function that checks whether the columns an indicator of a spec reads are present
+    Input:  item - dict describing the indicator
+            graph - IndicatorGraph of the instrument
+    Output: boolean
+    """
+    indicator = item['indicator']
+    columns = list(_REQUIRES.get(indicator, ()))
+    if indicator == 'weeks_high':
+        columns.append(item.get('column', 'high'))
+    elif indicator == 'weeks_low':
+        columns.append(item.get('column', 'low'))
+    elif indicator in ('exponential_moving_average', 'moving_average'):
+        columns.append(item.get('column', 'close'))
+    elif indicator in ('disparity', 'bollinger_bands'):
+        columns.append(item.get('column_ma', item.get('column', 'close')))
+    if 'relative_change_perc_1' in columns:
+        columns += ['open', 'close']
+    return all(graph.has(column) for column in columns if column != 'relative_change_perc_1')
+
+def resolve(spec, graph):
+    """
+    Function that resolves a feature spec into output columns and graph nodes
+    Input:  spec - list of dicts describing the indicators
+            graph - IndicatorGraph of the instrument
+    Output: list of (column name, node) tuples in the order of the spec
+    """
+    v = graph.varname
+    outputs = []
+    for item in spec:
+        indicator = item['indicator']
+        column = graph.source(item.get('column', 'close'))
+        column_ma = graph.source(item.get('column_ma', item.get('column', 'close')))
+        if indicator in _REQUIRES and not available(item, graph):
+            continue
+        if indicator == 'daily_relative_difference':
+            outputs.append((v + '_relative_change_perc_1', ('relative_difference',)))
+        elif indicator == 'average_relative_difference':
+            outputs += [(v + '_relative_change_perc_' + str(days), ('MA', ('relative_difference',), days)) for days in item['days']]
+        elif indicator == 'exponential_moving_average':
+            outputs += [(v + '_EMA' + str(days), ('EMA', column, days)) for days in item['days']]
+        elif indicator == 'moving_average':
+            outputs += [(v + '_MA' + str(days), ('MA', column, days)) for days in item['days']]
+        elif indicator == 'weeks_high':
+            outputs += [(v + '_week_high_' + str(weeks), ('max', graph.source(item.get('column', 'high')), weeks * 5)) for weeks in item['weeks']]
+        elif indicator == 'weeks_low':
+            outputs += [(v + '_week_low_' + str(weeks), ('min', graph.source(item.get('column', 'low')), weeks * 5)) for weeks in item['weeks']]
+        elif indicator == 'average_true_range':
+            outputs += [(v + '_ATR' + str(days), ('ATR', days)) for days in item['days']]
+        elif indicator == 'relative_strength_index':
+            lingering = item.get('lingering_pseudozero', True) # False averages over the days of the window only
+            outputs += [(v + '_RSI_' + str(days), ('RSI', days, lingering)) for days in item['days']]
+        elif indicator == 'stochastic_k':
+            outputs += [(v + '_stochastic_K_' + str(days), ('stochastic_K', days)) for days in item['days']]
+        elif indicator == 'stochastic_d':
+            outputs += [(v + '_stochastic_D_' + str(days) + '_' + str(days), ('stochastic_D', days)) for days in item['days']]
+        elif indicator == 'momentum':
+            outputs += [(v + '_momentum_' + str(days), ('momentum', days)) for days in item['days']]
+        elif indicator == 'williams_r':
+            outputs += [(v + '_williams_R_' + str(days), ('williams_R', days)) for days in item['days']]
+        elif indicator == 'ad_oscillator':
+            outputs.append((v + '_AD_oscillator', ('AD_oscillator',)))
+        elif indicator == 'disparity':
+            outputs += [(v + '_disparity_' + str(days), ('disparity', days, column_ma)) for days in item['days']]
+        elif indicator == 'bollinger_bands':
+            for days in item['days']:
+                outputs.append((v + '_bollinger_high_' + str(days), ('bollinger', days, column_ma, 1)))
+                outputs.append((v + '_bollinger_middle_' + str(days), ('bollinger', days, column_ma, 0)))
+                outputs.append((v + '_bollinger_low_' + str(days), ('bollinger', days, column_ma, -1)))
+        elif indicator == 'moving_average_convergence_divergence':
+            outputs += [(v + '_AD_MACD_' + str(days1) + '_' + str(days2), ('MACD', days1, days2)) for days1, days2 in item['days_pairs']]
+        elif indicator == 'on_balance_volume':
+            outputs.append((v + '_OBV', ('OBV',)))
+        elif indicator == 'stdev_on_balance_volume':
+            outputs += [(v + '_OBV_stdev_' + str(days), ('stdev', ('OBV',), days)) for days in item['days']]
+        else:
+            raise ValueError(f"Unknown indicator in feature spec: {indicator}")
+    return outputs
+
+@instrumented(detail='varname')
+def build_features(df, varname, spec=FOCUS_SPEC, graph=None):
+    """
+    Function that adds the features of a spec to the data of a single instrument
+    Input:  df - pandas dataframe with the Date and the open/high/low/close(/volume) columns of the instrument
+            varname - stock/index name (string) used in the column names
+            spec - list of dicts describing the indicators
+            graph - optional IndicatorGraph to reuse intermediates of an earlier call on the same dataframe
+    Output: new dataframe with the original and the feature columns, with the column names of the batch functions
+    """
+    if graph is None:
+        graph = IndicatorGraph(df, varname)
+    features = {}
+    for column, node in resolve(spec, graph):
+        features[column] = graph.get(node)
+    features = pd.DataFrame(features, index=df.index)
+    return pd.concat([df.drop(columns=[c for c in features.columns if c in df.columns]), features], axis=1)
@@ -0,0 +1,257 @@
+"""
+Labels, cached SHAP values and feature subsets of the feature selection and modelling notebooks
+
+label_dir and label_mag in the notebooks loop over the relative changes of a single instrument. Here the labels of all
+instruments are computed at once as array operations, per part of a split as in the notebooks. SHAP values are stored
+per model, fold and input data, so a feature selection run only computes them once. A feature subset, such as the
+reduced datasets that Create Feature Selected Datasets writes to csv, is a list of column positions into the full
+dataset, and a new subset is a column selection:
+
+    df = read_dataset("Dataset v3/SP500_reduced_data_20220425.csv")
+    train, val, test = labels(df, ['SP500'], YearIndex(df['Date']).fold(2018, 2019))
+    values = ShapCache().get(clf, 2019, x_val, lambda x: shap_calc(clf, x))    # clf fingerprinted by model_fingerprint
+    subset = FeatureSubset(df, REDUCED_FEATURES['SP500'])     # as SP500_reduced_data, without writing a csv
+    windows = LookbackWindows(subset.frame(), lookback=3)
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from prediction_cache import model_hash
+
+CACHE_DIR = '.shap_cache'
+
+# the feature subsets of Create Feature Selected Datasets, found with the SHAP and (V)AE notebooks
+REDUCED_FEATURES = {
+    'SP500': ['Date', 'SP500_relative_change_perc_1', 'SP500_F_relative_change_perc_1', 'Gold_F_relative_change_perc_1',
+              'Silver_F_relative_change_perc_1', 'Copper_F_relative_change_perc_1', 'SP500_williams_R_5',
+              'SP500_williams_R_10', 'SP500_williams_R_20', 'SP500_williams_R_50', 'SP500_AD_MACD_12_26',
+              'SP500_stochastic_D_5_5', 'SP500_momentum_8', 'SP500_momentum_16', 'SP500_AD_oscillator',
+              'SP500_stochastic_K_5', 'SP500_stochastic_K_10', 'SP500_stochastic_K_20', 'SP500_stochastic_K_50'],
+    'US30': ['Date', 'US30_relative_change_perc_1', 'US30_F_relative_change_perc_1', 'Gold_F_relative_change_perc_1',
+             'Silver_F_relative_change_perc_1', 'Copper_F_relative_change_perc_1', 'USDHKD_relative_change_perc_1',
+             'US30_AD_oscillator', 'US30_momentum_4', 'US30_momentum_16', 'US30_stochastic_K_5', 'US30_stochastic_K_10',
+             'US30_stochastic_K_20', 'US30_stochastic_K_50', 'US30_stochastic_D_5_5', 'US30_williams_R_5',
+             'US30_williams_R_10', 'US30_williams_R_20', 'US30_williams_R_50'],
+    'NASDAQ': ['Date', 'NASDAQ_relative_change_perc_1', 'NASDAQ_F_relative_change_perc_1', 'Gold_F_relative_change_perc_1',
+               'Silver_F_relative_change_perc_1', 'Copper_F_relative_change_perc_1', 'USDHKD_relative_change_perc_1',
+               'NASDAQ_AD_oscillator', 'NASDAQ_momentum_4', 'NASDAQ_momentum_8', 'NASDAQ_stochastic_K_5',
+               'NASDAQ_stochastic_K_10', 'NASDAQ_stochastic_K_20', 'NASDAQ_stochastic_K_50', 'NASDAQ_stochastic_D_5_5',
+               'NASDAQ_williams_R_5', 'NASDAQ_williams_R_10', 'NASDAQ_williams_R_20', 'NASDAQ_williams_R_50'],
+}
+
+def label_dir(y):
+    """
+    Function that labels relative changes by direction, as label_dir
+    Input:  y - array (days) or (days, instruments) of relative changes
+    Output: numpy int8 array of the same shape, 1 for a change >= 0 and 0 otherwise
+    """
+    return (np.asarray(y, dtype=np.float64) >= 0).astype(np.int8)
+
+def label_mag(y):
+    """
+    Function that labels relative changes by magnitude, as label_mag
+    Input:  y - array (days) or (days, instruments) of relative changes
+    Output: numpy int8 array of the same shape, 1 for a change at or beyond the median of the changes with the same sign
+            and 0 otherwise
+
+    the medians are taken per instrument over the given days, nan is left out
+    """
+    y = np.asarray(y, dtype=np.float64)
+    with warnings.catch_warnings(), np.errstate(invalid='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning) # an instrument without changes of a sign has no median
+        med_pos = np.nanmedian(np.where(y >= 0, y, np.nan), axis=0)
+        med_neg = np.nanmedian(np.where(y < 0, y, np.nan), axis=0)
+        return ((y >= med_pos) | (y <= med_neg)).astype(np.int8)
+
+def labels(df, instruments, fold=None):
+    """
+    Function that labels the relative changes of several instruments by direction and magnitude
+    Input:  df - pandas dataframe with the varname_relative_change_perc_1 column of every instrument
+            instruments - list of varnames (strings), e.g. ['SP500', 'NASDAQ', 'US30']
+            fold - optional splits.Fold, the magnitude medians are then taken per part as in the notebooks
+    Output: dataframe with the varname_dir and varname_mag columns, or a tuple (train, val, test) of them with a fold
+    """
+    columns = [symbol + "_relative_change_perc_1" for symbol in instruments]
+    parts = [df] if fold is None else list(fold.take(df))
+    results = []
+    for part in parts:
+        changes = part[columns].to_numpy(dtype=np.float64)
+        directions, magnitudes = label_dir(changes), label_mag(changes)
+        result = {}
+        for i, symbol in enumerate(instruments):
+            result[symbol + "_dir"] = directions[:, i]
+            result[symbol + "_mag"] = magnitudes[:, i]
+        results.append(pd.DataFrame(result, index=part.index))
+    return results[0] if fold is None else tuple(results)
+
+def data_hash(x):
+    """
+    Function that fingerprints the columns and values of model input
+    Input:  x - pandas dataframe or numpy array
+    Output: hexadecimal sha256 digest (string)
+
+    the bytes of object values are pointers, so frames and arrays with object, string or datetime values are hashed
+    by value per row with pd.util.hash_pandas_object
+    """
+    frame = x if isinstance(x, pd.DataFrame) else None
+    values = np.asarray(x) if frame is None else None
+    if frame is None and values.dtype.kind == 'O':
+        frame = pd.DataFrame(values.reshape(len(values), -1))
+    if frame is not None:
+        header = [[str(c) for c in x.columns] if isinstance(x, pd.DataFrame) else [], list(frame.shape),
+                  [str(t) for t in frame.dtypes]]
+        digest = hashlib.sha256(json.dumps(header).encode())
+        if all(t.kind in 'biuf' for t in frame.dtypes):
+            digest.update(np.ascontiguousarray(frame.to_numpy()).tobytes())
+        else:
+            digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    digest = hashlib.sha256(json.dumps([[], list(values.shape), str(values.dtype)]).encode())
+    digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+def model_fingerprint(model):
+    """
+    Function that fingerprints a trained model in memory, e.g. the XGBoost or LightGBM classifier of the SHAP notebooks
+    Input:  model - XGBoost or LightGBM booster or classifier, or another picklable model
+    Output: hexadecimal sha256 digest (string), which changes when the model is retrained on other data or parameters
+    """
+    if hasattr(model, 'get_booster'): # XGBoost scikit-learn interface
+        model = model.get_booster()
+    if hasattr(model, 'booster_'): # LightGBM scikit-learn interface
+        model = model.booster_
+    if hasattr(model, 'save_raw'):
+        data = bytes(model.save_raw())
+    elif hasattr(model, 'model_to_string'):
+        data = model.model_to_string().encode()
+    else:
+        data = pickle.dumps(model)
+    return hashlib.sha256(data).hexdigest()
+
+
+class ShapCache:
+    """
+    Class that stores SHAP values on disk per model, fold and input data
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path(self, model_key, fold, x):
+        """
+        Function that returns the file of the SHAP values of a model on an input
+        Input:  model_key - saved model directory, whose content is hashed, a model in memory, which is fingerprinted with
+                            model_fingerprint, or a string naming the model, which is used as is and so has to change
+                            when the model is retrained
+                fold - name of the fold (e.g. the test year)
+                x - pandas dataframe or numpy array the SHAP values are computed on
+        Output: path of the .npy file (string)
+        """
+        if isinstance(model_key, (str, os.PathLike)):
+            model = model_hash(model_key) if os.path.exists(model_key) else str(model_key)
+        else:
+            model = model_fingerprint(model_key)
+        key = json.dumps([model, str(fold), data_hash(x)])
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest()[:32] + '.npy')
+
+    def get(self, model_key, fold, x, compute):
+        """
+        Function that returns the SHAP values of a model on an input, computing and storing them on a miss
+        Input:  model_key - saved model directory, model in memory or string naming the model, see path
+                fold - name of the fold (e.g. the test year)
+                x - pandas dataframe or numpy array the SHAP values are computed on
+                compute - function of x returning the SHAP values (rows, features), e.g. lambda x: shap_calc(clf, x)
+        Output: pandas dataframe with the SHAP values, with the columns of x
+        """
+        path = self.path(model_key, fold, x)
+        if os.path.exists(path):
+            values = np.load(path)
+        else:
+            values = np.asarray(compute(x), dtype=np.float64)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.npy')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, values)
+            os.replace(tmp, path)
+        columns = x.columns if isinstance(x, pd.DataFrame) else None
+        return pd.DataFrame(values, columns=columns, index=x.index if isinstance(x, pd.DataFrame) else None)
+
+def importance(shap_values):
+    """
+    Function that ranks features by their mean absolute SHAP value, as calculate_shap_importance
+    Input:  shap_values - dataframe of ShapCache.get, or several of them (e.g. per fold) in a list
+    Output: pandas series with the mean absolute SHAP value per feature, largest first
+    """
+    if isinstance(shap_values, (list, tuple)):
+        shap_values = pd.concat(shap_values)
+    return shap_values.abs().mean().sort_values(ascending=False)
+
+
+class FeatureSubset:
+    """
+    Class that holds a subset of the columns of a full dataset as column positions, without copying the data
+    """
+
+    def __init__(self, df, columns):
+        missing = [c for c in columns if c not in df.columns]
+        if missing:
+            raise KeyError(f"Columns not in the dataset: {missing}")
+        self.df = df
+        self.columns = list(columns)
+        self.positions = df.columns.get_indexer(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def frame(self):
+        """
+        Function that materializes the subset as a dataframe, e.g. for create_classification_data or LookbackWindows
+        Input:  None
+        Output: pandas dataframe with the columns of the subset in order
+        """
+        return self.df.iloc[:, self.positions]
+
+    def values(self, dtype=np.float32):
+        """
+        Function that gathers the numeric columns of the subset into one contiguous array
+        Input:  dtype - numpy type of the result
+        Output: numpy array (rows, numeric columns of the subset)
+        """
+        numeric = [c for c in self.columns if pd.api.types.is_numeric_dtype(self.df[c])]
+        return np.ascontiguousarray(self.df[numeric].to_numpy(dtype=dtype))
+
+    def extend(self, columns):
+        """
+        Function that adds columns to the subset
+        Input:  columns - list of column names of the full dataset
+        Output: FeatureSubset with the new columns appended, columns already in the subset are kept once
+        """
+        return FeatureSubset(self.df, self.columns + [c for c in columns if c not in self.columns])
+
+    def without(self, columns):
+        """
+        Function that removes columns from the subset
+        Input:  columns - list of column names
+        Output: FeatureSubset without the given columns
+        """
+        return FeatureSubset(self.df, [c for c in self.columns if c not in columns])
+
+def top_features(df, ranking, n, keep=('Date',)):
+    """
+    Function that selects the best ranked features of a full dataset
+    Input:  df - pandas dataframe of the full dataset
+            ranking - series of importance, or a list of column names from best to worst
+            n - number of features (integer)
+            keep - columns always included first, e.g. Date and the target column
+    Output: FeatureSubset
+    """
+    names = list(ranking.index if isinstance(ranking, pd.Series) else ranking)
+    return FeatureSubset(df, list(keep) + [c for c in names if c not in keep][:n])
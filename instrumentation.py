@@ -0,0 +1,185 @@
+"""
+Opt-in timing and memory instrumentation of the dataset build
+
+Functions decorated with instrumented and blocks wrapped in stage are recorded only while a Collector is active, so the
+instrumentation costs a single check per call otherwise. A record holds the wall time, the rows of the input and,
+with memory=True, the peak of the memory allocated during the call as traced by tracemalloc (which slows down
+the instrumented code considerably):
+
+    with Collector(memory=True) as collector:
+        instruments = load_files(FILES)
+        with stage("remove holidays"):
+            ...
+    print(collector.summary())                  # a row per stage and detail: calls, time, rows, peak memory
+    collector.to_json("build_trace.json")       # trace events for chrome://tracing or Perfetto
+
+Stages may be nested, the time of a stage includes its children. Calls in other threads are recorded as well. The peak
+of tracemalloc is global to the process, so the memory is only recorded for the outermost stages of the main thread,
+whose peak includes their children and the threads they start; nested stages and stages of other threads record no
+peak. Calls in worker processes are recorded by a collector in the worker, whose
+records are merged into the collector of the parent (as batch_indicators does for the instruments).
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+_ACTIVE = [] # active collectors, the innermost records
+_LOCAL = threading.local()
+
+def active_collector():
+    """
+    Function that returns the collector that records the stages of this process
+    Input:  None
+    Output: innermost active Collector, or None when instrumentation is off
+    """
+    return _ACTIVE[-1] if _ACTIVE else None
+
+def _rows(value):
+    shape = getattr(value, 'shape', None) # dataframes, series and arrays
+    return int(shape[0]) if shape else None
+
+
+class Collector:
+    """
+    Class that collects the records of the instrumented stages while it is active
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.origin = time.perf_counter()
+        self.epoch = time.time() # wall clock at the origin, aligns the records of other processes
+        _ACTIVE.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _ACTIVE.remove(self)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def merge(self, records, epoch):
+        """
+        Function that adds the records of a collector of another process
+        Input:  records - list of record dicts of the other collector
+                epoch - wall clock time (float) at the origin of the other collector
+        Output: None
+        """
+        for record in records:
+            self.add(dict(record, start=record['start'] + epoch - self.epoch))
+
+    def summary(self):
+        """
+        Function that aggregates the records per stage and detail
+        Input:  None
+        Output: pandas dataframe with the calls, total/mean/max seconds, rows, rows per second and peak memory per stage,
+                sorted by total time
+        """
+        columns = ['stage', 'detail', 'calls', 'seconds', 'mean_seconds', 'max_seconds', 'rows', 'rows_per_second', 'peak_mb']
+        if not self.records:
+            return pd.DataFrame(columns=columns)
+        df = pd.DataFrame(self.records)
+        df['detail'] = df['detail'].fillna('')
+        summary = df.groupby(['stage', 'detail'], sort=False).agg(
+            calls=('seconds', 'size'), seconds=('seconds', 'sum'), mean_seconds=('seconds', 'mean'),
+            max_seconds=('seconds', 'max'), rows=('rows', lambda rows: rows.sum(min_count=1)),
+            peak_bytes=('peak_bytes', 'max')).reset_index()
+        summary['rows_per_second'] = summary['rows'] / summary['seconds']
+        summary['peak_mb'] = summary['peak_bytes'] / 2 ** 20
+        return summary[columns].sort_values('seconds', ascending=False, ignore_index=True)
+
+    def to_json(self, filename=None):
+        """
+        Function that exports the records as trace events of the Chrome trace format
+        Input:  filename - optional path of the json file (string)
+        Output: dict with the traceEvents
+        """
+        events = [{'name': r['stage'] if not r['detail'] else f"{r['stage']} {r['detail']}", 'ph': 'X', 'pid': r['process'],
+                   'tid': r['thread'], 'ts': r['start'] * 1e6, 'dur': r['seconds'] * 1e6,
+                   'args': {'rows': r['rows'], 'peak_bytes': r['peak_bytes'], 'depth': r['depth']}}
+                  for r in self.records]
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if filename is not None:
+            with open(filename, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+
+@contextmanager
+def stage(name, rows=None, detail=None):
+    """
+    Function that records a block of code as a stage of the active collector
+    Input:  name - name of the stage (string)
+            rows - optional number of rows processed (integer)
+            detail - optional description of the parameters, e.g. the days of an indicator (string)
+    Output: context manager yielding the record, whose rows may be set within the block (None without a collector)
+    """
+    if not _ACTIVE:
+        yield None
+        return
+    collector = _ACTIVE[-1]
+    stack = getattr(_LOCAL, 'stack', None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+    # resetting the peak of tracemalloc would hide the peak of an enclosing or concurrent stage
+    tracing = collector.memory and tracemalloc.is_tracing() and not stack and threading.current_thread() is threading.main_thread()
+    if tracing:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+    stack.append(name)
+    record = {'stage': name, 'detail': detail, 'rows': rows}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        peak = tracemalloc.get_traced_memory()[1] - current if tracing else None
+        record.update({'start': start - collector.origin, 'seconds': seconds, 'peak_bytes': peak, 'depth': len(stack),
+                       'process': os.getpid(), 'thread': threading.get_ident()})
+        collector.add(record)
+
+def instrumented(name=None, detail=None):
+    """
+    Function that creates a decorator recording every call of a function as a stage
+    Input:  name - name of the stage (string), defaults to the name of the function
+            detail - optional name of an argument whose value is recorded as the detail, e.g. 'days_list'
+    Output: decorator; the rows are those of the first argument, or of the result when it is not a frame or array
+    """
+    def decorator(function):
+        signature = inspect.signature(function) if detail is not None else None
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _ACTIVE:
+                return function(*args, **kwargs)
+            value = None
+            if signature is not None:
+                value = signature.bind_partial(*args, **kwargs).arguments.get(detail)
+            with stage(name or function.__name__, _rows(args[0]) if args else None, None if value is None else str(value)) as record:
+                result = function(*args, **kwargs)
+                if record is not None and record['rows'] is None:
+                    record['rows'] = _rows(result) # e.g. a frame loaded from a file
+            return result
+        return wrapper
+    return decorator
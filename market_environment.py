@@ -0,0 +1,144 @@
+"""
+Market data of the Q-Learning notebooks as arrays on a shared day index
+
+predict and get_reward in the notebooks look up every instrument in its dataframe with x[x['Date'] == date] for every
+day of every episode. MarketEnvironment does these lookups once: the predictions and relative changes of all instruments
+are aligned to the dates of the first instrument, after which a state or a reward is an array index:
+
+    env = MarketEnvironment.from_frames(instruments, data, models=models).mode('train')
+    state = env.state(day)                              # [dir SP500, mag SP500, dir NASDAQ, mag NASDAQ, ...]
+    reward = env.reward(day, action, capital, risk)
+"""
+
+import numpy as np
+import pandas as pd
+
+def predict_raw(x, model, column, batch_size=1024):
+    """
+    Function that runs a model over all rows of a lookback frame in large batches
+    Input:  x - pandas dataframe of create_classification_data with Date, the target column and the features
+            model - keras model with the input shape (samples, 1, features)
+            column - target column (string)
+            batch_size - number of rows per forward pass (integer)
+    Output: numpy float32 array with the output of every row, as stored in pred by predict_init of the DQN notebook
+    """
+    features = x.drop(['Date', column], axis=1).to_numpy(dtype=np.float32)
+    features = features.reshape((features.shape[0], 1, features.shape[1]))
+    return np.asarray(model.predict(features, batch_size=batch_size, verbose=0), dtype=np.float32).reshape(len(x), -1)[:, 0]
+
+def predict_frame(x, model, column, batch_size=1024):
+    """
+    Function that predicts all rows of a lookback frame at once, as predict_individual does per date
+    Input:  x - pandas dataframe of create_classification_data with Date, the target column and the features
+            model - keras model with the input shape (samples, 1, features)
+            column - target column (string)
+            batch_size - number of rows per forward pass (integer)
+    Output: numpy int8 array with the rounded prediction of every row
+    """
+    return predict_raw(x, model, column, batch_size).round().astype(np.int8)
+
+class MarketEnvironment:
+    """
+    Class that holds the predictions and relative changes of several instruments on a shared day index
+
+    As in the notebooks, an instrument without data on a day has a prediction of 0 and a reward of 0 on that day
+    """
+    _arrays = ('dates', 'pred_dir', 'pred_mag', 'changes')
+
+    def __init__(self, instruments, dates, pred_dir, pred_mag, changes):
+        self.instruments = list(instruments)
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.pred_dir = np.asarray(pred_dir, dtype=np.int8) # (days, instruments)
+        self.pred_mag = np.asarray(pred_mag, dtype=np.int8)
+        self.changes = np.asarray(changes, dtype=np.float64)
+        # state as in predict: direction and magnitude per instrument
+        self.states = np.empty((len(self.dates), 2 * len(self.instruments)), dtype=np.int8)
+        self.states[:, 0::2] = self.pred_dir
+        self.states[:, 1::2] = self.pred_mag
+        # relative change signed by whether the predicted direction was right, as in get_individual_reward
+        directions = np.where(self.pred_dir == 0, -1, 1)
+        self.signed_changes = np.where(np.sign(self.changes) == directions, np.abs(self.changes), -np.abs(self.changes))
+
+    def __len__(self):
+        return len(self.dates)
+
+    @staticmethod
+    def from_frames(instruments, data, predictions=None, models=None):
+        """
+        Function that aligns the dataframes of the notebooks to the dates of the first instrument
+        Input:  instruments - list of varnames (strings), e.g. ['SP500', 'NASDAQ', 'US30']
+                data - dict mapping varname_dir and varname_mag to lookback frames with the Date and varname_relative_change_perc_1 columns
+                predictions - optional dict mapping the same keys to arrays with the prediction of every row of the frame
+                models - optional dict mapping the same keys to keras models, used for the keys missing from predictions
+                (frames with a pred column, as in Q-Learning 3, need neither)
+        Output: MarketEnvironment
+        """
+        predictions = dict(predictions or {})
+        dates = pd.DatetimeIndex(data[instruments[0] + "_dir"]['Date'])
+        shape = (len(dates), len(instruments))
+        pred_dir, pred_mag, changes = np.zeros(shape, np.int8), np.zeros(shape, np.int8), np.zeros(shape)
+        for i, symbol in enumerate(instruments):
+            column = symbol + "_relative_change_perc_1"
+            for key, target in ((symbol + "_dir", pred_dir), (symbol + "_mag", pred_mag)):
+                x = data[key]
+                if key not in predictions:
+                    predictions[key] = x['pred'].to_numpy() if 'pred' in x.columns else predict_frame(x, models[key], column)
+                rows = dates.get_indexer(pd.DatetimeIndex(x['Date']))
+                found = rows >= 0
+                target[rows[found], i] = np.asarray(predictions[key])[found]
+                if key == symbol + "_dir":
+                    changes[rows[found], i] = x[column].to_numpy()[found]
+        return MarketEnvironment(instruments, dates, pred_dir, pred_mag, changes)
+
+    def select(self, mask):
+        """
+        Function that restricts the environment to a subset of days
+        Input:  mask - boolean array or array of day indices
+        Output: MarketEnvironment
+        """
+        return MarketEnvironment(self.instruments, self.dates[mask], self.pred_dir[mask], self.pred_mag[mask], self.changes[mask])
+
+    def mode(self, mode, year_val=2018, year_test=2019):
+        """
+        Function that selects the days of a mode, as extract_data
+        Input:  mode - 'train' (before year_val), 'val' (year_val), 'test' (year_test) or 'full'
+                year_val, year_test - years (integers)
+        Output: MarketEnvironment
+        """
+        years = pd.DatetimeIndex(self.dates).year
+        masks = {'train': years < year_val, 'val': years == year_val, 'test': years == year_test, 'full': np.ones(len(self), bool)}
+        if mode not in masks:
+            raise ValueError(f"Unknown mode: {mode}")
+        return self.select(masks[mode])
+
+    def state(self, day):
+        return self.states[day]
+
+    def trade_rewards(self, day, action, capital, risk):
+        """
+        Function that calculates the reward of every instrument on a day
+        Input:  day - day index (integer)
+                action - allocation per instrument (list or numpy array summing to 1)
+                capital - capital before the day (float)
+                risk - fraction of the capital invested per day (float)
+        Output: numpy array with the reward per instrument
+        """
+        return self.signed_changes[day] * np.asarray(action) * (capital * risk)
+
+    def reward(self, day, action, capital, risk):
+        """
+        Function that calculates the reward of a day, as get_reward
+        Input:  day - day index (integer)
+                action - allocation per instrument (list or numpy array summing to 1)
+                capital - capital before the day (float)
+                risk - fraction of the capital invested per day (float)
+        Output: reward (float)
+        """
+        return float(self.trade_rewards(day, action, capital, risk).sum())
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self._arrays}
+
+    @staticmethod
+    def from_arrays(instruments, arrays):
+        return MarketEnvironment(instruments, *(arrays[name] for name in MarketEnvironment._arrays))
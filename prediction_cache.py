@@ -0,0 +1,150 @@
+"""
+On-disk cache of the predictions of the direction/magnitude models of the Q-Learning, DQN and Plots notebooks
+
+predict_init in the notebooks runs every model with a batch size of 1 over the whole dataset each time a notebook starts.
+Here a model runs once per dataset in large batches and its raw outputs are stored as a float32 .npy file, keyed by a
+hash of the files of the model directory and a fingerprint of the dates, columns and values of the frame, so a changed
+model or a changed dataset is predicted again while all notebooks share the same entries. Storing the predictions of a
+changed model removes the entries of its earlier versions:
+
+    data = predict_init(data, "Models/SP500_NN_up-down_model_shap_l3", "SP500_relative_change_perc_1")
+    predictions = predict_all(data, MODEL_DIRS)
+    env = MarketEnvironment.from_frames(instruments, data, predictions=predictions)
+
+TensorFlow is only imported when a model has to be run.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from market_environment import predict_raw
+
+CACHE_DIR = '.prediction_cache'
+CACHE_VERSION = 1 # increase when the storage format or predict_raw changes
+
+# model directories per key of the data dict, as in init_models_data
+MODEL_DIRS = {
+    'SP500_dir': "Models/SP500_NN_up-down_model_shap_l3",
+    'SP500_mag': "Models/SP500_NN_large-small_model_shap_l3",
+    'NASDAQ_dir': "Models/NASDAQ_NN_up-down_model_shap_l3",
+    'NASDAQ_mag': "Models/NASDAQ_NN_large-small_model_shap_l3",
+    'US30_dir': "Models/US30_NN_up-down_model_shap_l3",
+    'US30_mag': "Models/US30_NN_large-small_model_shap_l3",
+}
+
+_HASHES = {} # (path, (name, mtime_ns, size) of every file) -> digest of the models hashed by this process
+
+def model_hash(model_dir):
+    """
+    Function that hashes the content of a saved model
+    Input:  model_dir - path of a saved model directory or file (string)
+    Output: hexadecimal sha256 digest (string)
+
+    the digest is remembered per modification time and size of the files, so a model is only read again after it changed
+    """
+    if os.path.isfile(model_dir):
+        files = [model_dir]
+    else:
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(model_dir) for name in names)
+    stats = [os.stat(filename) for filename in files]
+    key = (os.path.abspath(model_dir), tuple((os.path.relpath(filename, model_dir), stat.st_mtime_ns, stat.st_size)
+                                             for filename, stat in zip(files, stats)))
+    if key not in _HASHES:
+        digest = hashlib.sha256()
+        for filename in files:
+            digest.update(os.path.relpath(filename, model_dir).encode())
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        _HASHES[key] = digest.hexdigest()
+    return _HASHES[key]
+
+def frame_hash(x, column):
+    """
+    Function that fingerprints the model inputs of a lookback frame
+    Input:  x - pandas dataframe of create_classification_data with Date, the target column and the features
+            column - target column (string), not part of the model inputs
+    Output: hexadecimal sha256 digest (string)
+    """
+    features = x.drop(['Date', column], axis=1)
+    digest = hashlib.sha256(json.dumps([str(c) for c in features.columns]).encode())
+    digest.update(x['Date'].to_numpy(dtype='datetime64[ns]').tobytes())
+    digest.update(np.ascontiguousarray(features.to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+def _entry(model_dir, x, column, cache_dir):
+    # source-model-frame.npy, the entries of a model path share the source and those of one version of it the model part
+    source = hashlib.sha256(os.path.abspath(model_dir).encode()).hexdigest()[:16]
+    model = hashlib.sha256(json.dumps([model_hash(model_dir), CACHE_VERSION]).encode()).hexdigest()[:16]
+    frame = hashlib.sha256(frame_hash(x, column).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, '-'.join([source, model, frame]) + '.npy')
+
+def _load_model(model_dir):
+    import tensorflow.keras as tf
+    return tf.models.load_model(model_dir)
+
+def predict_cached(x, model_dir, column, cache_dir=CACHE_DIR, batch_size=1024, raw=False, model=None):
+    """
+    Function that predicts all rows of a lookback frame, reading the predictions from the cache when possible
+    Input:  x - pandas dataframe of create_classification_data with Date, the target column and the features
+            model_dir - path of the saved model (string), part of the key
+            column - target column (string)
+            cache_dir - directory of the cache (string)
+            batch_size - number of rows per forward pass on a cache miss (integer)
+            raw - boolean, True returns the outputs of the model instead of the rounded predictions
+            model - optional keras model already loaded from model_dir
+    Output: numpy array with the prediction of every row, int8 or float32 if raw
+    """
+    x = x.drop(columns=['pred'], errors='ignore') # added by an earlier predict_init
+    path = _entry(model_dir, x, column, cache_dir)
+    if os.path.exists(path):
+        outputs = np.load(path)
+    else:
+        outputs = predict_raw(x, model if model is not None else _load_model(model_dir), column, batch_size)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, outputs)
+        os.replace(tmp, path)
+        # entries of an earlier version of the model or of the cache format are stale
+        source, model = os.path.basename(path).split('-')[:2]
+        for name in os.listdir(cache_dir):
+            if name.startswith(source + '-') and name.split('-')[1] != model:
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except OSError: # removed concurrently
+                    pass
+    return outputs if raw else outputs.round().astype(np.int8)
+
+def predict_init(data, model_dir, column, cache_dir=CACHE_DIR, batch_size=1024, raw=False):
+    """
+    Function that adds the predictions of a model as the pred column, as predict_init in the notebooks
+    Input:  data - pandas dataframe of create_classification_data
+            model_dir - path of the saved model (string)
+            column - target column (string)
+            cache_dir - directory of the cache (string)
+            batch_size - number of rows per forward pass on a cache miss (integer)
+            raw - boolean, True stores the outputs of the model as in the DQN notebook instead of the rounded predictions
+    Output: pandas dataframe
+    """
+    data['pred'] = predict_cached(data, model_dir, column, cache_dir, batch_size, raw)
+    return data
+
+def predict_all(data, model_dirs=MODEL_DIRS, cache_dir=CACHE_DIR, batch_size=1024):
+    """
+    Function that predicts the frames of all direction/magnitude models
+    Input:  data - dict mapping varname_dir and varname_mag to lookback frames
+            model_dirs - dict mapping the same keys to saved model paths
+            cache_dir - directory of the cache (string)
+            batch_size - number of rows per forward pass on a cache miss (integer)
+    Output: dict mapping the keys to int8 arrays, for MarketEnvironment.from_frames
+    """
+    predictions = {}
+    for key, model_dir in model_dirs.items():
+        column = key.rsplit('_', 1)[0] + "_relative_change_perc_1"
+        predictions[key] = predict_cached(data[key], model_dir, column, cache_dir, batch_size)
+    return predictions
@@ -0,0 +1,185 @@
+"""
+Tabular Q-learning of the Portfolio Optimization notebooks on a NumPy array
+
+The notebooks key Q by repr([i0, ..., i5]) strings and scan a shuffled list of action indices for the maximum.
+QTable keeps Q as a (states x actions) array, with the direction/magnitude bits of a state encoded as an integer in the
+order of init_Q (i0 is the most significant bit), so a lookup is an index and action selection is array arithmetic:
+
+    actions = init_actions(0.05)
+    table = QTable(len(actions))
+    table, total_rewards, mean_diffs = train(table, env, actions, alpha, epsilon, decay, episodes, capital, risk, rng)
+    table.save("Models/Q/Q.npy")
+
+Ties between the best actions are broken uniformly at random as in choose_action. Random numbers are drawn from a
+numpy Generator, so runs are reproducible per seed but do not reproduce the random module streams of the notebooks.
+"""
+
+import itertools
+import math
+import os
+
+import numpy as np
+
+from backtest import backtest
+
+def init_actions(granularity=0.2, instruments=3):
+    """
+    Function that lists the possible allocations of the capital over the instruments
+    Input:  granularity - step of the allocation per instrument (float), 1 / granularity must be an integer
+            instruments - number of instruments (integer)
+    Output: numpy array (actions, instruments) with every allocation summing to 1, in the order of the notebooks
+
+    the notebooks round the allocations to one decimal and compare sums of floats with 1, which drops or duplicates
+    allocations for granularities below 0.2; here the allocations are enumerated as integer steps instead
+    """
+    steps = int(round(1 / granularity))
+    decimals = max(int(math.ceil(-math.log10(granularity))), 1) + 1
+    grid = [c for c in itertools.product(range(steps + 1), repeat=instruments) if sum(c) == steps]
+    return np.round(np.array(grid, dtype=np.float64) / steps, decimals)
+
+def encode_states(states):
+    """
+    Function that encodes states of bits as integers, in the order of the keys of init_Q
+    Input:  states - array (bits) or (samples, bits) of 0/1 predictions
+    Output: integer or numpy array of integers
+    """
+    states = np.asarray(states, dtype=np.int64)
+    weights = 1 << np.arange(states.shape[-1] - 1, -1, -1)
+    return states @ weights
+
+def decode_state(code, bits=6):
+    return [(int(code) >> (bits - 1 - i)) & 1 for i in range(bits)]
+
+
+class QTable:
+    """
+    Class that holds the Q values of all states and actions in a 2-D array
+    """
+
+    def __init__(self, n_actions, bits=6, values=None):
+        self.bits = bits
+        self.values = np.zeros((1 << bits, n_actions)) if values is None else np.asarray(values, dtype=np.float64)
+
+    @property
+    def n_actions(self):
+        return self.values.shape[1]
+
+    def best(self, codes, rng):
+        """
+        Function that selects the action with the largest Q value, breaking ties at random
+        Input:  codes - encoded state (integer) or array of encoded states
+                rng - numpy random Generator
+        Output: action index (integer) or numpy array of action indices
+        """
+        rows = self.values[codes]
+        if rows.ndim == 1:
+            ties = np.flatnonzero(rows == rows.max())
+            return int(ties[rng.integers(len(ties))]) if len(ties) > 1 else int(ties[0])
+        # a random key per tied action, the largest key wins
+        keys = np.where(rows == rows.max(axis=1, keepdims=True), rng.random(rows.shape), -1.0)
+        return keys.argmax(axis=1)
+
+    def choose(self, codes, epsilon, rng, epsilon_greedy=True):
+        """
+        Function that selects actions epsilon-greedily, as choose_action
+        Input:  codes - encoded state (integer) or array of encoded states
+                epsilon - probability of a random action (float)
+                rng - numpy random Generator
+                epsilon_greedy - boolean, False always selects the best action
+        Output: action index (integer) or numpy array of action indices
+        """
+        if not epsilon_greedy:
+            return self.best(codes, rng)
+        if np.ndim(codes) == 0:
+            return int(rng.integers(self.n_actions)) if rng.random() < epsilon else self.best(codes, rng)
+        codes = np.asarray(codes)
+        explore = rng.random(len(codes)) < epsilon
+        return np.where(explore, rng.integers(self.n_actions, size=len(codes)), self.best(codes, rng))
+
+    def save(self, filename):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        np.save(filename, self.values)
+
+    @staticmethod
+    def load(filename):
+        values = np.load(filename)
+        return QTable(values.shape[1], int(math.log2(values.shape[0])), values)
+
+    def to_dict(self):
+        """
+        Function that converts the table into the dict of init_Q, e.g. for the visualize_Q plots
+        Input:  None
+        Output: dict mapping repr([i0, ..., i5]) to the list of Q values
+        """
+        return {repr(decode_state(code, self.bits)): self.values[code].tolist() for code in range(len(self.values))}
+
+    @staticmethod
+    def from_dict(Q):
+        """
+        Function that converts a dict of init_Q, e.g. from the pickles in Models/Q, into a table
+        Input:  Q - dict mapping state strings to lists of Q values
+        Output: QTable
+        """
+        bits = len(next(iter(Q)).strip('[]').split(','))
+        table = QTable(len(next(iter(Q.values()))), bits)
+        for key, values in Q.items():
+            state = [int(float(bit.split('(')[-1].rstrip(')'))) for bit in key.strip('[]').split(',')]
+            table.values[encode_states(state)] = values
+        return table
+
+
+def train(table, env, actions, alpha, epsilon, decay, episodes, capital, risk, rng, save_dir=None):
+    """
+    Function that trains a Q table on a market environment, as run in the notebooks
+    Input:  table - QTable
+            env - MarketEnvironment with the days to train on
+            actions - numpy array of allocations (init_actions)
+            alpha - learning rate (float)
+            epsilon - initial probability of a random action (float), multiplied by decay after every episode
+            decay - decay of epsilon (float)
+            episodes - number of passes over the days (integer)
+            capital - initial capital (float), compounded over all episodes as in the notebooks
+            risk - fraction of the capital invested per day (float)
+            rng - numpy random Generator
+            save_dir - optional directory to store the table after every episode as Q<episode>.npy
+    Output: tuple (table, list of total reward per episode, list of mean absolute Q update per episode)
+    """
+    codes = encode_states(env.states)
+    total_rewards = []
+    mean_diffs = []
+    for episode in range(episodes):
+        total_reward = 0
+        diffs = np.empty(len(env))
+        # draw the random numbers of the episode at once; the greedy choices depend on the updates
+        explore = rng.random(len(env)) < epsilon
+        random_actions = rng.integers(table.n_actions, size=len(env))
+        for day in range(len(env)):
+            state = codes[day]
+            action_index = random_actions[day] if explore[day] else table.best(state, rng)
+            reward = env.reward(day, actions[action_index], capital, risk)
+            q_old = table.values[state, action_index]
+            table.values[state, action_index] += alpha * reward
+            diffs[day] = abs(table.values[state, action_index] - q_old)
+            total_reward += reward
+            capital += reward
+        if save_dir is not None:
+            table.save(os.path.join(save_dir, f"Q{episode}.npy"))
+        epsilon = epsilon * decay
+        mean_diffs.append(diffs.mean() if len(diffs) else 0.0)
+        total_rewards.append(total_reward)
+    return table, total_rewards, mean_diffs
+
+def evaluate(table, env, actions, capital, risk, rng):
+    """
+    Function that evaluates the greedy policy of a Q table on a market environment, as evaluate_Q in the notebooks
+    Input:  table - QTable
+            env - MarketEnvironment with the days to evaluate on
+            actions - numpy array of allocations (init_actions)
+            capital - initial capital (float)
+            risk - fraction of the capital invested per day (float)
+            rng - numpy random Generator, used to break ties between the best actions
+    Output: tuple (dict of metrics, list of the capital after every day, list of dates)
+    """
+    action_indices = table.best(encode_states(env.states), rng) # the greedy policy does not change during evaluation
+    metrics, capitals = backtest(env.signed_changes, actions[action_indices], capital, risk, env.dates)
+    return metrics, capitals.tolist(), list(env.dates)
@@ -0,0 +1,289 @@
+"""
+Rolling-window primitives shared by technical_indicators.py and streaming_indicators.py
+
+The array functions compute a value for every window in O(n), independent of the window size: the series is split
+into blocks of the window size, and every window is covered by the suffix of one block and the prefix of the next
+(van Herk/Gil-Werman), and the standard deviation sums the deviations from a shift per block in the same way.
+The classes update a single window in O(1) amortized time for streaming use: a monotonic deque for the extremes and
+a running sum with the sum of squared deviations for the moments.
+
+As in the batch functions, the value of an incomplete window or of a window containing nan is nan.
+"""
+
+import math
+import warnings
+from collections import deque
+
+import numpy as np
+
+_IDENTITY = {np.maximum: -np.inf, np.minimum: np.inf, np.add: 0.0}
+
+def _blockwise(values, window, ufunc):
+    """
+    Function that reduces every window of a series with a ufunc using block prefixes and suffixes
+    Input:  values - numpy array of values
+            window - size of the window (integer)
+            ufunc - np.maximum, np.minimum or np.add
+    Output: numpy array with the reduced windows, nan during the first window - 1 rows
+    """
+    n = len(values)
+    result = np.full(n, np.nan)
+    if n < window:
+        return result
+    n_blocks = -(-n // window)
+    padded = np.full(n_blocks * window, _IDENTITY[ufunc])
+    padded[:n] = values
+    blocks = padded.reshape(n_blocks, window)
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    start = np.arange(n - window + 1)
+    end = start + window - 1
+    reduced = ufunc(suffix[start], prefix[end])
+    # a window that starts on a block boundary is exactly one block
+    aligned = start % window == 0
+    reduced[aligned] = prefix[end[aligned]]
+    result[window - 1:] = reduced
+    return result
+
+def rolling_max(values, window):
+    """
+    Function that calculates the maximum over every window of a series
+    Input:  values - numpy array of values
+            window - size of the window (integer)
+    Output: numpy array with the maximum, nan during the first window - 1 rows
+    """
+    return _blockwise(np.asarray(values, dtype=np.float64), window, np.maximum)
+
+def rolling_min(values, window):
+    """
+    Function that calculates the minimum over every window of a series
+    Input:  values - numpy array of values
+            window - size of the window (integer)
+    Output: numpy array with the minimum, nan during the first window - 1 rows
+    """
+    return _blockwise(np.asarray(values, dtype=np.float64), window, np.minimum)
+
+def rolling_sum(values, window):
+    """
+    Function that calculates the sum over every window of a series
+    Input:  values - numpy array of values
+            window - size of the window (integer)
+    Output: numpy array with the sum, nan during the first window - 1 rows
+
+    every sum spans at most two partial blocks, so the rounding error does not grow with the length of the series
+    """
+    return _blockwise(np.asarray(values, dtype=np.float64), window, np.add)
+
+def rolling_mean(values, window):
+    """
+    Function that calculates the mean over every window of a series
+    Input:  values - numpy array of values
+            window - size of the window (integer)
+    Output: numpy array with the mean, nan during the first window - 1 rows
+    """
+    return rolling_sum(values, window) / window
+
+def rolling_std(values, window):
+    """
+    Function that calculates the sample standard deviation over every window of a series
+    Input:  values - numpy array of values
+            window - size of the window (integer)
+    Output: numpy array with the standard deviation, nan during the first window - 1 rows
+
+    computed from sums of deviations rather than from the sum of squares, as the latter loses precision
+    for series with a large level relative to their variance (e.g. the OBV). Every window lies within two
+    consecutive blocks, so the deviations are taken from the mean of the first block, which is close to the
+    level of the window, and the sums are block suffixes and prefixes as in the other array functions
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    stdevs = np.full(n, np.nan)
+    if n < window or window < 2:
+        return stdevs
+    n_blocks = -(-n // window)
+    padded = np.full((n_blocks + 1) * window, np.nan)
+    padded[:n] = values
+    blocks = padded.reshape(n_blocks + 1, window)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # blocks of only nan
+        shifts = np.nan_to_num(np.nanmean(blocks, axis=1))[:, None]
+    own = blocks - shifts                   # block b around its own shift
+    following = blocks[1:] - shifts[:-1]    # block b + 1 around the shift of block b
+    own_prefix = np.cumsum(own, axis=1).ravel()
+    own_prefix2 = np.cumsum(own * own, axis=1).ravel()
+    own_suffix = np.cumsum(own[:, ::-1], axis=1)[:, ::-1].ravel()
+    own_suffix2 = np.cumsum((own * own)[:, ::-1], axis=1)[:, ::-1].ravel()
+    next_prefix = np.cumsum(following, axis=1).ravel()
+    next_prefix2 = np.cumsum(following * following, axis=1).ravel()
+    start = np.arange(n - window + 1)
+    end = start + window - 1
+    aligned = start % window == 0 # a window that starts on a block boundary is exactly one block
+    # the prefix of block b + 1 around the shift of block b is stored in row b
+    sums = np.where(aligned, own_prefix[end], own_suffix[start] + next_prefix[np.maximum(end - window, 0)])
+    squares = np.where(aligned, own_prefix2[end], own_suffix2[start] + next_prefix2[np.maximum(end - window, 0)])
+    deviations = squares - sums * sums / window
+    # the subtraction cancels when the window varies little around its distance to the shift, those rare
+    # windows (e.g. a flat stretch of a trending series) are recomputed with two passes
+    unstable = np.flatnonzero(deviations < 1e-4 * squares)
+    if len(unstable):
+        windows = np.lib.stride_tricks.sliding_window_view(values, window)
+        for i in range(0, len(unstable), 65536): # bounds the temporary memory
+            rows = unstable[i:i + 65536]
+            selected = windows[rows]
+            deviations[rows] = ((selected - selected.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+    stdevs[window - 1:] = np.sqrt(np.maximum(deviations, 0.0) / (window - 1))
+    return stdevs
+
+
+class RollingWindow:
+    """
+    Class that holds the state of a single rolling window
+
+    Subclasses list their constructor argument and mutable state in _fields, which is all that is required for to_dict/from_dict
+    """
+    _fields = ()
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+
+    @property
+    def full(self):
+        return self.count >= self.window
+
+    def push(self, value):
+        raise NotImplementedError
+
+    def to_dict(self):
+        state = {'window': self.window, 'count': self.count}
+        for name in self._fields:
+            value = getattr(self, name)
+            state[name] = list(value) if isinstance(value, deque) else value
+        return {'type': type(self).__name__, 'state': state}
+
+    @staticmethod
+    def from_dict(data):
+        cls = {'RollingMax': RollingMax, 'RollingMin': RollingMin, 'RollingSum': RollingSum}[data['type']]
+        window = cls(data['state']['window'])
+        for name, value in data['state'].items():
+            setattr(window, name, deque(value) if isinstance(getattr(window, name), deque) else value)
+        return window
+
+
+class RollingMax(RollingWindow):
+    """
+    Class that keeps the maximum of a rolling window with a monotonic deque of (position, value) pairs
+    """
+    _fields = ('candidates', 'last_nan')
+    _keep = staticmethod(lambda kept, value: kept > value)
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.candidates = deque()
+        self.last_nan = -math.inf # position of the most recent nan
+
+    def push(self, value):
+        """
+        Function that adds a value to the window and drops the oldest one
+        Input:  value - new value (float)
+        Output: extreme of the window, nan if the window is incomplete or contains nan
+        """
+        position = self.count
+        self.count += 1
+        if math.isnan(value):
+            self.last_nan = position
+        else:
+            while self.candidates and not self._keep(self.candidates[-1][1], value):
+                self.candidates.pop()
+            self.candidates.append((position, value))
+        while self.candidates and self.candidates[0][0] <= position - self.window:
+            self.candidates.popleft()
+        if not self.full or self.last_nan > position - self.window:
+            return math.nan
+        return self.candidates[0][1]
+
+
+class RollingMin(RollingMax):
+    """
+    Class that keeps the minimum of a rolling window with a monotonic deque of (position, value) pairs
+    """
+    _keep = staticmethod(lambda kept, value: kept < value)
+
+
+class RollingSum(RollingWindow):
+    """
+    Class that keeps the sum, mean and variance of a rolling window
+
+    The variance is kept as the sum of squared deviations from the mean, updated when a value enters or leaves
+    the window (Welford), which does not suffer from the cancellation of a raw sum of squares. The rounding errors
+    of these updates are discarded by recomputing both from the window once every window pushes, amortized O(1)
+    """
+    _fields = ('vals', 'n', 'mean_', 'm2', 'nans')
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.vals = deque()
+        self.n = 0 # number of values in the window that are not nan
+        self.mean_ = 0.0
+        self.m2 = 0.0
+        self.nans = 0
+
+    def _add(self, value):
+        if math.isnan(value):
+            self.nans += 1
+            return
+        self.n += 1
+        delta = value - self.mean_
+        self.mean_ += delta / self.n
+        self.m2 += delta * (value - self.mean_)
+
+    def _remove(self, value):
+        if math.isnan(value):
+            self.nans -= 1
+            return
+        self.n -= 1
+        if self.n == 0:
+            self.mean_ = 0.0
+            self.m2 = 0.0
+            return
+        delta = value - self.mean_
+        self.mean_ -= delta / self.n
+        self.m2 = max(self.m2 - delta * (value - self.mean_), 0.0)
+
+    def push(self, value):
+        """
+        Function that adds a value to the window and drops the oldest one
+        Input:  value - new value (float)
+        Output: sum of the window, nan if the window is incomplete or contains nan
+        """
+        self.count += 1
+        if len(self.vals) == self.window:
+            self._remove(self.vals.popleft())
+        self.vals.append(value)
+        if self.count % self.window == 0:
+            self._recompute()
+        else:
+            self._add(value)
+        return self.sum()
+
+    def _recompute(self):
+        finite = [x for x in self.vals if not math.isnan(x)]
+        self.n = len(finite)
+        self.nans = len(self.vals) - self.n
+        self.mean_ = sum(finite) / self.n if self.n else 0.0
+        self.m2 = sum((x - self.mean_) ** 2 for x in finite)
+
+    def _valid(self):
+        return self.full and self.nans == 0
+
+    def sum(self):
+        return self.mean_ * self.n if self._valid() else math.nan
+
+    def mean(self):
+        return self.mean_ if self._valid() else math.nan
+
+    def var(self):
+        return self.m2 / (self.n - 1) if self._valid() and self.n > 1 else math.nan
+
+    def std(self):
+        return math.sqrt(self.var())
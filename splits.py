@@ -0,0 +1,150 @@
+"""
+Train/validation/test splits by year on a sorted date index, as slices
+
+create_train, create_val and create_test in the notebooks convert the Date column and filter it by year on every call,
+for every instrument and every frame. On a sorted date index every year is a contiguous range of rows, so the row
+boundaries of all years are found once with a binary search and every split is a slice. Slicing a numpy array, a
+dataframe (iloc) or a MarketEnvironment with them returns views, and a Fold is a few integers, cheap to send to
+worker processes:
+
+    years = YearIndex(data['SP500_dir']['Date'])
+    fold = years.fold(2018, 2019)                                   # train < 2018, val 2018, test 2019 as extract_data
+    x_train, x_val, x_test = fold.take(data['SP500_dir'])
+    for fold in years.walk_forward(2012, 2022, train_years=None):   # expanding, or rolling with train_years=5
+        ...
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+class Fold:
+    """
+    Class that holds the row ranges of the train, validation and test part of a split
+    """
+    parts = ('train', 'val', 'test')
+
+    def __init__(self, train, val, test, name=None):
+        self.train = train # slices of rows
+        self.val = val
+        self.test = test
+        self.name = name
+
+    def __repr__(self):
+        ranges = ', '.join(f"{part}=[{getattr(self, part).start}:{getattr(self, part).stop}]" for part in self.parts)
+        return f"Fold({self.name!r}, {ranges})"
+
+    @property
+    def full(self):
+        return slice(self.train.start, self.test.stop)
+
+    def rows(self, mode):
+        """
+        Function that returns the rows of a part, as the modes of extract_data
+        Input:  mode - 'train', 'val', 'test' or 'full' (string)
+        Output: slice
+        """
+        if mode not in self.parts + ('full',):
+            raise ValueError(f"Unknown mode: {mode}")
+        return getattr(self, mode)
+
+    def select(self, data, mode):
+        """
+        Function that selects the rows of a part without copying
+        Input:  data - pandas dataframe or series (by position), numpy array or MarketEnvironment
+                mode - 'train', 'val', 'test' or 'full' (string)
+        Output: view of data of the same type
+        """
+        rows = self.rows(mode)
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            return data.iloc[rows]
+        if hasattr(data, 'select'):
+            return data.select(rows)
+        return data[rows]
+
+    def take(self, data):
+        """
+        Function that selects the train, validation and test rows without copying
+        Input:  data - pandas dataframe or series, numpy array or MarketEnvironment
+        Output: tuple (train, val, test) of views of data
+        """
+        return tuple(self.select(data, part) for part in self.parts)
+
+
+class YearIndex:
+    """
+    Class that holds the first and last row of every year of a sorted date index
+    """
+
+    def __init__(self, dates):
+        dates = pd.DatetimeIndex(dates)
+        if not dates.is_monotonic_increasing:
+            raise ValueError("Dates must be sorted")
+        self.dates = dates
+        self.years = np.unique(dates.year)
+        starts = np.searchsorted(dates.asi8, pd.DatetimeIndex([f"{year}-01-01" for year in self.years]).as_unit(dates.unit).asi8)
+        self.bounds = {int(year): (int(start), int(stop)) for year, start, stop in
+                       zip(self.years, starts, np.append(starts[1:], len(dates)))}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def rows(self, first_year, last_year):
+        """
+        Function that returns the rows of a range of years
+        Input:  first_year, last_year - years (integers), inclusive; years without data are empty
+        Output: slice
+        """
+        start = np.searchsorted(self.years, first_year)
+        stop = np.searchsorted(self.years, last_year, side='right')
+        if start >= stop:
+            row = self.bounds[int(self.years[start])][0] if start < len(self.years) else len(self.dates)
+            return slice(row, row)
+        return slice(self.bounds[int(self.years[start])][0], self.bounds[int(self.years[stop - 1])][1])
+
+    def fold(self, year_val, year_test, first_year=None, val_years=1, test_years=1):
+        """
+        Function that splits the years as create_train, create_val and create_test
+        Input:  year_val - first validation year (integer)
+                year_test - first test year (integer)
+                first_year - first training year (integer), defaults to the first year of the data
+                val_years, test_years - number of validation and test years (integers)
+        Output: Fold
+        """
+        first_year = self.years[0] if first_year is None else first_year
+        return Fold(self.rows(first_year, year_val - 1), self.rows(year_val, year_val + val_years - 1),
+                    self.rows(year_test, year_test + test_years - 1), name=year_test)
+
+    def walk_forward(self, first_test=2012, last_test=2022, train_years=None, val_years=1, test_years=1, step=1):
+        """
+        Function that lists walk-forward folds, every fold is tested on the years after its validation years
+        Input:  first_test, last_test - first test years of the first and the last fold (integers)
+                train_years - number of training years of a rolling window (integer), None expands from the first year
+                val_years, test_years - number of validation and test years (integers)
+                step - number of years between folds (integer)
+        Output: list of Fold, named by their first test year, folds without training or test rows are left out
+        """
+        folds = []
+        for year_test in range(first_test, last_test + 1, step):
+            year_val = year_test - val_years
+            first_year = None if train_years is None else year_val - train_years
+            fold = self.fold(year_val, year_test, first_year, val_years, test_years)
+            if fold.train.stop > fold.train.start and fold.test.stop > fold.test.start:
+                folds.append(fold)
+        return folds
+
+
+def map_folds(function, data, folds, max_workers=None):
+    """
+    Function that evaluates a function on the views of many folds in parallel threads
+    Input:  function - callable (train, val, test) -> result, e.g. training and evaluating a model
+            data - pandas dataframe, numpy array or MarketEnvironment shared by all folds
+            folds - list of Fold
+            max_workers - number of threads, defaults to the number of cores
+    Output: dict mapping the name of every fold to its result, in the order of folds
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        futures = {fold.name: executor.submit(function, *fold.take(data)) for fold in folds}
+        return {name: future.result() for name, future in futures.items()}
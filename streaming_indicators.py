@@ -0,0 +1,618 @@
+"""
+Streaming counterparts of the batch functions in technical_indicators.py
+
+Every state accepts one bar at a time as a dict, e.g. {'open': 1.0, 'high': 1.2, 'low': 0.9, 'close': 1.1, 'volume': 1000},
+and returns the value the batch function would have written on that row (nan during the warm-up period).
+States can be serialized to a dict/json so a daily job can resume where it stopped:
+
+    state = ExponentialMovingAverageState(20)
+    for bar in bars:
+        value = state.update(bar)
+    save_states({'SP500_EMA20': state}, "states.json")
+"""
+
+import json
+import math
+from collections import deque
+
+from rolling_windows import RollingWindow, RollingMax, RollingMin, RollingSum
+
+_STATES = {}
+
+def _register(cls):
+    _STATES[cls.__name__] = cls
+    return cls
+
+def _encode(value):
+    if isinstance(value, IndicatorState):
+        return {'__state__': value.to_dict()}
+    if isinstance(value, RollingWindow):
+        return {'__window__': value.to_dict()}
+    if isinstance(value, deque):
+        return {'__deque__': [_encode(x) for x in value], 'maxlen': value.maxlen}
+    if isinstance(value, list):
+        return [_encode(x) for x in value]
+    return value
+
+def _decode(value):
+    if isinstance(value, dict) and '__state__' in value:
+        return IndicatorState.from_dict(value['__state__'])
+    if isinstance(value, dict) and '__window__' in value:
+        return RollingWindow.from_dict(value['__window__'])
+    if isinstance(value, dict) and '__deque__' in value:
+        return deque([_decode(x) for x in value['__deque__']], maxlen=value['maxlen'])
+    if isinstance(value, list):
+        return [_decode(x) for x in value]
+    return value
+
+def _relative_difference(p_open, p_close):
+    if p_open == 0:
+        return (p_close - p_open) / 0.0000001
+    return (p_close - p_open) / p_open
+
+def _maximum(*values):
+    """
+    Function that takes the maximum of values as np.maximum does, nan if any value is nan
+    Input:  values - floats
+    Output: float
+    """
+    if any(math.isnan(value) for value in values):
+        return math.nan
+    return max(values)
+
+
+class IndicatorState:
+    """
+    Class that holds the state of a technical indicator for a single instrument
+
+    Subclasses list the constructor arguments in _params and the mutable state in _fields,
+    which is all that is required for to_dict/from_dict
+    """
+    _params = ()
+    _fields = ()
+
+    def update(self, bar):
+        """
+        Function that processes a single bar
+        Input:  bar - dict with (a subset of) the keys open, high, low, close and volume
+        Output: value of the indicator for this bar, nan during the warm-up period
+        """
+        raise NotImplementedError
+
+    def columns(self, varname):
+        """
+        Function that returns the column name(s) the batch function uses for this indicator
+        Input:  varname - stock/index name (string)
+        Output: list of column names
+        """
+        raise NotImplementedError
+
+    def to_dict(self):
+        return {
+            'type': type(self).__name__,
+            'params': {name: getattr(self, name) for name in self._params},
+            'state': {name: _encode(getattr(self, name)) for name in self._fields},
+        }
+
+    @staticmethod
+    def from_dict(data):
+        state = _STATES[data['type']](**data['params'])
+        for name, value in data['state'].items():
+            setattr(state, name, _decode(value))
+        return state
+
+
+@_register
+class RelativeDifferenceState(IndicatorState):
+    """
+    Class that calculates the daily relative difference, see calculate_daily_relative_difference
+    """
+    _params = ('column_open', 'column_close')
+
+    def __init__(self, column_open='open', column_close='close'):
+        self.column_open = column_open
+        self.column_close = column_close
+
+    def update(self, bar):
+        return _relative_difference(bar[self.column_open], bar[self.column_close])
+
+    def columns(self, varname):
+        return [varname + '_relative_change_perc_1']
+
+
+@_register
+class MovingAverageState(IndicatorState):
+    """
+    Class that calculates the moving average over a certain period, see calculate_moving_average
+    """
+    _params = ('days', 'column')
+    _fields = ('vals',)
+
+    def __init__(self, days, column='close'):
+        self.days = days
+        self.column = column
+        self.vals = RollingSum(days)
+
+    def push(self, value):
+        self.vals.push(value)
+        return self.vals.mean()
+
+    def update(self, bar):
+        return self.push(bar[self.column])
+
+    def columns(self, varname):
+        return [varname + '_MA' + str(self.days)]
+
+
+@_register
+class AverageRelativeDifferenceState(IndicatorState):
+    """
+    Class that calculates the average relative difference over a certain period, see calculate_average_relative_difference
+    """
+    _params = ('days', 'column_open', 'column_close')
+    _fields = ('average',)
+
+    def __init__(self, days, column_open='open', column_close='close'):
+        self.days = days
+        self.column_open = column_open
+        self.column_close = column_close
+        self.average = MovingAverageState(days)
+
+    def update(self, bar):
+        return self.average.push(_relative_difference(bar[self.column_open], bar[self.column_close]))
+
+    def columns(self, varname):
+        return [varname + '_relative_change_perc_' + str(self.days)]
+
+
+@_register
+class ExponentialMovingAverageState(IndicatorState):
+    """
+    Class that calculates the exponential moving average over a certain period, see calculate_exponential_moving_average
+    """
+    _params = ('days', 'column')
+    _fields = ('count', 'ema')
+
+    def __init__(self, days, column='close'):
+        self.days = days
+        self.column = column
+        self.count = 0
+        self.ema = 0.0 # sum of the values until the warm-up is completed
+
+    def push(self, value):
+        self.count += 1
+        if self.count < self.days:
+            self.ema += value
+            return math.nan
+        if self.count == self.days:
+            self.ema = (self.ema + value) / self.days
+        else:
+            self.ema = (value - self.ema) * (2 / (self.days + 1)) + self.ema
+        return self.ema
+
+    def update(self, bar):
+        return self.push(bar[self.column])
+
+    def columns(self, varname):
+        return [varname + '_EMA' + str(self.days)]
+
+
+@_register
+class AverageTrueRangeState(IndicatorState):
+    """
+    Class that calculates the average true range over a certain period, see calculate_average_true_range
+
+    The first value is emitted on bar days + 1 as the first bar is only required for the previous close
+    """
+    _params = ('days',)
+    _fields = ('count', 'prev_close', 'window', 'total')
+
+    def __init__(self, days):
+        self.days = days
+        self.count = 0
+        self.prev_close = math.nan
+        self.window = deque(maxlen=days)
+        self.total = 0.0
+
+    def update(self, bar):
+        self.count += 1
+        true_range = _maximum(bar['high'] - bar['low'], bar['low'] - self.prev_close, bar['high'] - self.prev_close)
+        self.prev_close = bar['close']
+        if self.count == 1:
+            return math.nan
+        if self.count <= self.days + 1:
+            self.window.append(true_range)
+            self.total += true_range
+            if self.count <= self.days:
+                return math.nan
+        atr = (self.total / self.days * (self.days - 1) + true_range) / self.days
+        self.total += atr - self.window[0]
+        self.window.append(atr)
+        return atr
+
+    def columns(self, varname):
+        return [varname + '_ATR' + str(self.days)]
+
+
+@_register
+class WeeksHighState(IndicatorState):
+    """
+    Class that calculates the highest high over a certain number of weeks, see calculate_weeks_high
+    """
+    _params = ('weeks', 'column')
+    _fields = ('vals',)
+
+    def __init__(self, weeks, column='high'):
+        self.weeks = weeks
+        self.column = column
+        self.vals = RollingMax(weeks * 5) # trading days
+
+    def update(self, bar):
+        return self.vals.push(bar[self.column])
+
+    def columns(self, varname):
+        return [varname + '_week_high_' + str(self.weeks)]
+
+
+@_register
+class WeeksLowState(IndicatorState):
+    """
+    Class that calculates the lowest low over a certain number of weeks, see calculate_weeks_low
+    """
+    _params = ('weeks', 'column')
+    _fields = ('vals',)
+
+    def __init__(self, weeks, column='low'):
+        self.weeks = weeks
+        self.column = column
+        self.vals = RollingMin(weeks * 5) # trading days
+
+    def update(self, bar):
+        return self.vals.push(bar[self.column])
+
+    def columns(self, varname):
+        return [varname + '_week_low_' + str(self.weeks)]
+
+
+@_register
+class RelativeStrengthIndexState(IndicatorState):
+    """
+    Class that calculates the relative strength index over a certain period, see calculate_relative_strength_index
+    """
+    _params = ('days', 'lingering_pseudozero')
+    _fields = ('count', 'ups', 'downs', 'directions', 'moves', 'up_sum', 'up_count', 'down_sum')
+
+    def __init__(self, days, lingering_pseudozero=True):
+        self.days = days
+        self.lingering_pseudozero = lingering_pseudozero
+        # with lingering pseudozeros: the up and down moves, pseudozeros included, and the direction of every move
+        self.count = 0
+        self.ups = deque()
+        self.downs = deque()
+        self.directions = deque()
+        # without: the signed moves of the window, close - open, and their sums
+        self.moves = deque(maxlen=days)
+        self.up_sum = 0.0
+        self.up_count = 0
+        self.down_sum = 0.0
+
+    def _add(self, move, sign):
+        if move >= 0:
+            self.up_sum += sign * move
+            self.up_count += sign
+        else:
+            self.down_sum -= sign * move
+
+    def update(self, bar):
+        if self.lingering_pseudozero:
+            return self._update_lingering(bar)
+        if len(self.moves) == self.days:
+            self._add(self.moves[0], -1)
+        move = bar['close'] - bar['open']
+        self.moves.append(move)
+        self._add(move, 1)
+        if len(self.moves) < self.days:
+            return math.nan
+        down_count = self.days - self.up_count
+        mean_up = self.up_sum / self.up_count if self.up_count > 0 else 0
+        mean_down = self.down_sum / down_count if down_count > 0 else 0.0000001 # pseudozero
+        return 100 - (100 / (1 + (mean_up / mean_down)))
+
+    def _update_lingering(self, bar):
+        self.count += 1
+        if bar['open'] <= bar['close']:
+            self.ups.append(bar['close'] - bar['open'])
+            self.directions.append(True)
+        else:
+            self.downs.append(bar['open'] - bar['close'])
+            self.directions.append(False)
+        if self.count < self.days:
+            return math.nan
+        if len(self.directions) > self.days:
+            (self.ups if self.directions.popleft() else self.downs).popleft()
+        if len(self.downs) == 0:
+            self.downs.append(0.0000001) # pseudozero
+        if len(self.ups) == 0:
+            self.ups.append(0.0)
+        return 100 - (100 / (1 + (math.fsum(self.ups) / len(self.ups)) / (math.fsum(self.downs) / len(self.downs))))
+
+    def columns(self, varname):
+        return [varname + '_RSI_' + str(self.days)]
+
+
+@_register
+class StochasticKState(IndicatorState):
+    """
+    Class that calculates the stochastic K% over a certain period, see calculate_stochastic_k
+    """
+    _params = ('days',)
+    _fields = ('highs', 'lows')
+
+    def __init__(self, days):
+        self.days = days
+        self.highs = RollingMax(days)
+        self.lows = RollingMin(days)
+
+    def update(self, bar):
+        highest = self.highs.push(bar['high'])
+        lowest = self.lows.push(bar['low'])
+        if math.isnan(highest) or math.isnan(lowest):
+            return math.nan
+        diff = highest - lowest
+        if diff == 0:
+            return math.nan if bar['close'] == lowest else math.copysign(math.inf, bar['close'] - lowest)
+        return (bar['close'] - lowest) / diff
+
+    def columns(self, varname):
+        return [varname + '_stochastic_K_' + str(self.days)]
+
+
+@_register
+class StochasticDState(IndicatorState):
+    """
+    Class that calculates the stochastic D% over a certain period, see calculate_stochastic_d
+    """
+    _params = ('days',)
+    _fields = ('stochastic_k', 'average')
+
+    def __init__(self, days):
+        self.days = days
+        self.stochastic_k = StochasticKState(days)
+        self.average = MovingAverageState(days)
+
+    def update(self, bar):
+        stoch = self.stochastic_k.update(bar)
+        if math.isnan(stoch) and self.average.vals.count == 0:
+            return math.nan
+        return self.average.push(stoch)
+
+    def columns(self, varname):
+        return [varname + '_stochastic_D_' + str(self.days) + '_' + str(self.days)]
+
+
+@_register
+class MomentumState(IndicatorState):
+    """
+    Class that calculates the momentum over a certain period, see calculate_momentum
+    """
+    _params = ('days', 'column')
+    _fields = ('vals',)
+
+    def __init__(self, days, column='close'):
+        self.days = days
+        self.column = column
+        self.vals = deque(maxlen=days + 1)
+
+    def update(self, bar):
+        self.vals.append(bar[self.column])
+        if len(self.vals) <= self.days:
+            return math.nan
+        return self.vals[-1] - self.vals[0]
+
+    def columns(self, varname):
+        return [varname + '_momentum_' + str(self.days)]
+
+
+@_register
+class WilliamsRState(IndicatorState):
+    """
+    Class that calculates the Williams R% over a certain period, see calculate_williams_r
+    """
+    _params = ('days',)
+    _fields = ('count', 'highs', 'lows')
+
+    def __init__(self, days):
+        self.days = days
+        self.count = 0
+        self.highs = deque(maxlen=days)
+        self.lows = deque(maxlen=days)
+
+    def update(self, bar):
+        self.count += 1
+        will = math.nan
+        if self.count >= self.days:
+            # the oldest of the previous days bars, the bar itself for days=1 on the first bar as in the batch function
+            high, low = (self.highs[0], self.lows[0]) if self.highs else (bar['high'], bar['low'])
+            diff = high - low
+            if diff == 0:
+                diff = 0.0000001
+            will = (high - bar['close']) / diff
+        self.highs.append(bar['high'])
+        self.lows.append(bar['low'])
+        return will
+
+    def columns(self, varname):
+        return [varname + '_williams_R_' + str(self.days)]
+
+
+@_register
+class ADOscillatorState(IndicatorState):
+    """
+    Class that calculates the accummulation distribution oscillator, see calculate_ad_oscillator
+    """
+    _fields = ('prev_close',)
+
+    def __init__(self):
+        self.prev_close = math.nan
+
+    def update(self, bar):
+        diff = bar['high'] - bar['low']
+        if diff == 0:
+            diff = 0.0000001
+        ad = (bar['high'] - self.prev_close) / diff
+        self.prev_close = bar['close']
+        return ad
+
+    def columns(self, varname):
+        return [varname + '_AD_oscillator']
+
+
+@_register
+class DisparityState(IndicatorState):
+    """
+    Class that calculates the disparity, see calculate_disparity
+
+    column_ma can be used to take the moving average of another series, as happens in the batch
+    function when the moving average column is already present in the dataframe
+    """
+    _params = ('days', 'column', 'column_ma')
+    _fields = ('average',)
+
+    def __init__(self, days, column='close', column_ma=None):
+        self.days = days
+        self.column = column
+        self.column_ma = column_ma
+        self.average = MovingAverageState(days, column_ma or column)
+
+    def update(self, bar):
+        return bar[self.column] / self.average.update(bar)
+
+    def columns(self, varname):
+        return [varname + '_disparity_' + str(self.days)]
+
+
+@_register
+class MovingAverageConvergenceDivergenceState(IndicatorState):
+    """
+    Class that calculates the moving average convergence divergence, see calculate_moving_average_convergence_divergence
+    """
+    _params = ('days1', 'days2', 'column')
+    _fields = ('ema1', 'ema2')
+
+    def __init__(self, days1, days2, column='close'):
+        self.days1 = days1
+        self.days2 = days2
+        self.column = column
+        self.ema1 = ExponentialMovingAverageState(days1, column)
+        self.ema2 = ExponentialMovingAverageState(days2, column)
+
+    def update(self, bar):
+        return self.ema1.update(bar) - self.ema2.update(bar)
+
+    def columns(self, varname):
+        return [varname + '_AD_MACD_' + str(self.days1) + '_' + str(self.days2)]
+
+
+@_register
+class BollingerBandsState(IndicatorState):
+    """
+    Class that calculates the high, mid and low bollinger bands, see calculate_bollinger_bands
+
+    update returns a tuple (high, middle, low)
+    column_ma can be used to take the middle band from the moving average of another series
+    """
+    _params = ('days', 'column', 'column_ma')
+    _fields = ('vals', 'average')
+
+    def __init__(self, days, column='close', column_ma=None):
+        self.days = days
+        self.column = column
+        self.column_ma = column_ma
+        self.vals = RollingSum(days)
+        self.average = MovingAverageState(days, column_ma or column)
+
+    def update(self, bar):
+        self.vals.push(bar[self.column])
+        ma = self.average.update(bar)
+        stdev = self.vals.std()
+        return ma + 2 * stdev, ma, ma - 2 * stdev
+
+    def columns(self, varname):
+        return [varname + '_bollinger_high_' + str(self.days),
+                varname + '_bollinger_middle_' + str(self.days),
+                varname + '_bollinger_low_' + str(self.days)]
+
+
+@_register
+class OnBalanceVolumeState(IndicatorState):
+    """
+    Class that calculates the on-balance volume, see calculate_on_balance_volume
+    """
+    _fields = ('obv',)
+
+    def __init__(self):
+        self.obv = 0.0
+
+    def update(self, bar):
+        if bar['open'] <= bar['close']:
+            self.obv = self.obv + bar['volume']
+        else:
+            self.obv = self.obv - bar['volume']
+        return self.obv
+
+    def columns(self, varname):
+        return [varname + '_OBV']
+
+
+@_register
+class StdevOnBalanceVolumeState(IndicatorState):
+    """
+    Class that calculates the standard deviation in on-balance volume, see calculate_stdev_on_balance_volume
+    """
+    _params = ('days',)
+    _fields = ('on_balance_volume', 'vals')
+
+    def __init__(self, days):
+        self.days = days
+        self.on_balance_volume = OnBalanceVolumeState()
+        self.vals = RollingSum(days)
+
+    def update(self, bar):
+        self.vals.push(self.on_balance_volume.update(bar))
+        return self.vals.std()
+
+    def columns(self, varname):
+        return [varname + '_OBV_stdev_' + str(self.days)]
+
+
+def replay(state, df, column_map):
+    """
+    Function that feeds the rows of a dataframe to a state, e.g. to warm it up on the history
+    Input:  state - IndicatorState to update
+            df - pandas dataframe with one row per bar
+            column_map - dict mapping the bar keys (open, high, ...) to the column names in df
+    Output: list of values returned by the state
+    """
+    keys = list(column_map)
+    values = []
+    for row in zip(*[df[column_map[key]].tolist() for key in keys]):
+        values.append(state.update(dict(zip(keys, row))))
+    return values
+
+def save_states(states, filename):
+    """
+    Function that writes a dict of states to a json file
+    Input:  states - dict mapping a name (string) to an IndicatorState
+            filename - path of the json file
+    """
+    with open(filename, 'w') as handle:
+        json.dump({name: state.to_dict() for name, state in states.items()}, handle)
+
+def load_states(filename):
+    """
+    Function that reads a dict of states written by save_states
+    Input:  filename - path of the json file
+    Output: dict mapping a name (string) to an IndicatorState
+    """
+    with open(filename) as handle:
+        return {name: IndicatorState.from_dict(data) for name, data in json.load(handle).items()}
@@ -0,0 +1,133 @@
+"""
+Parallel seed and hyperparameter sweeps of the Q-learning training and evaluation
+
+The arrays of the MarketEnvironment are placed in shared memory once and every worker process wraps them without a copy.
+Every configuration seeds its own numpy Generator from its seed, so the results do not depend on the number of workers
+or the order in which configurations finish:
+
+    configs = grid(seed=[67, 435, 829], alpha=[0.1, 0.2], epsilon=[0.5, 0.8], decay=[0.9], episodes=[20], risk=[0.05])
+    results, capitals = sweep(env, configs)
+    capitals_list = [capitals[(i, 'test')] for i in results[results['mode'] == 'test'].index_config]
+"""
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from market_environment import MarketEnvironment
+from q_table import QTable, init_actions, train, evaluate
+
+DEFAULTS = {
+    'seed': 111, 'alpha': 0.01, 'epsilon': 0.9, 'decay': 0.85, 'episodes': 20,
+    'capital': 100000, 'risk': 0.05, 'granularity': 0.2, 'train_mode': 'train',
+}
+
+_ENV = {} # environment of the worker process, set by _attach
+
+def _check(configs):
+    """
+    Function that rejects hyperparameters the training does not use, e.g. gamma, which the Q-learning update of
+    q_table.train does not have, so a sweep over it would return identical results for every value
+    Input:  configs - list of dicts of hyperparameters
+    Output: None
+    """
+    unknown = sorted({name for config in configs for name in config if name not in DEFAULTS})
+    if unknown:
+        raise ValueError(f"Unknown hyperparameters: {unknown}, expected some of {list(DEFAULTS)}")
+
+def grid(**params):
+    """
+    Function that lists all combinations of hyperparameters
+    Input:  params - lists of values per hyperparameter, e.g. seed=[67, 435], alpha=[0.1, 0.2]
+    Output: list of dicts, one per combination
+    """
+    names = list(params)
+    return [dict(zip(names, values)) for values in itertools.product(*(params[name] for name in names))]
+
+def share_environment(env):
+    """
+    Function that copies the arrays of an environment into shared memory
+    Input:  env - MarketEnvironment
+    Output: tuple (list of SharedMemory blocks, to be closed and unlinked by the caller, dict describing the arrays)
+    """
+    blocks = []
+    handles = {}
+    for name, array in env.arrays().items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        handles[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, handles
+
+def _attach(instruments, handles):
+    arrays = {}
+    blocks = []
+    for name, (block_name, shape, dtype) in handles.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block) # keep the blocks open for the lifetime of the worker
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    _ENV['blocks'] = blocks
+    _ENV['env'] = MarketEnvironment.from_arrays(instruments, arrays)
+
+def run_config(config, env=None, eval_modes=('train', 'val', 'test')):
+    """
+    Function that trains and evaluates a Q table for a single configuration
+    Input:  config - dict of hyperparameters, missing ones are taken from DEFAULTS
+            env - MarketEnvironment with all days, defaults to the environment shared with the worker
+            eval_modes - modes to evaluate the trained table on
+    Output: tuple (list of metric dicts, one per mode, dict mapping mode to the list of capitals)
+    """
+    _check([config])
+    config = {**DEFAULTS, **config}
+    env = env if env is not None else _ENV['env']
+    rng = np.random.default_rng(np.random.SeedSequence(config['seed']))
+    actions = init_actions(config['granularity'], len(env.instruments))
+    table = QTable(len(actions), 2 * len(env.instruments))
+    table, total_rewards, mean_diffs = train(table, env.mode(config['train_mode']), actions, config['alpha'], config['epsilon'],
+                                             config['decay'], config['episodes'], config['capital'], config['risk'], rng)
+    rows = []
+    capitals = {}
+    for mode in eval_modes:
+        metrics, capitals[mode], _ = evaluate(table, env.mode(mode), actions, config['capital'], config['risk'], rng)
+        rows.append({**config, 'mode': mode, **metrics, 'final_total_reward': total_rewards[-1], 'final_mean_diff': mean_diffs[-1]})
+    return rows, capitals
+
+def _run_indexed(task):
+    index, config, eval_modes = task
+    rows, capitals = run_config(config, None, eval_modes)
+    for row in rows:
+        row['index_config'] = index
+    return rows, capitals
+
+def sweep(env, configs, max_workers=None, eval_modes=('train', 'val', 'test')):
+    """
+    Function that runs many configurations in a process pool
+    Input:  env - MarketEnvironment with all days
+            configs - list of dicts of hyperparameters (see grid and DEFAULTS)
+            max_workers - number of worker processes, defaults to the number of cores
+            eval_modes - modes to evaluate every trained table on
+    Output: tuple (dataframe with one row of hyperparameters and metrics per configuration and mode,
+                   dict mapping (index of the configuration, mode) to the list of capitals)
+    """
+    _check(configs)
+    blocks, handles = share_environment(env)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_attach,
+                                 initargs=(env.instruments, handles)) as executor:
+            tasks = [(i, config, eval_modes) for i, config in enumerate(configs)]
+            outputs = list(executor.map(_run_indexed, tasks))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    rows = []
+    capitals = {}
+    for index, (config_rows, config_capitals) in enumerate(outputs):
+        rows += config_rows
+        for mode, values in config_capitals.items():
+            capitals[(index, mode)] = values
+    return pd.DataFrame(rows), capitals
@@ -1,8 +1,222 @@
 import pandas as pd
 import numpy as np
+import math
+from collections import deque
 from datetime import datetime, timedelta
-from statistics import mean, stdev
 
+from instrumentation import instrumented
+from rolling_windows import rolling_max, rolling_min, rolling_sum, rolling_mean, rolling_std
+
+def _values(df, column):
+    """
+    Function that extracts a column as a float64 numpy array
+    Input:  df - pandas dataframe containing the column
+            column - column name (string)
+    Output: numpy array with the column values
+    """
+    return df[column].to_numpy(dtype=np.float64)
+
+def _relative_difference(p_open, p_close):
+    """
+    Function that calculates the relative difference between open and close prices
+    Input:  p_open - numpy array of open prices
+            p_close - numpy array of close prices
+    Output: numpy array with the relative differences
+
+    an open price of 0 is replaced by a pseudozero to avoid division through 0
+    """
+    return (p_close - p_open) / np.where(p_open == 0, 0.0000001, p_open)
+
+def _exponential_moving_average(values, days):
+    """
+    Function that calculates the exponential moving average over a certain period
+    Input:  values - numpy array of values
+            days - size of the period (integer)
+    Output: numpy array with the exponential moving average, nan during the first days - 1 rows
+
+    the first value (row days - 1) is the mean of the first days values, after which the
+    recursive filter ema = (value - ema) * 2 / (days + 1) + ema is applied
+    """
+    emas = np.full(len(values), np.nan)
+    if len(values) < days:
+        return emas
+    seeded = values[days - 1:].copy()
+    seeded[0] = values[:days].mean()
+    emas[days - 1:] = pd.Series(seeded).ewm(alpha=2 / (days + 1), adjust=False).mean().to_numpy()
+    return emas
+
+def _true_range(p_high, p_low, p_close):
+    """
+    Function that calculates the true range per day
+    Input:  p_high - numpy array of high prices
+            p_low - numpy array of low prices
+            p_close - numpy array of close prices
+    Output: numpy array with the true range, nan on the first row as it requires the previous close
+    """
+    prev_close = np.empty(len(p_close))
+    prev_close[:1] = np.nan
+    prev_close[1:] = p_close[:-1]
+    return np.maximum(np.maximum(p_high - p_low, p_low - prev_close), p_high - prev_close)
+
+def _average_true_range(p_high, p_low, p_close, days):
+    """
+    Function that calculates the average true range over a certain period
+    Input:  p_high - numpy array of high prices
+            p_low - numpy array of low prices
+            p_close - numpy array of close prices
+            days - size of the period (integer)
+    Output: numpy array with the average true range, nan during the first days rows
+
+    the average is taken over a window that starts with the true ranges of day 1 up to day days
+    and is gradually replaced by previous average true ranges. This recursion cannot be expressed
+    as a rolling window, so it is computed with a running sum in a single pass
+    """
+    n = len(p_close)
+    atrs = np.full(n, np.nan)
+    if n <= days:
+        return atrs
+    true_ranges = _true_range(p_high, p_low, p_close).tolist()
+    window = true_ranges[1:days + 1] + [0.0] * (n - days)
+    total = sum(window[:days])
+    for k in range(n - days):
+        atr = (total / days * (days - 1) + true_ranges[days + k]) / days
+        window[days + k] = atr
+        total += atr - window[k]
+        atrs[days + k] = atr
+    return atrs
+
+def _relative_strength_index(p_open, p_close, days, lingering_pseudozero=True):
+    """
+    Function that calculates the relative strength index over a certain period
+    Input:  p_open - numpy array of open prices
+            p_close - numpy array of close prices
+            days - size of the period (integer)
+            lingering_pseudozero - boolean to keep the pseudozeros in the window as the validated loop does
+    Output: numpy array with the relative strength index, nan during the first days - 1 rows
+
+    without down moves in the window a pseudozero down move is added, without up moves a 0 up move. In the validated
+    loop these stay in the window and the oldest move is removed in their place, which requires a single pass over
+    the days with running sums (recomputed once every days days to discard their rounding errors). Every move leaving
+    the window is removed from its own list, an equal move of the other direction is no longer removed instead.
+    Without lingering pseudozeros the averages are taken over the up and down days within the window only
+    """
+    if not lingering_pseudozero:
+        moves = p_close - p_open
+        ups = p_open <= p_close
+        up_count = rolling_sum(ups.astype(np.float64), days)
+        up_sum = rolling_sum(np.where(ups, moves, 0.0), days)
+        down_sum = rolling_sum(np.where(ups, 0.0, -moves), days)
+        down_count = days - up_count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_up = np.where(up_count > 0, up_sum / up_count, 0.0)
+            mean_down = np.where(down_count > 0, down_sum / down_count, 0.0000001)
+        rsis = 100 - (100 / (1 + (mean_up / mean_down)))
+        rsis[np.isnan(up_count)] = np.nan
+        return rsis
+    n = len(p_close)
+    rsis = np.full(n, np.nan)
+    opens = p_open.tolist()
+    closes = p_close.tolist()
+    ups = deque()
+    downs = deque()
+    directions = deque() # True for an up move, in the order the moves entered the window
+    up_sum = 0.0
+    down_sum = 0.0
+    for index in range(n):
+        if opens[index] <= closes[index]:
+            ups.append(closes[index] - opens[index])
+            up_sum += ups[-1]
+            directions.append(True)
+        else:
+            downs.append(opens[index] - closes[index])
+            down_sum += downs[-1]
+            directions.append(False)
+        if index + 1 >= days:
+            if len(directions) > days:
+                if directions.popleft():
+                    up_sum -= ups.popleft()
+                else:
+                    down_sum -= downs.popleft()
+            if len(downs) == 0:
+                downs.append(0.0000001) # pseudozero
+            if len(ups) == 0:
+                ups.append(0.0)
+            if index % days == 0 or len(downs) == 1 or len(ups) == 1:
+                up_sum = math.fsum(ups)
+                down_sum = math.fsum(downs)
+            rsis[index] = 100 - (100 / (1 + (up_sum / len(ups)) / (down_sum / len(downs))))
+    return rsis
+
+def _stochastic_k(p_high, p_low, p_close, days):
+    """
+    Function that calculates the stochastic K% over a certain period
+    Input:  p_high - numpy array of high prices
+            p_low - numpy array of low prices
+            p_close - numpy array of close prices
+            days - size of the period (integer)
+    Output: numpy array with the stochastic K%, nan during the first days - 1 rows
+    """
+    lowest = rolling_min(p_low, days)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (p_close - lowest) / (rolling_max(p_high, days) - lowest)
+
+def _williams_r(p_high, p_low, p_close, days):
+    """
+    Function that calculates the Williams R% over a certain period
+    Input:  p_high - numpy array of high prices
+            p_low - numpy array of low prices
+            p_close - numpy array of close prices
+            days - size of the period (integer)
+    Output: numpy array with the Williams R%, nan during the first days - 1 rows
+
+    uses the high and low of the oldest day in the window of the previous days days
+    """
+    n = len(p_close)
+    wills = np.full(n, np.nan)
+    if n < days:
+        return wills
+    oldest = np.maximum(np.arange(days - 1, n) - days, 0)
+    diff = p_high[oldest] - p_low[oldest]
+    diff[diff == 0] = 0.0000001
+    wills[days - 1:] = (p_high[oldest] - p_close[days - 1:]) / diff
+    return wills
+
+def _ad_oscillator(p_high, p_low, p_close):
+    """
+    Function that calculates the accummulation distribution oscillator
+    Input:  p_high - numpy array of high prices
+            p_low - numpy array of low prices
+            p_close - numpy array of close prices
+    Output: numpy array with the accummulation distribution oscillator, nan on the first row
+    """
+    ads = np.full(len(p_close), np.nan)
+    diff = p_high[1:] - p_low[1:]
+    diff[diff == 0] = 0.0000001
+    ads[1:] = (p_high[1:] - p_close[:-1]) / diff
+    return ads
+
+def _on_balance_volume(p_open, p_close, volume):
+    """
+    Function that calculates the on-balance volume
+    Input:  p_open - numpy array of open prices
+            p_close - numpy array of close prices
+            volume - numpy array of trading volumes
+    Output: numpy array with the on-balance volume
+    """
+    return np.cumsum(np.where(p_open <= p_close, volume, -volume))
+
+def _warmup(values, days):
+    """
+    Function that masks the rows before a certain period is completed
+    Input:  values - numpy array of values
+            days - size of the period (integer)
+    Output: numpy array with nan in the first days - 1 rows
+    """
+    values = np.array(values, dtype=np.float64)
+    values[:max(days - 1, 0)] = np.nan
+    return values
+
+@instrumented()
 def calculate_daily_relative_difference(df, column_open, column_close, varname):
     """
     Function that calculates the daily relative difference, or daily rate of change
@@ -14,16 +228,10 @@ def calculate_daily_relative_difference(df, column_open, column_close, varname):
 
     Output validated
     """
-    diffs = {}
-    for index, row in df.iterrows():
-        if row[column_open] == 0:
-            diff = (row[column_close] - row[column_open]) / 0.0000001
-        else:
-            diff = (row[column_close] - row[column_open]) / row[column_open]
-        diffs[row['Date']] = diff
-    df[varname + '_relative_change_perc_1'] = df['Date'].map(diffs)
+    df[varname + '_relative_change_perc_1'] = _relative_difference(_values(df, column_open), _values(df, column_close))
     return df
 
+@instrumented(detail='days_list')
 def calculate_average_relative_difference(df, column_open, column_close, days_list, varname):
     """
     Function that calculates the average relative difference, or average rate of change over a certain period
@@ -36,20 +244,12 @@ def calculate_average_relative_difference(df, column_open, column_close, days_li
 
     Output validated
     """
+    diffs = _relative_difference(_values(df, column_open), _values(df, column_close))
     for days in days_list:
-        vals = []
-        diffs = {}
-        for index, row in df.iterrows():
-            if row[column_open] == 0:
-                vals.append((row[column_close] - row[column_open]) / 0.0000001)
-            else:
-                vals.append((row[column_close] - row[column_open]) / row[column_open])
-            if index >= days - 1:
-                diffs[row['Date']] = mean(vals)
-                vals.pop(0)
-        df[varname + '_relative_change_perc_' + str(days)] = df['Date'].map(diffs)
+        df[varname + '_relative_change_perc_' + str(days)] = rolling_mean(diffs, days)
     return df
 
+@instrumented(detail='days_list')
 def calculate_exponential_moving_average(df, column_close, days_list, varname):
     """
     Function that calculates the exponential moving average over a certain period
@@ -64,24 +264,12 @@ def calculate_exponential_moving_average(df, column_close, days_list, varname):
 
     Output validated
     """
+    closes = _values(df, column_close)
     for days in days_list:
-        vals = []
-        emas = {}
-        ema = 0 # placeholder
-        for index, row in df.iterrows():
-            if index + 1 == days:
-                vals.append(row[column_close])
-                ema = mean(vals) # placeholder
-                emas[row['Date']] = ema
-            elif index >= days:
-                multiplier = 2 / (days + 1)
-                ema = (row[column_close] - ema) * multiplier + ema
-                emas[row['Date']] = ema
-            else:
-                vals.append(row[column_close])
-        df[varname + '_EMA' + str(days)] = df['Date'].map(emas)
+        df[varname + '_EMA' + str(days)] = _exponential_moving_average(closes, days)
     return df
 
+@instrumented(detail='days_list')
 def calculate_moving_average(df, column_close, days_list, varname):
     """
     Function that calculates the moving average over a certain period
@@ -93,21 +281,12 @@ def calculate_moving_average(df, column_close, days_list, varname):
 
     Output validated
     """
+    closes = _values(df, column_close)
     for days in days_list:
-        vals = []
-        mas = {}
-        ma = 0 # placeholder
-        for index, row in df.iterrows():
-            if index + 1 >= days:
-                vals.append(row[column_close])
-                ma = mean(vals)
-                mas[row['Date']] = ma
-                vals.pop(0)
-            else:
-                vals.append(row[column_close])
-        df[varname + '_MA' + str(days)] = df['Date'].map(mas)
+        df[varname + '_MA' + str(days)] = rolling_mean(closes, days)
     return df
 
+@instrumented(detail='days_list')
 def calculate_average_true_range(df, column_open, column_high, column_low, column_close, days_list, varname):
     """
     Function that calculates the average true range over a certain period
@@ -127,36 +306,14 @@ def calculate_average_true_range(df, column_open, column_high, column_low, colum
 
     Output validated
     """
+    highs = _values(df, column_high)
+    lows = _values(df, column_low)
+    closes = _values(df, column_close)
     for days in days_list:
-        vals = []
-        atrs = {}
-        atr = 0 # placeholder
-        prev_close = 0 # placeholder
-        for index, row in df.iterrows():
-            if index >= days:
-                metric1 = row[column_high] - row[column_low]
-                metric2 = row[column_low] - prev_close
-                metric3 = row[column_high] - prev_close
-                if index == days:
-                    vals.append(max(metric1, metric2, metric3))
-                atr = (mean(vals) * (days - 1) + max(metric1, metric2, metric3)) / days
-                atrs[row['Date']] = atr
-                vals.append(atr)
-                if len(vals) > days:
-                    vals.pop(0)
-                prev_close = row[column_close]
-            elif index > 0:
-                metric1 = row[column_high] - row[column_low]
-                metric2 = row[column_low] - prev_close
-                metric3 = row[column_high] - prev_close
-                vals.append(max(metric1, metric2, metric3))
-                prev_close = row[column_close]
-            else:
-                prev_close = row[column_close]
-
-        df[varname + '_ATR' + str(days)] = df['Date'].map(atrs)
+        df[varname + '_ATR' + str(days)] = _average_true_range(highs, lows, closes, days)
     return df
 
+@instrumented(detail='weeks_list')
 def calculate_weeks_high(df, column_high, weeks_list, varname):
     """
     Function that calculates the highest high over a certain period
@@ -168,21 +325,13 @@ def calculate_weeks_high(df, column_high, weeks_list, varname):
 
     Output validated
     """
+    highs = _values(df, column_high)
     for weeks in weeks_list:
         days = weeks * 5 # trading days
-        vals = []
-        highs = {}
-        for index, row in df.iterrows():
-            if index + 1 >= days:
-                vals.append(row[column_high])
-                high = max(vals)
-                highs[row['Date']] = high
-                vals.pop(0)
-            else:
-                vals.append(row[column_high])
-        df[varname + '_week_high_' + str(weeks)] = df['Date'].map(highs)
+        df[varname + '_week_high_' + str(weeks)] = rolling_max(highs, days)
     return df
 
+@instrumented(detail='weeks_list')
 def calculate_weeks_low(df, column_low, weeks_list, varname):
     """
     Function that calculates the lowest low over a certain period
@@ -194,22 +343,14 @@ def calculate_weeks_low(df, column_low, weeks_list, varname):
 
     Output validated
     """
+    lows = _values(df, column_low)
     for weeks in weeks_list:
         days = weeks * 5 # trading days
-        vals = []
-        lows = {}
-        for index, row in df.iterrows():
-            if index + 1 >= days:
-                vals.append(row[column_low])
-                low = min(vals)
-                lows[row['Date']] = low
-                vals.pop(0)
-            else:
-                vals.append(row[column_low])
-        df[varname + '_week_low_' + str(weeks)] = df['Date'].map(lows)
+        df[varname + '_week_low_' + str(weeks)] = rolling_min(lows, days)
     return df
 
-def calculate_relative_strength_index(df, column_open, column_close, days_list, varname):
+@instrumented(detail='days_list')
+def calculate_relative_strength_index(df, column_open, column_close, days_list, varname, lingering_pseudozero=True):
     """
     Function that calculates the relative strength index over a certain period
     Input:  df - pandas dataframe to which the relative strength index should be added
@@ -217,45 +358,23 @@ def calculate_relative_strength_index(df, column_open, column_close, days_list,
             column_close - column name (string) of the close price
             days_list - list of integers to describe the size of the period to consider for the average
             varname - stock/index name (string) to name the column
+            lingering_pseudozero - boolean, False averages over the up and down days within the window only
     Output: original dataframe with additional column
 
     deviates from normal calculation to avoid division through 0
+    every move leaving the window is removed from the up or down moves it belongs to, an equal move of the other
+    direction was removed before. The pseudozeros for a window without down (or up) moves stay in the window as in the
+    validated output, unless lingering_pseudozero is False
 
     Output validated
     """
+    opens = _values(df, column_open)
+    closes = _values(df, column_close)
     for days in days_list:
-        ups = []
-        downs = []
-        all_moves = []
-        rsis = {}
-        for index, row in df.iterrows():
-            if row[column_open] <= row[column_close]:
-                ups.append(row[column_close] - row[column_open])
-                all_moves.append(row[column_close] - row[column_open])
-            else:
-                downs.append(row[column_open] - row[column_close])
-                all_moves.append(row[column_open] - row[column_close])
-
-            if index + 1 >= days:
-                if len(all_moves) > days:
-                    if all_moves[0] in ups:
-                        all_moves.pop(0)
-                        ups.pop(0)
-                    elif all_moves[0] in downs:
-                        all_moves.pop(0)
-                        downs.pop(0)
-
-                if len(downs) == 0:
-                    downs = [0.0000001] # pseudozero
-                if len(ups) == 0:
-                    ups = [0]
-                # if index + 1 == days:
-                #     print(mean(ups), mean(downs))
-                rsi = 100 - (100 / (1 + (mean(ups) / mean(downs))))
-                rsis[row['Date']] = rsi
-        df[varname + '_RSI_' + str(days)] = df['Date'].map(rsis)
+        df[varname + '_RSI_' + str(days)] = _relative_strength_index(opens, closes, days, lingering_pseudozero)
     return df
 
+@instrumented(detail='days_list')
 def calculate_stochastic_k(df, column_high, column_low, column_close, days_list, varname):
     """
     Function that calculates the stochastic K% over a certain period
@@ -269,22 +388,14 @@ def calculate_stochastic_k(df, column_high, column_low, column_close, days_list,
 
     Output validated
     """
+    highs = _values(df, column_high)
+    lows = _values(df, column_low)
+    closes = _values(df, column_close)
     for days in days_list:
-        highs = []
-        lows = []
-        stochs = {}
-        for index, row in df.iterrows():
-            highs.append(row[column_high])
-            lows.append(row[column_low])
-            if len(highs) > days:
-                highs.pop(0)
-            if len(lows) > days:
-                lows.pop(0)
-            if index + 1 >= days:
-                stochs[row['Date']] = (row[column_close] - min(lows)) / (max(highs) - min(lows))
-        df[varname + '_stochastic_K_' + str(days)] = df['Date'].map(stochs)
+        df[varname + '_stochastic_K_' + str(days)] = _stochastic_k(highs, lows, closes, days)
     return df
 
+@instrumented(detail='days_list')
 def calculate_stochastic_d(df, column_high, column_low, column_close, days_list, varname):
     """
     Function that calculates the stochastic D% over a certain period
@@ -299,22 +410,14 @@ def calculate_stochastic_d(df, column_high, column_low, column_close, days_list,
     Output validated
     """
     for days in days_list:
-        vals = []
-        stochs = {}
         if varname + "_stochastic_K_" + str(days) not in df.columns.tolist():
-            df_temp = calculate_stochastic_k(df, column_high, column_low, column_close, days_list, varname)
-        else:
-            df_temp = df.copy()
-        for index, row in df_temp.iterrows():
-            if index + 1 >= days:
-                vals.append(row[varname + "_stochastic_K_" + str(days)]) # replace days with k_days
-                if len(vals) > days:
-                    vals.pop(0)
-                if len(vals) == days:
-                    stochs[row['Date']] = mean(vals)
-        df[varname + '_stochastic_D_' + str(days) + "_" + str(days)] = df['Date'].map(stochs)
+            # as the validated loop: the K of all days first, so the K columns precede the D columns
+            df = calculate_stochastic_k(df, column_high, column_low, column_close, days_list, varname)
+        stochs = _values(df, varname + "_stochastic_K_" + str(days))
+        df[varname + '_stochastic_D_' + str(days) + "_" + str(days)] = rolling_mean(stochs, days)
     return df
 
+@instrumented(detail='days_list')
 def calculate_momentum(df, column_close, days_list, varname):
     """
     Function that calculates the momentum over a certain period
@@ -328,18 +431,14 @@ def calculate_momentum(df, column_close, days_list, varname):
 
     Output validated
     """
+    closes = _values(df, column_close)
     for days in days_list:
-        vals = []
-        momentums = {}
-        for index, row in df.iterrows():
-            if index >= days:
-                momentums[row['Date']] = row[column_close] - vals[0]
-            vals.append(row[column_close])
-            if len(vals) > days:
-                vals.pop(0)
-        df[varname + '_momentum_' + str(days)] = df['Date'].map(momentums)
+        momentums = np.full(len(closes), np.nan)
+        momentums[days:] = closes[days:] - closes[:len(closes) - days]
+        df[varname + '_momentum_' + str(days)] = momentums
     return df
 
+@instrumented(detail='days_list')
 def calculate_williams_r(df, column_high, column_low, column_close, days_list, varname):
     """
     Function that calculates the Williams R% over a certain period
@@ -353,25 +452,14 @@ def calculate_williams_r(df, column_high, column_low, column_close, days_list, v
 
     Output validated
     """
+    highs = _values(df, column_high)
+    lows = _values(df, column_low)
+    closes = _values(df, column_close)
     for days in days_list:
-        wills = {}
-        highs = []
-        lows = []
-        for index, row in df.iterrows():
-            if index + 1 >= days:
-                diff = (highs[0] - lows[0])
-                if diff == 0:
-                    diff = 0.0000001
-                wills[row['Date']] = (highs[0] - row[column_close]) / diff
-            highs.append(row[column_high])
-            lows.append(row[column_low])
-            if len(highs) > days:
-                highs.pop(0)
-            if len(lows) > days:
-                lows.pop(0)
-        df[varname + '_williams_R_' + str(days)] = df['Date'].map(wills)
+        df[varname + '_williams_R_' + str(days)] = _williams_r(highs, lows, closes, days)
     return df
 
+@instrumented()
 def calculate_ad_oscillator(df, column_high, column_low, column_close, varname):
     """
     Function that calculates the accummulation distribution oscillator
@@ -384,19 +472,11 @@ def calculate_ad_oscillator(df, column_high, column_low, column_close, varname):
 
     Output validated
     """
-    ads = {}
-    vals = []
-    for index, row in df.iterrows():
-        if index > 0:
-            diff = (row[column_high] - row[column_low])
-            if diff == 0:
-                diff = 0.0000001
-            ads[row['Date']] = (row[column_high] - vals[-1]) / diff
-        vals.append(row[column_close])
-    df[varname + '_AD_oscillator'] = df['Date'].map(ads)
+    df[varname + '_AD_oscillator'] = _ad_oscillator(_values(df, column_high), _values(df, column_low), _values(df, column_close))
     return df
 
 
+@instrumented(detail='days_list')
 def calculate_disparity(df, column_close, days_list, varname):
     """
     Function that calculates the disparity
@@ -408,18 +488,15 @@ def calculate_disparity(df, column_close, days_list, varname):
 
     Output validated
     """
+    closes = _values(df, column_close)
     for days in days_list:
-        disps = {}
         if varname + "_MA" + str(days) not in df.columns.tolist():
-            df_temp = calculate_moving_average(df, column_close, [days], varname)
-        else:
-            df_temp = df.copy()
-        for index, row in df_temp.iterrows():
-            if index + 1 >= days:
-                disps[row['Date']] = row[column_close] / row[varname + "_MA" + str(days)]
-        df[varname + '_disparity_' + str(days)] = df['Date'].map(disps)
+            df = calculate_moving_average(df, column_close, [days], varname)
+        mas = _values(df, varname + "_MA" + str(days))
+        df[varname + '_disparity_' + str(days)] = _warmup(closes / mas, days)
     return df
 
+@instrumented(detail='days_pairs_list')
 def calculate_moving_average_convergence_divergence(df, column_close, days_pairs_list, varname):
     """
     Function that calculates the moving average convergence divergence
@@ -431,17 +508,15 @@ def calculate_moving_average_convergence_divergence(df, column_close, days_pairs
 
     Output validated
     """
+    closes = _values(df, column_close)
     for days_pairs in days_pairs_list:
         days1 = days_pairs[0]
         days2 = days_pairs[1]
-        df_temp = calculate_exponential_moving_average(df.copy(), column_close, [days1, days2], varname)
-        macds = {}
-        for index, row in df_temp.iterrows():
-            if index + 1 >= max(days1, days2):
-                macds[row['Date']] = row[varname + '_EMA' + str(days1)] - row[varname + '_EMA' + str(days2)]
-        df[varname + '_AD_MACD_' +  str(days1) + "_" + str(days2)] = df['Date'].map(macds)
+        macds = _exponential_moving_average(closes, days1) - _exponential_moving_average(closes, days2)
+        df[varname + '_AD_MACD_' +  str(days1) + "_" + str(days2)] = _warmup(macds, max(days1, days2))
     return df
 
+@instrumented(detail='days_list')
 def calculate_bollinger_bands(df, column_close, days_list, varname):
     """
     Function that calculates the high, mid and low bollinger bands
@@ -452,28 +527,19 @@ def calculate_bollinger_bands(df, column_close, days_list, varname):
 
     Output validated
     """
+    closes = _values(df, column_close)
     for days in days_list:
-        highs = {}
-        mids = {}
-        lows = {}
-        vals = []
         if varname + "_MA" + str(days) not in df.columns.tolist():
-            df_temp = calculate_moving_average(df.copy(), column_close, [days], varname)
+            mas = rolling_mean(closes, days)
         else:
-            df_temp = df.copy()
-        for index, row in df_temp.iterrows():
-            vals.append(row[column_close])
-            if len(vals) > days:
-                vals.pop(0)
-            if index + 1 >= days:
-                highs[row['Date']] = row[varname + "_MA" + str(days)] + 2 * stdev(vals)
-                mids[row['Date']] = row[varname + "_MA" + str(days)]
-                lows[row['Date']] = row[varname + "_MA" + str(days)] - 2 * stdev(vals)
-        df[varname + '_bollinger_high_' + str(days)] = df['Date'].map(highs)
-        df[varname + '_bollinger_middle_' + str(days)] = df['Date'].map(mids)
-        df[varname + '_bollinger_low_' + str(days)] = df['Date'].map(lows)
+            mas = _warmup(_values(df, varname + "_MA" + str(days)), days)
+        stdevs = rolling_std(closes, days)
+        df[varname + '_bollinger_high_' + str(days)] = mas + 2 * stdevs
+        df[varname + '_bollinger_middle_' + str(days)] = mas
+        df[varname + '_bollinger_low_' + str(days)] = mas - 2 * stdevs
     return df
 
+@instrumented()
 def calculate_on_balance_volume(df, column_open, column_close, column_volume, varname):
     """
     Function that calculates the on-balance volume
@@ -488,17 +554,10 @@ def calculate_on_balance_volume(df, column_open, column_close, column_volume, va
     Output validated
     """
     if column_volume in df.columns.tolist():
-        obvs = {}
-        obv = 0
-        for index, row in df.iterrows():
-            if row[column_open] <= row[column_close]:
-                obv = obv + row[column_volume]
-            else:
-                obv = obv - row[column_volume]
-            obvs[row['Date']] = obv
-        df[varname + '_OBV'] = df['Date'].map(obvs)
+        df[varname + '_OBV'] = _on_balance_volume(_values(df, column_open), _values(df, column_close), _values(df, column_volume))
     return df
 
+@instrumented(detail='days_list')
 def calculate_stdev_on_balance_volume(df, column_open, column_close, column_volume, days_list, varname):
     """
     Function that calculates the standard deviation in on-balance volume
@@ -512,15 +571,8 @@ def calculate_stdev_on_balance_volume(df, column_open, column_close, column_volu
     Output validated
     """
     if column_volume in df.columns.tolist():
-        df_temp = calculate_on_balance_volume(df, column_open, column_close, column_volume, varname)
+        df = calculate_on_balance_volume(df, column_open, column_close, column_volume, varname)
+        obvs = _values(df, varname + "_OBV")
         for days in days_list:
-            vars = {}
-            vals = []
-            for index, row in df_temp.iterrows():
-                vals.append(row[varname + "_OBV"])
-                if len(vals) > days:
-                    vals.pop(0)
-                if len(vals) >= days:
-                    vars[row['Date']] = stdev(vals)
-            df[varname + '_OBV_stdev_' + str(days)] = df['Date'].map(vars)
+            df[varname + '_OBV_stdev_' + str(days)] = rolling_std(obvs, days)
     return df
@@ -0,0 +1,399 @@
+"""
+Trading calendars and vectorized calendar cleaning for the Create Dataset and Data Cleaning notebooks
+
+A calendar is built once as an array of holidays and a weekmask, after which filtering a frame to its trading days,
+reindexing many instruments onto its sessions and filling the gaps are single vectorized operations:
+
+    df = remove_holidays(df, US_HOLIDAYS)                  # as remove_holidays in the notebooks
+    df = align(frames, CALENDARS['US'], start, end)        # combine instruments on US trading days and fill gaps
+
+US_HOLIDAYS is the hand-written list of the notebooks (July 2009 to 2019). The exchange calendars in CALENDARS are
+generated from the holiday rules of NYSE, Xetra, Euronext Paris and the LSE plus their special closures, for the years
+of Dataset v3 (2005 to 2021), and checked against the trading days of SP500/US30/NASDAQ, GER30, CAC40 and UK100. There
+are no rules for the lunisolar holidays of the Shanghai, Hong Kong and Tokyo exchanges, their instruments are aligned
+on the calendar of the predicted index as in the notebooks.
+"""
+
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+
+US_HOLIDAYS = [
+    datetime(2009, 7, 3), # Independence day
+    datetime(2009, 9, 7), # Labor day
+    datetime(2009, 11, 26), # Thanksgiving
+    datetime(2009, 12, 25), # Christmas
+
+    datetime(2010, 1, 1), # New Year's day
+    datetime(2010, 1, 18), # Martin Luther King Jr. day
+    datetime(2010, 2, 15), # President's day
+    datetime(2010, 4, 2), # Good Friday
+    datetime(2010, 5, 31), # Memorial day
+    datetime(2010, 7, 5), # Independence day
+    datetime(2010, 9, 6), # Labor day
+    datetime(2010, 11, 25), # Thanksgiving
+    datetime(2010, 12, 24), # Christmas
+
+    datetime(2011, 1, 1), # New Year's day
+    datetime(2011, 1, 17), # Martin Luther King Jr. day
+    datetime(2011, 2, 21), # President's day
+    datetime(2011, 4, 22), # Good Friday
+    datetime(2011, 5, 30), # Memorial day
+    datetime(2011, 7, 4), # Independence day
+    datetime(2011, 9, 5), # Labor day
+    datetime(2011, 11, 24), # Thanksgiving
+    datetime(2011, 12, 26), # Christmas
+
+    datetime(2012, 1, 1), # New Year's day
+    datetime(2012, 1, 2), # New Year's day
+    datetime(2012, 1, 16), # Martin Luther King Jr. day
+    datetime(2012, 2, 20), # President's day
+    datetime(2012, 4, 6), # Good Friday
+    datetime(2012, 5, 28), # Memorial day
+    datetime(2012, 7, 4), # Independence day
+    datetime(2012, 9, 3), # Labor day
+
+    datetime(2012, 10, 29), # Hurricane Sandy
+    datetime(2012, 10, 30), # Hurricane Sandy
+
+    datetime(2012, 11, 22), # Thanksgiving
+    datetime(2012, 12, 25), # Christmas
+
+    datetime(2013, 1, 1), # New Year's day
+    datetime(2013, 1, 21), # Martin Luther King Jr. day
+    datetime(2013, 2, 18), # President's day
+    datetime(2013, 3, 29), # Good Friday
+    datetime(2013, 5, 27), # Memorial day
+    datetime(2013, 7, 4), # Independence day
+    datetime(2013, 9, 2), # Labor day
+    datetime(2013, 11, 28), # Thanksgiving
+    datetime(2013, 12, 25), # Christmas
+
+    datetime(2014, 1, 1), # New Year's day
+    datetime(2014, 1, 20), # Martin Luther King Jr. day
+    datetime(2014, 2, 17), # President's day
+    datetime(2014, 4, 18), # Good Friday
+    datetime(2014, 5, 26), # Memorial day
+    datetime(2014, 7, 4), # Independence day
+    datetime(2014, 9, 1), # Labor day
+    datetime(2014, 11, 27), # Thanksgiving
+    datetime(2014, 12, 25), # Christmas
+
+    datetime(2015, 1, 1), # New Year's day
+    datetime(2015, 1, 19), # Martin Luther King Jr. day
+    datetime(2015, 2, 16), # President's day
+    datetime(2015, 4, 3), # Good Friday
+    datetime(2015, 5, 25), # Memorial day
+    datetime(2015, 7, 3), # Independence day
+    datetime(2015, 9, 7), # Labor day
+    datetime(2015, 11, 26), # Thanksgiving
+    datetime(2015, 12, 25), # Christmas
+
+    datetime(2016, 1, 1), # New Year's day
+    datetime(2016, 1, 18), # Martin Luther King Jr. day
+    datetime(2016, 2, 15), # President's day
+    datetime(2016, 3, 25), # Good Friday
+    datetime(2016, 5, 30), # Memorial day
+    datetime(2016, 7, 4), # Independence day
+    datetime(2016, 9, 5), # Labor day
+    datetime(2016, 11, 24), # Thanksgiving
+    datetime(2016, 12, 26), # Christmas
+
+    datetime(2017, 1, 1), # New Year's day
+    datetime(2017, 1, 2), # New Year's day
+    datetime(2017, 1, 16), # Martin Luther King Jr. day
+    datetime(2017, 2, 20), # President's day
+    datetime(2017, 4, 14), # Good Friday
+    datetime(2017, 5, 29), # Memorial day
+    datetime(2017, 7, 4), # Independence day
+    datetime(2017, 9, 4), # Labor day
+    datetime(2017, 11, 23), # Thanksgiving
+    datetime(2017, 12, 25), # Christmas
+
+    datetime(2018, 1, 1), # New Year's day
+    datetime(2018, 1, 15), # Martin Luther King Jr. day
+    datetime(2018, 2, 19), # President's day
+    datetime(2018, 3, 30), # Good Friday
+    datetime(2018, 5, 28), # Memorial day
+    datetime(2018, 7, 4), # Independence day
+    datetime(2018, 9, 3), # Labor day
+    datetime(2018, 11, 22), # Thanksgiving
+    datetime(2018, 12, 5), # National day of mourning
+    datetime(2018, 12, 25), # Christmas
+
+    datetime(2019, 1, 1), # New Year's day
+    datetime(2019, 1, 21), # Martin Luther King Jr. day
+    datetime(2019, 2, 18), # President's day
+    datetime(2019, 4, 19), # Good Friday
+    datetime(2019, 5, 27), # Memorial day
+    datetime(2019, 7, 4), # Independence day
+    datetime(2019, 9, 2), # Labor day
+    datetime(2019, 11, 28), # Thanksgiving
+    datetime(2019, 12, 25), # Christmas
+]
+
+DATASET_YEARS = range(2005, 2022) # years of Dataset v3, covered by the generated exchange calendars
+
+def easter(year):
+    """
+    Function that computes Easter Sunday with the anonymous Gregorian algorithm
+    Input:  year - integer
+    Output: date
+    """
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    g = (b - (b + 8) // 25 + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+def _weekday(year, month, weekday, n):
+    # n-th weekday (0 is Monday) of a month, counted from the end for negative n
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta((weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(1)
+    return last - timedelta((last.weekday() - weekday) % 7 - 7 * (n + 1))
+
+def _observed(day):
+    # holiday on a Saturday is observed on the Friday before, on a Sunday on the Monday after
+    return day + timedelta({5: -1, 6: 1}.get(day.weekday(), 0))
+
+def nyse_holidays(years=DATASET_YEARS):
+    """
+    Function that generates the holidays of the New York Stock Exchange (and Nasdaq)
+    Input:  years - iterable of integers
+    Output: list of dates
+    """
+    holidays = []
+    for year in years:
+        new_year = date(year, 1, 1)
+        if new_year.weekday() != 5: # not observed on the Friday before
+            holidays.append(_observed(new_year))
+        holidays += [
+            _weekday(year, 1, 0, 3), # Martin Luther King Jr. day
+            _weekday(year, 2, 0, 3), # President's day
+            easter(year) - timedelta(2), # Good Friday
+            _weekday(year, 5, 0, -1), # Memorial day
+            _observed(date(year, 7, 4)), # Independence day
+            _weekday(year, 9, 0, 1), # Labor day
+            _weekday(year, 11, 3, 4), # Thanksgiving
+            _observed(date(year, 12, 25)), # Christmas
+        ]
+        if year >= 2022:
+            holidays.append(_observed(date(year, 6, 19))) # Juneteenth
+    special = [
+        date(2007, 1, 2), # National day of mourning
+        date(2012, 10, 29), date(2012, 10, 30), # Hurricane Sandy
+        date(2018, 12, 5), # National day of mourning
+    ]
+    return holidays + [day for day in special if day.year in years]
+
+def xetra_holidays(years=DATASET_YEARS):
+    """
+    Function that generates the holidays of the Frankfurt Stock Exchange (Xetra)
+    Input:  years - iterable of integers
+    Output: list of dates
+    """
+    holidays = []
+    for year in years:
+        holidays += [
+            date(year, 1, 1), # New Year's day
+            easter(year) - timedelta(2), # Good Friday
+            easter(year) + timedelta(1), # Easter Monday
+            date(year, 5, 1), # Labour day
+            date(year, 12, 24), date(year, 12, 25), date(year, 12, 26), date(year, 12, 31), # Christmas, New Year's eve
+        ]
+        if year >= 2016:
+            holidays.append(easter(year) + timedelta(50)) # Whit Monday
+        if year >= 2014:
+            holidays.append(date(year, 10, 3)) # German unity day
+    special = [
+        date(2007, 5, 28), # Whit Monday
+        date(2017, 10, 31), # Reformation day
+    ]
+    return holidays + [day for day in special if day.year in years]
+
+def euronext_holidays(years=DATASET_YEARS):
+    """
+    Function that generates the holidays of Euronext Paris
+    Input:  years - iterable of integers
+    Output: list of dates
+    """
+    holidays = []
+    for year in years:
+        holidays += [
+            date(year, 1, 1), # New Year's day
+            easter(year) - timedelta(2), # Good Friday
+            easter(year) + timedelta(1), # Easter Monday
+            date(year, 5, 1), # Labour day
+            date(year, 12, 25), date(year, 12, 26), # Christmas
+        ]
+    return holidays
+
+def lse_holidays(years=DATASET_YEARS):
+    """
+    Function that generates the holidays of the London Stock Exchange (the bank holidays of England)
+    Input:  years - iterable of integers
+    Output: list of dates
+    """
+    moved = {
+        date(2012, 5, 28): date(2012, 6, 4), # Spring bank holiday, Diamond Jubilee
+        date(2020, 5, 4): date(2020, 5, 8), # Early May bank holiday, VE day
+    }
+    holidays = []
+    for year in years:
+        new_year = date(year, 1, 1)
+        christmas = date(year, 12, 25)
+        holidays += [
+            new_year + timedelta({5: 2, 6: 1}.get(new_year.weekday(), 0)), # New Year's day, on the Monday after a weekend
+            easter(year) - timedelta(2), # Good Friday
+            easter(year) + timedelta(1), # Easter Monday
+            _weekday(year, 5, 0, 1), # Early May bank holiday
+            _weekday(year, 5, 0, -1), # Spring bank holiday
+            _weekday(year, 8, 0, -1), # Summer bank holiday
+        ]
+        # Christmas and Boxing day, on the next weekdays after a weekend
+        holidays += {
+            4: [christmas, date(year, 12, 28)],
+            5: [date(year, 12, 27), date(year, 12, 28)],
+            6: [date(year, 12, 26), date(year, 12, 27)],
+        }.get(christmas.weekday(), [christmas, date(year, 12, 26)])
+    special = [
+        date(2011, 4, 29), # Royal wedding
+        date(2012, 6, 5), # Diamond Jubilee
+    ]
+    return [moved.get(day, day) for day in holidays] + [day for day in special if day.year in years]
+
+
+class TradingCalendar:
+    """
+    Class that holds the trading days of an exchange as a weekmask and a sorted array of holidays, which are known
+    between first and last (None for no limit)
+    """
+
+    def __init__(self, holidays=(), weekdays=(0, 1, 2, 3, 4), first=None, last=None):
+        self.holidays = np.unique(np.array(holidays, dtype='datetime64[D]'))
+        self.weekdays = tuple(weekdays)
+        self.weekmask = [day in self.weekdays for day in range(7)]
+        self.first = None if first is None else pd.Timestamp(first)
+        self.last = None if last is None else pd.Timestamp(last)
+
+    def is_trading_day(self, dates):
+        """
+        Function that checks for every date whether it is a trading day
+        Input:  dates - DatetimeIndex, series or array of dates
+        Output: numpy boolean array
+        """
+        days = np.asarray(pd.DatetimeIndex(dates).normalize().to_numpy(), dtype='datetime64[D]')
+        return np.is_busday(days, weekmask=self.weekmask, holidays=self.holidays)
+
+    def sessions(self, start, end):
+        """
+        Function that lists the trading days between two dates, both included
+        Input:  start, end - datetimes within the holidays known to the calendar
+        Output: DatetimeIndex named Date
+        """
+        if (self.first is not None and pd.Timestamp(start) < self.first) or (self.last is not None and pd.Timestamp(end) > self.last):
+            raise ValueError(f"Sessions from {start} to {end} are outside the holidays of the calendar, {self.first} to {self.last}")
+        days = pd.date_range(start, end, freq='D')
+        return pd.DatetimeIndex(days[self.is_trading_day(days)], name='Date')
+
+
+def _calendar(holidays):
+    return TradingCalendar(holidays, first=datetime(DATASET_YEARS[0], 1, 1), last=datetime(DATASET_YEARS[-1], 12, 31))
+
+CALENDARS = {
+    'US': _calendar(nyse_holidays()), # SP500, US30, US2000, NASDAQ and their constituents
+    'XETRA': _calendar(xetra_holidays()), # GER30
+    'EURONEXT': _calendar(euronext_holidays()), # CAC40
+    'LSE': _calendar(lse_holidays()), # UK100
+    'weekdays': TradingCalendar(),
+}
+
+# candles missing from the NIKKEI225 data, as in add_candles of Data Cleaning - Fill Missing Days
+NIKKEI225_CANDLES = [
+    # date, open, high, low, close, volume
+    (datetime(2010, 7, 28), 9614.74, 9760.31, 9614.74, 9753.27, 0),
+    (datetime(2010, 7, 29), 9653.51, 9732.76, 9648.97, 9696.02, 0),
+]
+
+def _dates(df):
+    return df['Date'] if 'Date' in df.columns else df.index
+
+@instrumented()
+def remove_holidays(df, holidays=US_HOLIDAYS, calendar=None):
+    """
+    Function that removes weekends and holidays from data
+    Input:  df - pandas dataframe with a Date column or a DatetimeIndex
+            holidays - list of datetimes, ignored if calendar is given
+            calendar - optional TradingCalendar
+    Output: dataframe with only the rows on trading days, in the original order
+    """
+    if calendar is None:
+        calendar = TradingCalendar(holidays)
+    return df[calendar.is_trading_day(_dates(df))]
+
+@instrumented()
+def fill_missing(df):
+    """
+    Function that fills missing values by interpolating over time, and backwards before the first value of a column
+    Input:  df - pandas dataframe with a Date column or a DatetimeIndex
+    Output: dataframe with the same layout
+    """
+    if 'Date' in df.columns:
+        return fill_missing(df.set_index('Date')).reset_index()
+    return df.interpolate(method='time').bfill()
+
+@instrumented(detail='how')
+def align(frames, calendar=CALENDARS['US'], start=None, end=None, how='filter', fill=True):
+    """
+    Function that combines instruments on the trading days of a calendar
+    Input:  frames - dict mapping varname to a dataframe with a Date column or a DatetimeIndex, or a single dataframe
+            calendar - TradingCalendar
+            start, end - optional datetimes to which the result is limited
+            how - 'filter' keeps the trading days on which any instrument has data (as remove_holidays in the notebooks),
+                  'reindex' uses every session of the calendar between the first and last date
+            fill - boolean to fill missing values as fill_missing
+    Output: dataframe with a Date column and the columns of all frames, sorted by date
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = {None: frames}
+    frames = [df.set_index('Date') if 'Date' in df.columns else df for df in frames.values()]
+    df = pd.concat(frames, axis=1, join='outer').sort_index().copy() # copy consolidates the blocks of the frames
+    if start is not None:
+        df = df[df.index >= start]
+    if end is not None:
+        df = df[df.index <= end]
+    if how == 'filter':
+        df = df[calendar.is_trading_day(df.index)]
+    elif how == 'reindex':
+        df = df.reindex(calendar.sessions(start or df.index[0], end or df.index[-1]))
+    else:
+        raise ValueError(f"Unknown alignment: {how}")
+    df.index.name = 'Date'
+    if fill:
+        df = fill_missing(df)
+    return df.reset_index()
+
+def add_candles(df, varname, candles=NIKKEI225_CANDLES):
+    """
+    Function that adds missing candles to data
+    Input:  df - pandas dataframe with a Date column or a DatetimeIndex and the varname_Close/Open/High/Low(/Volume) columns
+            varname - stock/index name (string) used in the column names
+            candles - list of (date, open, high, low, close, volume) tuples
+    Output: dataframe with the candles added, sorted by date
+    """
+    new = pd.DataFrame(candles, columns=['Date', varname + '_Open', varname + '_High', varname + '_Low', varname + '_Close', varname + '_Volume'])
+    if 'Date' not in df.columns:
+        new = new.set_index('Date')[[c for c in df.columns if c in new.columns]]
+        return pd.concat([df, new]).sort_index()
+    new = new[[c for c in df.columns if c in new.columns]]
+    return pd.concat([df, new], ignore_index=True).sort_values(by='Date').reset_index(drop=True)
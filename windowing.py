@@ -0,0 +1,117 @@
+"""
+Lookback windows for the modelling and Q-Learning notebooks
+
+create_classification_data in the notebooks builds every sample as a Python list of the previous lookback rows. Here the
+feature columns are copied once into a contiguous float32 array, and the (samples, lookback, features) tensor is a strided
+view on it, so the memory does not grow with the lookback:
+
+    windows = LookbackWindows(df, lookback=20)
+    x = windows.tensor()                               # view, x[s, i - 1] holds the features at t-i of sample s
+    for x_batch, y_batch in windows.batches(256):      # copies of a single batch, e.g. for model.fit
+        ...
+    df_class = create_classification_data(df, 3)       # the wide frame of the notebooks, when it is needed
+"""
+
+import numpy as np
+import pandas as pd
+
+class LookbackWindows:
+    """
+    Class that holds the lookback samples of a dataset
+
+    As in create_classification_data, sample s is the row t = lookback + 1 + s of the data: its target is the target
+    column at t and its features are all columns except Date at t-1, ..., t-lookback
+    """
+
+    def __init__(self, df, lookback, column=None, features=None, dtype=np.float32):
+        if features:
+            df = df[features]
+        self.lookback = lookback
+        self.column = column if column is not None else df.columns[1]
+        self.columns = [c for c in df.columns if c != 'Date']
+        self.dates = df['Date'].to_numpy()
+        self.values = np.ascontiguousarray(df[self.columns].to_numpy(dtype=dtype))
+        self.targets = df[self.column].to_numpy()
+        self.start = lookback + 1 # first row with a complete lookback, as in the notebooks
+
+    def __len__(self):
+        return max(len(self.values) - self.start, 0)
+
+    def tensor(self):
+        """
+        Function that returns the lookback windows of all samples without copying the data
+        Input:  None
+        Output: read-only numpy array (samples, lookback, features), [:, i - 1] holds the features at t-i
+        """
+        windows = np.lib.stride_tricks.sliding_window_view(self.values, self.lookback, axis=0) # (n - lookback + 1, features, lookback)
+        return windows[1:1 + len(self)].transpose(0, 2, 1)[:, ::-1, :]
+
+    def flat(self, rows=None):
+        """
+        Function that returns the samples as rows of the wide frame of create_classification_data
+        Input:  rows - optional array of sample indices or boolean mask, all samples by default
+        Output: numpy array (samples, lookback * features) in the order of column_names(), a copy
+        """
+        x = self.tensor() if rows is None else self.tensor()[rows]
+        return x.reshape(len(x), -1)
+
+    def target(self):
+        return self.targets[self.start:]
+
+    def target_dates(self):
+        return self.dates[self.start:]
+
+    def column_names(self):
+        """
+        Function that generates the names of the flattened features lazily, e.g. SP500_RSI_14_t-3
+        Input:  None
+        Output: generator of strings, lag by lag
+        """
+        for i in range(1, self.lookback + 1):
+            for column in self.columns:
+                yield column + "_t-" + str(i)
+
+    def batches(self, batch_size, rows=None, flatten=False, repeat=False):
+        """
+        Function that streams the samples in batches, which are the only copies of the data that are made
+        Input:  batch_size - number of samples per batch (integer)
+                rows - optional array of sample indices or boolean mask (e.g. a year), all samples by default
+                flatten - boolean to return (batch, lookback * features) instead of (batch, lookback, features)
+                repeat - boolean to start over after the last batch, as Keras expects of a generator over several epochs
+        Output: generator of (x, y) tuples of numpy arrays
+        """
+        rows = np.arange(len(self)) if rows is None else np.arange(len(self))[rows]
+        tensor = self.tensor()
+        targets = self.target()
+        while True:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                x = tensor[batch]
+                yield (x.reshape(len(batch), -1) if flatten else x), targets[batch]
+            if not repeat:
+                return
+
+    def steps(self, batch_size, rows=None):
+        n = len(self) if rows is None else len(np.arange(len(self))[rows])
+        return -(-n // batch_size)
+
+    def frame(self):
+        """
+        Function that materializes the wide frame of create_classification_data
+        Input:  None
+        Output: pandas dataframe with Date, the target column and the features at t-1, ..., t-lookback
+        """
+        features = pd.DataFrame(self.flat(), columns=list(self.column_names()))
+        head = pd.DataFrame({'Date': self.target_dates(), self.column: self.target()})
+        return pd.concat([head, features], axis=1)
+
+def create_classification_data(df, lookback, column=None, features=None):
+    """
+    Function that creates the lookback data of the notebooks
+    Input:  df - pandas dataframe with a Date column
+            lookback - number of previous days to add as features (integer)
+            column - target column (string), defaults to the column after Date
+            features - optional list of columns to select first, including Date and the target
+    Output: pandas dataframe with Date, the target column and all other columns at t-1, ..., t-lookback
+    """
+    return LookbackWindows(df, lookback, column, features, dtype=np.float64).frame()